@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
+import json
 import os
 import textwrap
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
+from .attachments import MultipartFileBody
+from .errors import APIError, CircuitOpenError
+from .metrics import RequestMetrics
+from .throttling import (
+    CIRCUIT_OPEN,
+    POST_RETRY_STATUS_CODES,
+    RETRY_STATUS_CODES,
+    RetryPolicy,
+)
 
-class APIError(Exception):
-    pass
+DEFAULT_POOL_SIZE = 10
+# Seconds to connect and to wait for data, a hung Testrail must not stall the run.
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
 
 
 class APIClient:
@@ -16,7 +35,40 @@ class APIClient:
     with additional abstractions for certain operations.
     """
 
-    def __init__(self, base_url):
+    # Maximum number of items Testrail returns in one page of a paginated endpoint.
+    MAX_PAGE_LIMIT = 250
+
+    def __init__(
+        self,
+        base_url,
+        page_limit=MAX_PAGE_LIMIT,
+        page_workers=1,
+        retry_policy=None,
+        rate_limiter=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        keep_alive=True,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        gzip_threshold=None,
+        circuit_breaker=None,
+    ):
+        self.page_limit = page_limit
+        self.page_workers = page_workers
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        # A missing timeout gets its default, requests would never time out.
+        self.timeout = (
+            DEFAULT_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            DEFAULT_READ_TIMEOUT if read_timeout is None else read_timeout,
+        )
+        self.gzip_threshold = gzip_threshold
+        self.circuit_breaker = circuit_breaker
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.gzip_bytes_before = 0
+        self.gzip_bytes_after = 0
+        self.metrics = RequestMetrics()
+        self._counters_lock = threading.Lock()
         self.user = os.environ.get(u"TESTRAIL_USER")
         self.password = os.environ.get(u"TESTRAIL_KEY")
 
@@ -26,6 +78,11 @@ class APIClient:
         self.session = requests.Session()
         self.session.auth = (self.user, self.password)
         self.session.headers.update({u"Content-Type": u"application/json"})
+        if not keep_alive:
+            self.session.headers.update({u"Connection": u"close"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount(u"https://", adapter)
+        self.session.mount(u"http://", adapter)
 
         if not self.user or not self.password:
             raise ValueError(
@@ -37,9 +94,147 @@ class APIClient:
     def _build_endpoint_from_uri(self, uri):
         return u"{base_url}{uri}".format(base_url=self.url, uri=uri)
 
-    def send_get(self, uri):
+    def _add_throttled_time(self, seconds, retry=False):
+        with self._counters_lock:
+            self.throttled_seconds += seconds
+            if retry:
+                self.retries += 1
+
+    def _build_post_body(self, data):
+        """
+        Returns the arguments to send data as the JSON body of a POST request,
+        compressing it with gzip when it is bigger than gzip_threshold bytes.
+        Files are streamed as they are.
+        """
+        if isinstance(data, MultipartFileBody):
+            return {u"data": data, u"headers": {u"Content-Type": data.content_type}}
+
+        if self.gzip_threshold is None:
+            return {u"json": data}
+
+        body = json.dumps(data).encode(u"utf-8")
+        if len(body) < self.gzip_threshold:
+            return {u"data": body}
+
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed_body = compressor.compress(body) + compressor.flush()
+        with self._counters_lock:
+            self.gzip_bytes_before += len(body)
+            self.gzip_bytes_after += len(compressed_body)
+
+        return {u"data": compressed_body, u"headers": {u"Content-Encoding": u"gzip"}}
+
+    def _send_request(self, method, uri, data=None):
+        """
+        Sends the request, retrying connection errors and the responses with a status
+        in RETRY_STATUS_CODES as allowed by the retry policy.
+        Returns the last response received.
+
+        POST requests are not idempotent, a retry could add the results or the run twice.
+        They are only retried when the connection could not be established or the
+        status is in POST_RETRY_STATUS_CODES.
+
+        With a circuit breaker the connection errors and the 5xx responses are counted
+        as failures, and no request is sent while the circuit is open.
+        """
         endpoint = self._build_endpoint_from_uri(uri)
-        response = self.session.get(endpoint)
+        request_kwargs = {u"timeout": self.timeout}
+        if method == u"POST":
+            request_kwargs.update(self._build_post_body(data))
+
+        retry_status_codes = RETRY_STATUS_CODES
+        if method == u"POST":
+            retry_status_codes = POST_RETRY_STATUS_CODES
+
+        attempt = 0
+        while True:
+            if self.circuit_breaker and not self.circuit_breaker.allow_request():
+                self._raise_circuit_open(method, uri)
+            if self.rate_limiter:
+                self._add_throttled_time(self.rate_limiter.acquire())
+
+            started_at = time.time()
+            try:
+                if method == u"POST":
+                    response = self.session.post(endpoint, **request_kwargs)
+                else:
+                    response = self.session.get(endpoint, **request_kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self.metrics.record_request(uri, time.time() - started_at)
+                self._record_outcome(failed=True)
+                if not self.retry_policy.can_retry(
+                    attempt
+                ) or not self._can_resend_after(method, error):
+                    self.metrics.record_error(uri)
+                    raise APIError(
+                        u"Error ({error}) during {method} to endpoint: ({endpoint})".format(
+                            error=error, method=method, endpoint=uri
+                        )
+                    )
+                delay = self.retry_policy.get_delay(attempt)
+            else:
+                self.metrics.record_request(
+                    uri,
+                    time.time() - started_at,
+                    bytes_sent=self._get_body_size(getattr(response, u"request", None)),
+                    bytes_received=self._get_body_size(response, u"content"),
+                )
+                self._record_outcome(failed=response.status_code >= 500)
+                if (
+                    response.status_code not in retry_status_codes
+                    or not self.retry_policy.can_retry(attempt)
+                ):
+                    if response.status_code >= 400:
+                        self.metrics.record_error(uri)
+                    return response
+                delay = self.retry_policy.get_delay(
+                    attempt, response.headers.get(u"Retry-After")
+                )
+
+            if self.circuit_breaker and self.circuit_breaker.state == CIRCUIT_OPEN:
+                # The retry would be rejected, there is no point in waiting for it.
+                self._raise_circuit_open(method, uri)
+            attempt += 1
+            self.metrics.record_retry(uri)
+            self._add_throttled_time(delay, retry=True)
+            time.sleep(delay)
+
+    def _can_resend_after(self, method, error):
+        """
+        Returns True when the request can be sent again after the error, POST requests
+        only when they did not reach Testrail.
+        """
+        if method != u"POST" or isinstance(error, requests.ConnectTimeout):
+            return True
+        if isinstance(error, requests.Timeout):
+            # The read timed out, Testrail may have processed the request.
+            return False
+        reason = getattr(error.args[0], u"reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _raise_circuit_open(self, method, uri):
+        raise CircuitOpenError(
+            u"Circuit breaker open, {method} to endpoint ({endpoint}) not sent".format(
+                method=method, endpoint=uri
+            )
+        )
+
+    def _record_outcome(self, failed):
+        if not self.circuit_breaker:
+            return
+        if failed:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def _get_body_size(self, message, attribute=u"body"):
+        body = getattr(message, attribute, None)
+        if isinstance(body, (bytes, type(u""), MultipartFileBody)):
+            return len(body)
+        return 0
+
+    def send_get(self, uri):
+        response = self._send_request(u"GET", uri)
         try:
             response.raise_for_status()
         except requests.HTTPError as e:
@@ -56,13 +251,12 @@ class APIClient:
             error_message = error_template.format(
                 error=exception_message, endpoint=uri, response_content=response.content
             )
-            raise APIError(error_message)
+            raise APIError(error_message, status_code=response.status_code)
         else:
             return response.json()
 
     def send_post(self, uri, data):
-        endpoint = self._build_endpoint_from_uri(uri)
-        response = self.session.post(endpoint, json=data)
+        response = self._send_request(u"POST", uri, data=data)
         try:
             response.raise_for_status()
         except requests.HTTPError as e:
@@ -84,71 +278,254 @@ class APIClient:
                 response_content=response.content,
             )
 
-            raise APIError(error_message)
+            raise APIError(error_message, status_code=response.status_code)
         else:
             return response.json()
 
-    def create_run(self, project_id, suite_id, test_run_name):
+    def create_run(self, project_id, suite_id, test_run_name, case_ids=None):
+        """
+        Creates a test run with all the cases of the suite, or only with case_ids.
+        """
         uri_create_test_run = u"add_run/{}".format(project_id)
         post_data = {
             u"suite_id": suite_id,
             u"name": test_run_name,
             u"include_all": True,
         }
+        if case_ids is not None:
+            post_data[u"include_all"] = False
+            post_data[u"case_ids"] = list(case_ids)
 
         return self.send_post(uri=uri_create_test_run, data=post_data)
 
-    def get_test_run_by_project_and_name(self, project_id, test_run_name):
-        test_runs = self.get_test_runs(project_id)
+    def update_run(self, run_id, case_ids):
+        """
+        Replaces the cases of a test run created without include_all by case_ids.
+        """
+        uri_update_test_run = u"update_run/{}".format(run_id)
+        post_data = {u"include_all": False, u"case_ids": list(case_ids)}
+
+        return self.send_post(uri=uri_update_test_run, data=post_data)
 
-        for test_run in test_runs:
+    def get_run(self, run_id):
+        return self.send_get(uri=u"get_run/{}".format(run_id))
+
+    def get_test_run_by_project_and_name(self, project_id, test_run_name):
+        """
+        Returns the first incomplete test run with test_run_name, pages of runs are only
+        requested until it is found.
+        """
+        for test_run in self.iter_runs(project_id):
             if test_run[u"name"] == test_run_name:
                 return test_run
         return None
 
-    def _build_incomplete_test_runs_endpoint(self, project_id, offset):
-        return u"get_runs/{project_id}&is_completed=0&offset={offset}".format(
-            project_id=project_id, offset=offset
+    def _build_incomplete_test_runs_endpoint(self, project_id, offset=0):
+        uri_template = (
+            u"get_runs/{project_id}&is_completed=0&limit={limit}&offset={offset}"
         )
+        return uri_template.format(
+            project_id=project_id, limit=self.page_limit, offset=offset
+        )
+
+    def _iter_pages(self, build_uri, items_key, concurrent=False):
+        """
+        Yields the items of a paginated Testrail endpoint, requesting one page at a time
+        until the response has no `_links.next`.
+        With concurrent=True and more than one page worker, the following pages are
+        requested in parallel once the first response tells the page size.
+        """
+        offset = 0
+        while True:
+            api_response = self.send_get(uri=build_uri(offset))
+
+            for item in api_response[items_key]:
+                yield item
+
+            if not api_response[u"_links"][u"next"]:
+                return
+            limit = api_response[u"limit"]
+            offset += limit
 
-    def get_test_runs(self, project_id, fetched_test_runs=[], offset=0):
-        uri_get_project_test_runs = self._build_incomplete_test_runs_endpoint(
-            project_id, offset
+            if concurrent and self.page_workers > 1:
+                for item in self._iter_pages_concurrently(
+                    build_uri, items_key, offset, limit
+                ):
+                    yield item
+                return
+
+    def _iter_pages_concurrently(self, build_uri, items_key, offset, limit):
+        """
+        Requests windows of `page_workers` pages at the same time and yields their items
+        in order, stopping at the first short or last page.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.page_workers)
+        try:
+            while True:
+                window = [offset + limit * index for index in range(self.page_workers)]
+                api_responses = executor.map(
+                    lambda page_offset: self.send_get(uri=build_uri(page_offset)),
+                    window,
+                )
+                for api_response in api_responses:
+                    items = api_response[items_key]
+                    for item in items:
+                        yield item
+
+                    if len(items) < limit or not api_response[u"_links"][u"next"]:
+                        return
+                offset += limit * self.page_workers
+        finally:
+            executor.shutdown(wait=True)
+
+    def iter_runs(self, project_id):
+        return self._iter_pages(
+            partial(self._build_incomplete_test_runs_endpoint, project_id), u"runs"
         )
 
-        api_response = self.send_get(uri=uri_get_project_test_runs)
+    def get_test_runs(self, project_id):
+        return list(self.iter_runs(project_id))
+
+    def create_plan(self, project_id, test_plan_name, entries):
+        """
+        Creates a test plan with all its entries, and their test runs, in one request.
+        """
+        uri_add_test_plan = u"add_plan/{}".format(project_id)
+        post_data = {u"name": test_plan_name, u"entries": list(entries)}
 
-        test_runs = fetched_test_runs + api_response["runs"]
+        return self.send_post(uri=uri_add_test_plan, data=post_data)
 
-        if api_response["_links"]["next"]:
-            next_offset = offset + api_response["limit"]
-            test_runs = self.get_test_runs(
-                project_id, fetched_test_runs=test_runs, offset=next_offset
+    def add_plan_entry(self, plan_id, entry):
+        """
+        Adds an entry to a test plan, with one test run for each of its configurations.
+        """
+        uri_add_plan_entry = u"add_plan_entry/{}".format(plan_id)
+
+        return self.send_post(uri=uri_add_plan_entry, data=entry)
+
+    def update_plan_run(self, test_run, case_ids):
+        """
+        Replaces the cases of a test run of a test plan by case_ids. The runs of entries
+        with configurations are updated one by one, the other entries hold one run.
+        """
+        post_data = {u"include_all": False, u"case_ids": list(case_ids)}
+        if test_run.get(u"config_ids"):
+            uri_update_plan_run = u"update_run_in_plan_entry/{}".format(test_run[u"id"])
+        else:
+            uri_update_plan_run = u"update_plan_entry/{plan}/{entry}".format(
+                plan=test_run[u"plan_id"], entry=test_run[u"entry_id"]
             )
 
-        return test_runs
+        return self.send_post(uri=uri_update_plan_run, data=post_data)
+
+    def get_plan(self, plan_id):
+        return self.send_get(uri=u"get_plan/{}".format(plan_id))
 
-    def _build_get_cases_endpoint(self, project_id, suite_id, offset=0):
-        return u"get_cases/{project}&suite_id={suite}&offset={offset}".format(
-            project=project_id, suite=suite_id, offset=offset
+    def get_test_plan_by_project_and_name(self, project_id, test_plan_name):
+        """
+        Returns the first incomplete test plan with test_plan_name, with its entries.
+        """
+        for test_plan in self.iter_plans(project_id):
+            if test_plan[u"name"] == test_plan_name:
+                # The plans listed do not include their entries.
+                return self.get_plan(test_plan[u"id"])
+        return None
+
+    def _build_incomplete_test_plans_endpoint(self, project_id, offset=0):
+        uri_template = (
+            u"get_plans/{project_id}&is_completed=0&limit={limit}&offset={offset}"
+        )
+        return uri_template.format(
+            project_id=project_id, limit=self.page_limit, offset=offset
+        )
+
+    def iter_plans(self, project_id):
+        return self._iter_pages(
+            partial(self._build_incomplete_test_plans_endpoint, project_id), u"plans"
         )
 
-    def get_cases(self, project_id, suite_id, fetched_cases=[], offset=0):
-        """This will recursively fetch cases from Testrail API until there are no more pages to fetch."""
-        uri_get_project_cases = self._build_get_cases_endpoint(
-            project_id, suite_id, offset=offset
+    def _build_get_cases_endpoint(
+        self, project_id, suite_id, offset=0, updated_after=None
+    ):
+        uri_template = (
+            u"get_cases/{project}&suite_id={suite}&limit={limit}&offset={offset}"
+        )
+        uri = uri_template.format(
+            project=project_id, suite=suite_id, limit=self.page_limit, offset=offset
         )
-        api_response = self.send_get(uri=uri_get_project_cases)
+        if updated_after is not None:
+            uri += u"&updated_after={}".format(int(updated_after))
+        return uri
 
-        cases = fetched_cases + api_response["cases"]
+    def iter_cases(self, project_id, suite_id, updated_after=None):
+        return self._iter_pages(
+            partial(
+                self._build_get_cases_endpoint,
+                project_id,
+                suite_id,
+                updated_after=updated_after,
+            ),
+            u"cases",
+            concurrent=True,
+        )
 
-        if api_response["_links"]["next"]:
-            next_offset = offset + api_response["limit"]
-            cases = self.get_cases(
-                project_id, suite_id, fetched_cases=cases, offset=next_offset
-            )
+    def get_cases(self, project_id, suite_id, updated_after=None):
+        return list(self.iter_cases(project_id, suite_id, updated_after=updated_after))
 
-        return cases
+    def get_case(self, case_id):
+        return self.send_get(uri=u"get_case/{}".format(case_id))
+
+    def iter_cases_by_id(self, case_ids, workers=1):
+        """
+        Yields the cases with case_ids, requesting up to `workers` cases at the same
+        time. The ids Testrail does not know are skipped.
+        """
+
+        def get_case_or_none(case_id):
+            try:
+                return self.get_case(case_id)
+            except APIError as error:
+                if error.status_code == 400:
+                    return None
+                raise
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            for case in executor.map(get_case_or_none, case_ids):
+                if case is not None:
+                    yield case
+        finally:
+            executor.shutdown(wait=True)
+
+    def _build_get_results_for_run_endpoint(
+        self, run_id, offset=0, created_after=None
+    ):
+        uri = u"get_results_for_run/{run}&limit={limit}&offset={offset}".format(
+            run=run_id, limit=self.page_limit, offset=offset
+        )
+        if created_after is not None:
+            uri += u"&created_after={}".format(int(created_after))
+        return uri
+
+    def iter_results_for_run(self, run_id, created_after=None):
+        return self._iter_pages(
+            partial(
+                self._build_get_results_for_run_endpoint,
+                run_id,
+                created_after=created_after,
+            ),
+            u"results",
+        )
+
+    def _build_get_tests_endpoint(self, run_id, offset=0):
+        return u"get_tests/{run}&limit={limit}&offset={offset}".format(
+            run=run_id, limit=self.page_limit, offset=offset
+        )
+
+    def iter_tests(self, run_id):
+        return self._iter_pages(
+            partial(self._build_get_tests_endpoint, run_id), u"tests"
+        )
 
     def create_result(self, run_id, case_id, status, comment, elapsed, version=None):
         uri_add_test_result = u"add_result_for_case/{run}/{test_case}".format(
@@ -162,3 +539,21 @@ class APIClient:
         }
 
         return self.send_post(uri=uri_add_test_result, data=post_data)
+
+    def add_attachment_to_result(self, result_id, path):
+        """
+        Uploads the file at path to the result, reading it from disk while it is sent.
+        """
+        uri_add_attachment = u"add_attachment_to_result/{}".format(result_id)
+
+        return self.send_post(uri=uri_add_attachment, data=MultipartFileBody(path))
+
+    def create_results(self, run_id, results):
+        """
+        Adds several test results to a run with a single request.
+        Each item of results must contain the `case_id` the result belongs to.
+        """
+        uri_add_test_results = u"add_results_for_cases/{run}".format(run=run_id)
+        post_data = {u"results": results}
+
+        return self.send_post(uri=uri_add_test_results, data=post_data)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Coroutine interface of the Testrail API, it needs python 3.5 or newer and is only
+imported when the `async_api` option is configured.
+"""
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_CONCURRENCY = 20
+
+
+class AsyncAPIClient(object):
+    """
+    Exposes the operations of an APIClient as coroutines, running at most
+    `concurrency` requests at the same time.
+
+    The requests are sent by the wrapped client on its connection pool, so retries,
+    rate limiting and compression behave exactly as in synchronous mode.
+    """
+
+    def __init__(self, client, concurrency=DEFAULT_CONCURRENCY):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore = None
+
+    async def run(self, function, *args, **kwargs):
+        # Created on first use so the semaphore belongs to the loop running the client.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(function, *args, **kwargs)
+            )
+
+    async def create_run(self, project_id, suite_id, test_run_name, case_ids=None):
+        return await self.run(
+            self.client.create_run,
+            project_id,
+            suite_id,
+            test_run_name,
+            case_ids=case_ids,
+        )
+
+    async def update_run(self, run_id, case_ids):
+        return await self.run(self.client.update_run, run_id, case_ids)
+
+    async def get_run(self, run_id):
+        return await self.run(self.client.get_run, run_id)
+
+    async def get_test_run_by_project_and_name(self, project_id, test_run_name):
+        return await self.run(
+            self.client.get_test_run_by_project_and_name, project_id, test_run_name
+        )
+
+    async def get_test_runs(self, project_id):
+        return await self.run(self.client.get_test_runs, project_id)
+
+    async def get_cases(self, project_id, suite_id, updated_after=None):
+        return await self.run(
+            self.client.get_cases, project_id, suite_id, updated_after=updated_after
+        )
+
+    async def create_result(
+        self, run_id, case_id, status, comment, elapsed, version=None
+    ):
+        return await self.run(
+            self.client.create_result,
+            run_id,
+            case_id,
+            status,
+            comment,
+            elapsed,
+            version=version,
+        )
+
+    async def create_results(self, run_id, results):
+        return await self.run(self.client.create_results, run_id, results)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class EventLoopThread(object):
+    """
+    Event loop running forever in a daemon thread, so synchronous code like the Behave
+    reporter can schedule coroutines on it.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=u"testrail-event-loop")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """
+        Schedules the coroutine on the loop and returns a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        return self.submit(coroutine).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class AsyncResultSender(object):
+    """
+    Sends the result batches of a TestrailReporter with an AsyncAPIClient driven from
+    an EventLoopThread.
+
+    Behave goes on while the batches are sent. All the batches, of the same project
+    too, are sent concurrently up to the concurrency of the client.
+    """
+
+    def __init__(self, reporter, client, loop_thread):
+        self.reporter = reporter
+        self.client = client
+        self.loop_thread = loop_thread
+        self.errors = []
+        self._futures = []
+        self._futures_lock = threading.Lock()
+
+    def submit(self, project, batches):
+        future = self.loop_thread.submit(self._send_project(project, batches))
+        with self._futures_lock:
+            self._futures.append(future)
+
+    async def _send_project(self, project, batches):
+        # The test run is set up once under the lock of the project, by the first
+        # batch reaching it.
+        outcomes = await asyncio.gather(
+            *[self._send(project, results) for results in batches],
+            return_exceptions=True
+        )
+        self.errors.extend(
+            outcome for outcome in outcomes if isinstance(outcome, Exception)
+        )
+
+    async def _send(self, project, results):
+        # The batch goes through the same path as in synchronous mode, only on the
+        # executor of the client.
+        await self.client.run(self.reporter._send_results, project, results)
+
+    def wait(self, timeout=None):
+        """
+        Waits up to timeout seconds for the submitted batches to be sent.
+        Returns the number of submissions that did not finish in time.
+        """
+        with self._futures_lock:
+            futures, self._futures = self._futures, []
+
+        _, not_done = wait(futures, timeout=timeout)
+        with self._futures_lock:
+            self._futures.extend(not_done)
+        return len(not_done)
+
+    def close(self, timeout=None):
+        pending = self.wait(timeout=timeout)
+        self.loop_thread.stop()
+        # The requests still running after a timeout are left to the daemon threads.
+        self.client.close(wait=not pending)
+        return pending
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import collections
+import mimetypes
+import os
+import threading
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_ATTACHMENT_WORKERS = 2
+# Testrail does not accept bigger attachments.
+DEFAULT_ATTACHMENT_MAX_SIZE = 256 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Field of a queued result holding the paths of its attachments, never sent.
+ATTACHMENTS_FIELD = u"_attachments"
+
+
+class MultipartFileBody(object):
+    """
+    multipart/form-data body with the file at path as its `attachment` field.
+
+    The file is read in chunks of `chunk_size` bytes while the body is sent and every
+    iteration reads it again, so a retried request sends the whole file again.
+    The length is known upfront, requests sends it as the Content-Length.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        boundary = uuid.uuid4().hex
+        self.content_type = u"multipart/form-data; boundary={}".format(boundary)
+        file_name = os.path.basename(path).replace(u'"', u"%22")
+        self._head = (
+            u"--{boundary}\r\n"
+            u'Content-Disposition: form-data; name="attachment"; filename="{name}"\r\n'
+            u"Content-Type: {content_type}\r\n\r\n".format(
+                boundary=boundary,
+                name=file_name,
+                content_type=mimetypes.guess_type(path)[0]
+                or u"application/octet-stream",
+            )
+        ).encode(u"utf-8")
+        self._tail = u"\r\n--{}--\r\n".format(boundary).encode(u"utf-8")
+        self.file_size = os.path.getsize(path)
+
+    def __len__(self):
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        with open(self.path, u"rb") as stream:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        yield self._tail
+
+    def __repr__(self):
+        return u"<attachment {}>".format(self.path)
+
+
+class AttachmentUploader(object):
+    """
+    Uploads the attachments of the results sent to Testrail from `workers` threads.
+
+    Files bigger than `max_size` bytes are skipped, and so are the files that would
+    take the attachments of a test run over `run_budget` bytes.
+    """
+
+    def __init__(
+        self,
+        client,
+        workers=DEFAULT_ATTACHMENT_WORKERS,
+        max_size=DEFAULT_ATTACHMENT_MAX_SIZE,
+        run_budget=None,
+    ):
+        self.client = client
+        self.max_size = max_size
+        self.run_budget = run_budget
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.skipped = 0
+        self.errors = []
+        self._run_bytes = collections.Counter()
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def upload(self, run_id, result_id, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError as error:
+            with self._lock:
+                self.errors.append(error)
+            return
+
+        with self._lock:
+            if size > self.max_size or (
+                self.run_budget is not None
+                and self._run_bytes[run_id] + size > self.run_budget
+            ):
+                self.skipped += 1
+                return
+            # The bytes are taken from the budget before the upload starts.
+            self._run_bytes[run_id] += size
+            self._futures.append(
+                self._executor.submit(self._upload, result_id, path, size)
+            )
+
+    def _upload(self, result_id, path, size):
+        try:
+            self.client.add_attachment_to_result(result_id, path)
+        except Exception as error:
+            with self._lock:
+                self.errors.append(error)
+        else:
+            with self._lock:
+                self.uploaded += 1
+                self.uploaded_bytes += size
+
+    def close(self, timeout=None):
+        """
+        Waits up to timeout seconds for the uploads to finish.
+        Returns the number of uploads that did not finish in time.
+        """
+        with self._lock:
+            futures = list(self._futures)
+
+        _, not_done = wait(futures, timeout=timeout)
+        # The uploads still running after a timeout are left behind.
+        self._executor.shutdown(wait=not not_done)
+        return len(not_done)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .coordination import FileLock, write_file_atomically
+
+DEFAULT_CACHE_DIRECTORY = u".testrail_cache"
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+DEFAULT_CACHE_MAX_SIZE = 100 * 1024 * 1024
+DEFAULT_RUN_REGISTRY_PATH = os.path.join(DEFAULT_CACHE_DIRECTORY, u"runs.json")
+# The cache directory is shared with the run registry and the spool, only the files with
+# this prefix belong to the case cache.
+CASE_FILE_PREFIX = u"cases-"
+
+
+class CaseCache(object):
+    """
+    Stores the test cases of a Testrail suite on disk so the next Behave executions only
+    have to request the cases updated since they were cached.
+
+    Each suite is stored in its own file keyed by (base_url, project_id, suite_id), only
+    the id and the update time of the cases are kept. A cached suite older than `ttl`
+    seconds is downloaded again in full, and the least recently used files are removed
+    when the cache grows over `max_size` bytes. The suite just written is never removed.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIRECTORY,
+        ttl=DEFAULT_CACHE_TTL,
+        max_size=DEFAULT_CACHE_MAX_SIZE,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.refreshed_cases = 0
+        self.refresh_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _get_path(self, base_url, project_id, suite_id):
+        key = json.dumps([base_url, project_id, suite_id])
+        file_name = (
+            CASE_FILE_PREFIX + hashlib.sha1(key.encode(u"utf-8")).hexdigest() + u".json"
+        )
+        return os.path.join(self.directory, file_name)
+
+    def _read(self, path):
+        try:
+            with open(path, u"r") as stream:
+                entry = json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if time.time() - entry.get(u"created_on", 0) > self.ttl:
+            return None
+        # Touch the file so eviction removes the least recently used suites first.
+        os.utime(path, None)
+        return entry
+
+    def _write(self, path, entry):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        write_file_atomically(path, json.dumps(entry))
+        self._evict(path)
+
+    def _is_cache_file(self, file_name):
+        return file_name.startswith(CASE_FILE_PREFIX) and file_name.endswith(u".json")
+
+    def _evict(self, written_path):
+        cache_files = []
+        total_size = 0
+        for file_name in os.listdir(self.directory):
+            if not self._is_cache_file(file_name):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total_size += stat.st_size
+            if path != written_path:
+                cache_files.append((stat.st_mtime, stat.st_size, path))
+
+        for _, size, path in sorted(cache_files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another worker.
+                pass
+            total_size -= size
+
+    def _get_last_updated_on(self, cases):
+        return max([case.get(u"updated_on") or 0 for case in cases.values()] or [0])
+
+    def get_cases(self, client, project_id, suite_id):
+        """
+        Returns the cases of the suite indexed by their string id, downloading the whole
+        suite on a cache miss or only the cases updated since the last refresh on a hit.
+        """
+        path = self._get_path(client.url, project_id, suite_id)
+        entry = self._read(path)
+        started_at = time.time()
+
+        if entry is None:
+            with self._stats_lock:
+                self.misses += 1
+            cases = client.iter_cases(project_id, suite_id)
+            entry = {u"created_on": started_at, u"cases": {}}
+        else:
+            with self._stats_lock:
+                self.hits += 1
+            # updated_after is exclusive, asking one second earlier covers the cases
+            # updated in the same second as the last cached one.
+            updated_after = max(0, self._get_last_updated_on(entry[u"cases"]) - 1)
+            cases = client.iter_cases(project_id, suite_id, updated_after=updated_after)
+
+        refreshed_cases = 0
+        for case in cases:
+            entry[u"cases"][str(case[u"id"])] = {
+                u"id": case[u"id"],
+                u"updated_on": case.get(u"updated_on"),
+            }
+            refreshed_cases += 1
+
+        with self._stats_lock:
+            self.refreshed_cases += refreshed_cases
+            self.refresh_seconds += time.time() - started_at
+        self._write(path, entry)
+
+        return entry[u"cases"]
+
+
+class RunRegistry(object):
+    """
+    Remembers on disk the id of the test run used for each
+    (base_url, project_id, suite_id, test run name), so following executions can check
+    the run with one request instead of searching the incomplete runs of the project.
+    """
+
+    def __init__(self, path=DEFAULT_RUN_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _get_key(self, base_url, project_id, suite_id, test_run_name):
+        return json.dumps([base_url, project_id, suite_id, test_run_name])
+
+    def _read(self):
+        try:
+            with open(self.path, u"r") as stream:
+                return json.load(stream)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, base_url, project_id, suite_id, test_run_name):
+        with self._lock:
+            runs = self._read()
+        return runs.get(self._get_key(base_url, project_id, suite_id, test_run_name))
+
+    def set(self, base_url, project_id, suite_id, test_run_name, run_id):
+        # The file lock keeps the runs registered by other processes at the same time.
+        with self._lock, FileLock(self.path + u".lock"):
+            runs = self._read()
+            runs[self._get_key(base_url, project_id, suite_id, test_run_name)] = run_id
+            write_file_atomically(self.path, json.dumps(runs))
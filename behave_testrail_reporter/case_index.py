@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import array
+import bisect
+
+
+class CaseIndex(object):
+    """
+    Case ids of a suite kept as a sorted array of integers instead of the full cases,
+    8 bytes per case on 64 bits Linux and macOS. Lookups are a binary search.
+
+    It supports the parts of the cases dict the reporter uses: `in`, `len` and the
+    iteration over the string ids.
+    """
+
+    __slots__ = ("case_ids",)
+
+    def __init__(self, case_ids=()):
+        self.case_ids = array.array(
+            "l", sorted(set(int(case_id) for case_id in case_ids))
+        )
+
+    def __len__(self):
+        return len(self.case_ids)
+
+    def __contains__(self, case_id):
+        try:
+            case_id = int(case_id)
+        except (TypeError, ValueError):
+            return False
+        index = bisect.bisect_left(self.case_ids, case_id)
+        return index < len(self.case_ids) and self.case_ids[index] == case_id
+
+    def __iter__(self):
+        for case_id in self.case_ids:
+            yield str(case_id)
+
+
+class UnavailableCases(object):
+    """
+    Cases of a suite that could not be loaded because Testrail was unavailable.
+
+    Any case may be in the suite, so every result is kept for it. The results of cases
+    that are not in the suite are rejected by Testrail once it is available again.
+    """
+
+    __slots__ = ()
+
+    def __len__(self):
+        return 0
+
+    def __contains__(self, case_id):
+        # Tags that are not case ids are still ignored, as when the cases are loaded.
+        try:
+            int(case_id)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(())
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import collections
+import itertools
+
+VERBOSITY_FULL = u"full"
+VERBOSITY_FAILURES = u"failures"
+VERBOSITY_SUMMARY = u"summary"
+
+TRUNCATION_MARKER = u"\n[truncated]"
+
+
+def get_status_name(status):
+    # Behave statuses are enums, but steps copied by older versions hold strings.
+    return getattr(status, u"name", status)
+
+
+class CommentPolicy(object):
+    """
+    Builds the comment of a scenario result:
+
+    - full: the scenario name and every step with its status.
+    - failures: the steps that did not pass, only for the scenarios that did not pass.
+    - summary: the scenario name and the number of steps by status.
+
+    At most `max_steps` steps are listed and the comment is cut at `max_size`
+    characters, the steps past those limits are never formatted.
+    """
+
+    def __init__(self, verbosity=VERBOSITY_FULL, max_steps=None, max_size=None):
+        self.verbosity = verbosity
+        self.max_steps = max_steps
+        self.max_size = max_size
+
+    def build(self, scenario):
+        if self.verbosity == VERBOSITY_SUMMARY:
+            lines = [scenario.name, self._format_step_counts(scenario.steps)]
+        elif (
+            self.verbosity == VERBOSITY_FAILURES
+            and get_status_name(scenario.status) == u"passed"
+        ):
+            lines = [scenario.name]
+        else:
+            lines = itertools.chain(
+                [scenario.name], self._iter_step_lines(scenario.steps)
+            )
+        return self.join(lines)
+
+    def _format_step_counts(self, steps):
+        counts = collections.Counter(get_status_name(step.status) for step in steps)
+        return u"{} steps: {}".format(
+            len(steps),
+            u", ".join(
+                u"{} {}".format(count, status)
+                for status, count in sorted(counts.items())
+            ),
+        )
+
+    def _iter_step_lines(self, steps):
+        if self.verbosity == VERBOSITY_FAILURES:
+            steps = [
+                step for step in steps if get_status_name(step.status) != u"passed"
+            ]
+
+        for index, step in enumerate(steps):
+            if self.max_steps is not None and index >= self.max_steps:
+                yield u"... {} more steps".format(len(steps) - index)
+                return
+            yield u"->  {} {} [{}]".format(step.keyword, step.name, step.status)
+
+    def join(self, lines):
+        """
+        Joins the comment lines, cutting the comment at max_size characters.
+        """
+        if self.max_size is None:
+            return u"\n".join(lines)
+
+        parts = []
+        size = -1
+        for line in lines:
+            parts.append(line)
+            size += len(line) + 1
+            if size > self.max_size:
+                return self.truncate(u"\n".join(parts))
+        return u"\n".join(parts)
+
+    def truncate(self, comment, reserved_size=0):
+        """
+        Cuts the comment so it fits in max_size characters with reserved_size more
+        characters added after it, like the key of a spooled result.
+        """
+        max_size = None if self.max_size is None else self.max_size - reserved_size
+        if max_size is None or len(comment) <= max_size:
+            return comment
+        return comment[: max(0, max_size - len(TRUNCATION_MARKER))] + TRUNCATION_MARKER
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_COORDINATION_DIRECTORY = os.path.join(u".testrail_cache", u"workers")
+DEFAULT_CASE_INDEX_TTL = 60 * 60
+
+# os.replace is not available on python 2
+_replace_file = getattr(os, "replace", os.rename)
+
+
+def write_file_atomically(path, content):
+    """
+    Writes content to a temporary file replaced by path, so other threads and
+    processes never read a half written file.
+    """
+    temporary_path = u"{}.{}.{}.tmp".format(
+        path, os.getpid(), threading.current_thread().ident
+    )
+    with open(temporary_path, u"w") as stream:
+        stream.write(content)
+    _replace_file(temporary_path, path)
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a file shared by all the processes of the host, released by the
+    operating system if the process holding it dies.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._file = open(self.path, u"a+")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 seconds, keep waiting.
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+class WorkerCoordinator(object):
+    """
+    Coordinates the Behave processes running in parallel on one host, so only one of
+    them sets up each test run and downloads each suite while the others reuse its work
+    through the files of a shared directory.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_COORDINATION_DIRECTORY,
+        case_index_ttl=DEFAULT_CASE_INDEX_TTL,
+    ):
+        self.directory = directory
+        self.case_index_ttl = case_index_ttl
+        self.run_registry_path = os.path.join(directory, u"runs.json")
+
+    def _get_path(self, kind, key, extension):
+        key_hash = hashlib.sha1(json.dumps(key).encode(u"utf-8")).hexdigest()
+        return os.path.join(
+            self.directory, u"{}-{}.{}".format(kind, key_hash, extension)
+        )
+
+    def lock(self, kind, key):
+        return FileLock(self._get_path(kind, key, u"lock"))
+
+    def read_case_ids(self, key):
+        """
+        Returns the case ids shared by another worker, or None if there are none or
+        they are older than case_index_ttl seconds.
+        """
+        path = self._get_path(u"cases", key, u"json")
+        try:
+            if time.time() - os.path.getmtime(path) > self.case_index_ttl:
+                return None
+            with open(path, u"r") as stream:
+                return json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_case_ids(self, key, case_ids):
+        write_file_atomically(
+            self._get_path(u"cases", key, u"json"), json.dumps(list(case_ids))
+        )
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+
+class APIError(Exception):
+    def __init__(self, message, status_code=None):
+        super(APIError, self).__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(APIError):
+    """
+    The request was not sent because the circuit breaker of the client is open.
+    """
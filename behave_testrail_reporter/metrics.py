@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import os
+import threading
+
+from .coordination import write_file_atomically
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket holds the
+# slower requests.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def get_endpoint_name(uri):
+    """
+    Returns the Testrail method of the uri, `get_cases` for `get_cases/1&suite_id=2`.
+    """
+    return uri.split(u"&", 1)[0].split(u"/", 1)[0]
+
+
+class EndpointMetrics(object):
+    """
+    Counters of the requests to one endpoint. The latencies are counted in the
+    LATENCY_BUCKETS, so the memory used does not grow with the number of requests.
+    """
+
+    __slots__ = (
+        "requests",
+        "errors",
+        "retries",
+        "bytes_sent",
+        "bytes_received",
+        "bucket_counts",
+        "duration_sum",
+        "duration_min",
+        "duration_max",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.duration_min = None
+        self.duration_max = 0.0
+
+    def record_duration(self, seconds):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.duration_sum += seconds
+        if self.duration_min is None or seconds < self.duration_min:
+            self.duration_min = seconds
+        self.duration_max = max(self.duration_max, seconds)
+
+    def get_percentile(self, percentile):
+        """
+        Estimates the percentile by interpolating in its bucket, like the
+        histogram_quantile function of Prometheus.
+        """
+        count = sum(self.bucket_counts)
+        if not count:
+            return 0.0
+
+        rank = percentile / 100.0 * count
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count and cumulative_count + bucket_count >= rank:
+                break
+            cumulative_count += bucket_count
+        if index == len(LATENCY_BUCKETS):
+            return self.duration_max
+
+        lower_bound = LATENCY_BUCKETS[index - 1] if index else 0.0
+        upper_bound = LATENCY_BUCKETS[index]
+        value = lower_bound + (upper_bound - lower_bound) * (
+            rank - cumulative_count
+        ) / float(bucket_count)
+        return min(max(value, self.duration_min), self.duration_max)
+
+    def get_latencies(self):
+        return {
+            u"p50": self.get_percentile(50),
+            u"p95": self.get_percentile(95),
+            u"max": self.duration_max,
+            u"sum": self.duration_sum,
+        }
+
+    def get_cumulative_bucket_counts(self):
+        cumulative_counts = []
+        cumulative_count = 0
+        for bucket_count in self.bucket_counts:
+            cumulative_count += bucket_count
+            cumulative_counts.append(cumulative_count)
+        return cumulative_counts
+
+    def to_dict(self):
+        return {
+            u"requests": self.requests,
+            u"errors": self.errors,
+            u"retries": self.retries,
+            u"bytes_sent": self.bytes_sent,
+            u"bytes_received": self.bytes_received,
+            u"latency_seconds": self.get_latencies(),
+            u"latency_buckets": self.get_cumulative_bucket_counts(),
+        }
+
+
+class RequestMetrics(object):
+    """
+    Counts the requests sent to each Testrail endpoint with their latency, the bytes
+    sent and received, the retries and the errors. Every attempt is a request.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def _get_endpoint(self, uri):
+        endpoint = get_endpoint_name(uri)
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointMetrics()
+        return self.endpoints[endpoint]
+
+    def record_request(self, uri, seconds, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            endpoint_metrics = self._get_endpoint(uri)
+            endpoint_metrics.requests += 1
+            endpoint_metrics.record_duration(seconds)
+            endpoint_metrics.bytes_sent += bytes_sent
+            endpoint_metrics.bytes_received += bytes_received
+
+    def record_retry(self, uri):
+        with self._lock:
+            self._get_endpoint(uri).retries += 1
+
+    def record_error(self, uri):
+        with self._lock:
+            self._get_endpoint(uri).errors += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                endpoint: endpoint_metrics.to_dict()
+                for endpoint, endpoint_metrics in self.endpoints.items()
+            }
+
+    def format_summary(self):
+        """
+        Returns one line per endpoint, sorted by the total time spent on it.
+        """
+        endpoints = sorted(
+            self.to_dict().items(),
+            key=lambda item: item[1][u"latency_seconds"][u"sum"],
+            reverse=True,
+        )
+        lines = []
+        for endpoint, metrics in endpoints:
+            latencies = metrics[u"latency_seconds"]
+            line = (
+                u"%s: %d requests, p50 %0.3fs, p95 %0.3fs, max %0.3fs, "
+                u"%d bytes sent, %d bytes received"
+                % (
+                    endpoint,
+                    metrics[u"requests"],
+                    latencies[u"p50"],
+                    latencies[u"p95"],
+                    latencies[u"max"],
+                    metrics[u"bytes_sent"],
+                    metrics[u"bytes_received"],
+                )
+            )
+            if metrics[u"retries"]:
+                line += u", %d retries" % metrics[u"retries"]
+            if metrics[u"errors"]:
+                line += u", %d errors" % metrics[u"errors"]
+            lines.append(line)
+        return lines
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text format, for the textfile collector.
+        """
+        counters = (
+            (u"testrail_requests_total", u"requests", u"Requests sent to Testrail."),
+            (
+                u"testrail_request_errors_total",
+                u"errors",
+                u"Requests that failed after their retries.",
+            ),
+            (u"testrail_request_retries_total", u"retries", u"Requests retried."),
+            (u"testrail_request_sent_bytes_total", u"bytes_sent", u"Bytes sent."),
+            (
+                u"testrail_response_received_bytes_total",
+                u"bytes_received",
+                u"Bytes received.",
+            ),
+        )
+        endpoints = sorted(self.to_dict().items())
+
+        lines = []
+        for name, key, help_text in counters:
+            lines.append(u"# HELP {} {}".format(name, help_text))
+            lines.append(u"# TYPE {} counter".format(name))
+            for endpoint, metrics in endpoints:
+                lines.append(
+                    u'{}{{endpoint="{}"}} {}'.format(name, endpoint, metrics[key])
+                )
+
+        name = u"testrail_request_duration_seconds"
+        lines.append(u"# HELP {} Latency of the requests to Testrail.".format(name))
+        lines.append(u"# TYPE {} histogram".format(name))
+        bucket_bounds = [u"{}".format(bound) for bound in LATENCY_BUCKETS] + [u"+Inf"]
+        for endpoint, metrics in endpoints:
+            for bound, count in zip(bucket_bounds, metrics[u"latency_buckets"]):
+                lines.append(
+                    u'{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                        name, endpoint, bound, count
+                    )
+                )
+            lines.append(
+                u'{}_sum{{endpoint="{}"}} {}'.format(
+                    name, endpoint, metrics[u"latency_seconds"][u"sum"]
+                )
+            )
+            lines.append(
+                u'{}_count{{endpoint="{}"}} {}'.format(
+                    name, endpoint, metrics[u"requests"]
+                )
+            )
+
+        return u"\n".join(lines) + u"\n"
+
+    def write(self, path, metrics_format=u"json"):
+        if metrics_format == u"prometheus":
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # The textfile collector must never read a half written file.
+        write_file_atomically(path, content)
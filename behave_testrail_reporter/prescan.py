@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+
+DEFAULT_FEATURE_LOCATIONS = (u"features",)
+DEFAULT_LOOKUP_MAX_CASES = 100
+DEFAULT_LOOKUP_WORKERS = 10
+FEATURE_FILE_EXTENSION = u".feature"
+# Behave locations can point to a line of the file, `login.feature:12`.
+_LINE_SUFFIX_PATTERN = re.compile(u":\\d+$")
+
+
+def iter_feature_files(locations):
+    """
+    Yields the feature files of locations, the directories are searched recursively.
+    """
+    for location in locations:
+        if not os.path.exists(location):
+            location = _LINE_SUFFIX_PATTERN.sub(u"", location)
+
+        if not os.path.isdir(location):
+            yield location
+            continue
+
+        for directory, directory_names, file_names in os.walk(location):
+            directory_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(FEATURE_FILE_EXTENSION):
+                    yield os.path.join(directory, file_name)
+
+
+def scan_case_ids(locations, tag_prefix):
+    """
+    Returns the ids tagged with `@<tag_prefix><id>` in the feature files of locations.
+    Only the tag lines are read, the Gherkin is not parsed.
+    """
+    tag_pattern = re.compile(u"(?:^|\\s)@" + re.escape(tag_prefix) + u"(\\S+)")
+    case_ids = set()
+    for path in iter_feature_files(locations):
+        with io.open(path, u"r", encoding=u"utf-8") as stream:
+            for line in stream:
+                line = line.strip()
+                if line.startswith(u"@"):
+                    case_ids.update(tag_pattern.findall(line))
+    return case_ids
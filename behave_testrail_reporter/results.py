@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_MAX_BYTES = 1024 * 1024
+DEFAULT_AGGREGATE_MAX_FAILURES = 10
+
+
+class ResultBuffer(object):
+    """
+    Collects the test results of one test run so they can be sent to Testrail with
+    `add_results_for_cases` in chunks bounded by number of results and payload size.
+    """
+
+    def __init__(
+        self, max_results=DEFAULT_BATCH_SIZE, max_bytes=DEFAULT_BATCH_MAX_BYTES
+    ):
+        self.max_results = max(1, max_results)
+        self.max_bytes = max_bytes
+        self.results = []
+        self.sizes = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self, result):
+        result_size = len(json.dumps(result))
+        self.results.append(result)
+        self.sizes.append(result_size)
+        self.size += result_size
+
+    def is_full(self):
+        return len(self.results) >= self.max_results or self.size >= self.max_bytes
+
+    def drain(self):
+        """
+        Empties the buffer and yields lists of results small enough to be sent in one
+        request. A single result bigger than max_bytes is still sent on its own.
+        """
+        results, sizes = self.results, self.sizes
+        self.results, self.sizes, self.size = [], [], 0
+
+        chunk, chunk_size = [], 0
+        for result, result_size in zip(results, sizes):
+            if chunk and (
+                len(chunk) >= self.max_results
+                or chunk_size + result_size > self.max_bytes
+            ):
+                yield chunk
+                chunk, chunk_size = [], 0
+            chunk.append(result)
+            chunk_size += result_size
+
+        if chunk:
+            yield chunk
+
+
+class ResultAggregator(object):
+    """
+    Collects the results reported for each case of a test run, so one merged result
+    per case can be sent when the results are flushed.
+
+    `statuses` lists the (Testrail status, name) pairs from best to worst, the merged
+    result takes the worst status, the sum of the elapsed seconds and the comments of
+    up to `max_failures` results not in the best status.
+    """
+
+    def __init__(self, statuses, max_failures=DEFAULT_AGGREGATE_MAX_FAILURES):
+        self.status_order = [status for status, _ in statuses]
+        self.status_names = dict(statuses)
+        self.max_failures = max_failures
+        self.results = collections.OrderedDict()
+        self.attachments = {}
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self, case_id, status, comment, elapsed_seconds, attachments=()):
+        self.results.setdefault(case_id, []).append((status, comment, elapsed_seconds))
+        if attachments:
+            self.attachments.setdefault(case_id, []).extend(attachments)
+
+    def drain_attachments(self):
+        """
+        Empties the attachments and returns the paths attached to each case.
+        """
+        attachments, self.attachments = self.attachments, {}
+        return attachments
+
+    def drain(self):
+        """
+        Empties the aggregator and yields (case_id, status, comment lines,
+        elapsed seconds) for each case, in the order the cases were first reported.
+        """
+        results, self.results = self.results, collections.OrderedDict()
+        for case_id, case_results in results.items():
+            statuses = [status for status, _, _ in case_results]
+            worst_status = max(statuses, key=self.status_order.index)
+            elapsed_seconds = sum(elapsed for _, _, elapsed in case_results)
+            yield (
+                case_id,
+                worst_status,
+                self._merge_comments(case_results),
+                elapsed_seconds,
+            )
+
+    def _merge_comments(self, case_results):
+        if len(case_results) == 1:
+            return [case_results[0][1]]
+
+        counts = collections.Counter(status for status, _, _ in case_results)
+        lines = [
+            u"{} results: {}".format(
+                len(case_results),
+                u", ".join(
+                    u"{} {}".format(counts[status], self.status_names[status])
+                    for status in reversed(self.status_order)
+                    if counts[status]
+                ),
+            )
+        ]
+        failures = [
+            comment
+            for status, comment, _ in case_results
+            if status != self.status_order[0]
+        ]
+        for comment in failures[: self.max_failures]:
+            lines.append(u"")
+            lines.append(comment)
+        if len(failures) > self.max_failures:
+            lines.append(u"")
+            lines.append(
+                u"... {} more failed results".format(len(failures) - self.max_failures)
+            )
+        return lines
+
+
+class StepResult(object):
+    __slots__ = ("keyword", "name", "status")
+
+    def __init__(self, keyword, name, status):
+        self.keyword = keyword
+        self.name = name
+        self.status = status
+
+
+class ScenarioResult(object):
+    """
+    Compact copy of the parts of an executed Behave scenario reported to Testrail,
+    so it can be reported later without keeping the Behave model alive.
+    """
+
+    __slots__ = ("name", "status", "duration", "steps", "case_ids", "attachments")
+
+    def __init__(self, name, status, duration, steps, case_ids, attachments=()):
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.steps = steps
+        self.case_ids = case_ids
+        self.attachments = attachments
+
+    @classmethod
+    def from_scenario(cls, scenario, case_ids, attachments=()):
+        steps = [
+            StepResult(step.keyword, step.name, step.status) for step in scenario.steps
+        ]
+        return cls(
+            scenario.name,
+            scenario.status,
+            scenario.duration,
+            steps,
+            case_ids,
+            attachments,
+        )
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import re
+import threading
+import uuid
+
+from .coordination import FileLock
+
+DEFAULT_SPOOL_PATH = os.path.join(u".testrail_cache", u"spool.jsonl")
+# Results that could not be sent while Testrail was unavailable, in the spool format.
+DEFAULT_FALLBACK_PATH = os.path.join(u".testrail_cache", u"fallback.jsonl")
+
+SPOOL_KEY_FIELD = u"_spool_key"
+# The key is added to the result comment so a replay can find the results already sent.
+SPOOL_KEY_TEMPLATE = u"\n\nResult key: {key}"
+SPOOL_KEY_PATTERN = re.compile(r"Result key: ([0-9a-f]{32})")
+# Resuming only looks for the results created since the oldest pending record, this
+# long before it in case the clocks of the host and Testrail differ.
+RESUME_CLOCK_MARGIN = 60 * 60
+
+
+def build_spool_key():
+    return uuid.uuid4().hex
+
+
+def find_spool_keys(comment):
+    return SPOOL_KEY_PATTERN.findall(comment or u"")
+
+
+class ResultSpool(object):
+    """
+    Journal of the test results written to disk before they are sent to Testrail.
+
+    Each result is appended as a JSON line and synced to disk, then acknowledged with
+    another line once Testrail accepted it, so the results pending after a crash
+    can be sent later by `resume`.
+    """
+
+    def __init__(self, path=DEFAULT_SPOOL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _lock_file(self):
+        # Coordinated workers share the spool, so it is also locked across processes.
+        return FileLock(self.path + u".lock")
+
+    def _append_line(self, entry):
+        line = json.dumps(entry) + u"\n"
+        with self._lock, self._lock_file():
+            if not self._ends_with_newline():
+                # Never write onto the torn line of a process killed while writing it.
+                line = u"\n" + line
+            with open(self.path, u"a") as stream:
+                stream.write(line)
+                stream.flush()
+                os.fsync(stream.fileno())
+
+    def _ends_with_newline(self):
+        try:
+            with open(self.path, u"rb") as stream:
+                stream.seek(0, os.SEEK_END)
+                if not stream.tell():
+                    return True
+                stream.seek(-1, os.SEEK_END)
+                return stream.read(1) == b"\n"
+        except (IOError, OSError):
+            return True
+
+    def append(self, record):
+        """
+        Writes the record of a result, it must contain its idempotency `key`.
+        """
+        self._append_line(record)
+
+    def acknowledge(self, keys):
+        keys = [key for key in keys if key]
+        if keys:
+            self._append_line({u"ack": keys})
+
+    def pending(self):
+        """
+        Returns the records not acknowledged yet, in the order they were written.
+        """
+        with self._lock:
+            return self._read_pending()
+
+    def _read_pending(self):
+        records = []
+        acknowledged_keys = set()
+        try:
+            with open(self.path, u"r") as stream:
+                lines = stream.readlines()
+        except (IOError, OSError):
+            return []
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line can be incomplete if the process was killed writing it.
+                continue
+            if u"ack" in entry:
+                acknowledged_keys.update(entry[u"ack"])
+            else:
+                records.append(entry)
+
+        return [record for record in records if record[u"key"] not in acknowledged_keys]
+
+    def clear_if_acknowledged(self):
+        """
+        Removes the journal when all its results have been acknowledged.
+        """
+        with self._lock, self._lock_file():
+            if self._read_pending():
+                return False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        return True
+
+
+def main(argv=None):
+    """
+    Sends to Testrail the results left in the spool by an interrupted execution.
+    """
+    from .testrail_reporter import TestrailReporter
+
+    parser = argparse.ArgumentParser(
+        description=u"Send the pending results of the testrail.yml spool to Testrail."
+    )
+    parser.add_argument(
+        u"--branch",
+        default=u"",
+        help=u"Branch name used to check the allowed_branch_pattern of the projects.",
+    )
+    arguments = parser.parse_args(argv)
+
+    testrail_reporter = TestrailReporter(arguments.branch)
+    testrail_reporter.resume()
+    testrail_reporter.end()
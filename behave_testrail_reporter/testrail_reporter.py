@@ -1,14 +1,285 @@
 # -*- coding: utf-8 -*-
 
 import re
-import yaml
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from jsonschema import validate
 from behave.reporter.base import Reporter
 from behave.model import ScenarioOutline
 from behave.model_core import Status
 
-from .api import APIClient
+from .attachments import (
+    ATTACHMENTS_FIELD,
+    DEFAULT_ATTACHMENT_MAX_SIZE,
+    DEFAULT_ATTACHMENT_WORKERS,
+    AttachmentUploader,
+)
+from .cache import (
+    DEFAULT_CACHE_DIRECTORY,
+    DEFAULT_CACHE_MAX_SIZE,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_RUN_REGISTRY_PATH,
+    CaseCache,
+    RunRegistry,
+)
+from .case_index import CaseIndex, UnavailableCases
+from .comments import VERBOSITY_FULL, CommentPolicy
+from .coordination import (
+    DEFAULT_CASE_INDEX_TTL,
+    DEFAULT_COORDINATION_DIRECTORY,
+    WorkerCoordinator,
+)
+from .errors import APIError
+from .prescan import (
+    DEFAULT_FEATURE_LOCATIONS,
+    DEFAULT_LOOKUP_MAX_CASES,
+    DEFAULT_LOOKUP_WORKERS,
+    scan_case_ids,
+)
+from .results import (
+    DEFAULT_AGGREGATE_MAX_FAILURES,
+    DEFAULT_BATCH_MAX_BYTES,
+    DEFAULT_BATCH_SIZE,
+    ResultAggregator,
+    ResultBuffer,
+    ScenarioResult,
+)
+from .spool import (
+    DEFAULT_FALLBACK_PATH,
+    DEFAULT_SPOOL_PATH,
+    RESUME_CLOCK_MARGIN,
+    SPOOL_KEY_FIELD,
+    SPOOL_KEY_TEMPLATE,
+    ResultSpool,
+    build_spool_key,
+    find_spool_keys,
+)
+from .throttling import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_COOL_DOWN,
+    DEFAULT_FAILURE_THRESHOLD,
+    DEFAULT_MAX_BACKOFF,
+    DEFAULT_MAX_RETRIES,
+    CircuitBreaker,
+    RateLimiter,
+    RetryPolicy,
+)
+from .uploader import (
+    DEFAULT_DRAIN_TIMEOUT,
+    DEFAULT_UPLOAD_QUEUE_SIZE,
+    DEFAULT_UPLOAD_WORKERS,
+    BackgroundUploader,
+)
+
+DEFAULT_PROJECT_WORKERS = 4
+
+CONFIG_SCHEMA = """
+type: object
+properties:
+    base_url:
+        type: string
+    projects:
+        type: array
+        items:
+            type: object
+            properties:
+                id:
+                    type: number
+                name:
+                    type: string
+                suite_id:
+                    type: number
+                allowed_branch_pattern:
+                    type: string
+                config_ids:
+                    type: array
+                    items:
+                        type: number
+            required: ['id', 'name', 'suite_id', 'allowed_branch_pattern']
+    api:
+        type: object
+        properties:
+            page_workers:
+                type: integer
+                minimum: 1
+            max_retries:
+                type: integer
+                minimum: 0
+            backoff_factor:
+                type: number
+                minimum: 0
+            max_backoff:
+                type: number
+                minimum: 0
+            rate_limit:
+                type: number
+                exclusiveMinimum: 0
+            rate_limit_burst:
+                type: integer
+                minimum: 1
+            pool_size:
+                type: integer
+                minimum: 1
+            keep_alive:
+                type: boolean
+            connect_timeout:
+                type: number
+                exclusiveMinimum: 0
+            read_timeout:
+                type: number
+                exclusiveMinimum: 0
+            gzip_threshold:
+                type: integer
+                minimum: 0
+    circuit_breaker:
+        type: object
+        properties:
+            failure_threshold:
+                type: integer
+                minimum: 1
+            cool_down:
+                type: number
+                minimum: 0
+            fallback_path:
+                type: string
+    async_api:
+        type: object
+        properties:
+            concurrency:
+                type: integer
+                minimum: 1
+            drain_timeout:
+                type: number
+                minimum: 0
+    attachments:
+        type: object
+        properties:
+            workers:
+                type: integer
+                minimum: 1
+            max_size:
+                type: integer
+                minimum: 0
+            run_budget:
+                type: integer
+                minimum: 0
+            drain_timeout:
+                type: number
+                minimum: 0
+    async_upload:
+        type: object
+        properties:
+            workers:
+                type: integer
+                minimum: 1
+            queue_size:
+                type: integer
+                minimum: 0
+            drain_timeout:
+                type: number
+                minimum: 0
+    case_cache:
+        type: object
+        properties:
+            directory:
+                type: string
+            ttl:
+                type: number
+                minimum: 0
+            max_size:
+                type: integer
+                minimum: 0
+    case_lookup:
+        type: object
+        properties:
+            max_cases:
+                type: integer
+                minimum: 0
+            workers:
+                type: integer
+                minimum: 1
+    delta_sync:
+        type: object
+        properties:
+            max_age:
+                type: number
+                minimum: 0
+    compact_case_index:
+        type: boolean
+    coordination:
+        type: object
+        properties:
+            directory:
+                type: string
+            case_index_ttl:
+                type: number
+                minimum: 0
+    comments:
+        type: object
+        properties:
+            verbosity:
+                enum: ['full', 'failures', 'summary']
+            max_steps:
+                type: integer
+                minimum: 0
+            max_size:
+                type: integer
+                minimum: 100
+    test_runs:
+        type: object
+        properties:
+            include_all:
+                type: boolean
+    test_plan:
+        type: object
+        properties:
+            name:
+                type: string
+        required: ['name']
+    metrics:
+        type: object
+        properties:
+            path:
+                type: string
+            format:
+                enum: ['json', 'prometheus']
+        required: ['path']
+    spool:
+        type: object
+        properties:
+            path:
+                type: string
+    run_registry:
+        type: object
+        properties:
+            path:
+                type: string
+    project_workers:
+        type: integer
+        minimum: 1
+    results:
+        type: object
+        properties:
+            batch_size:
+                type: integer
+                minimum: 1
+            batch_max_bytes:
+                type: integer
+                minimum: 1
+            aggregate:
+                type: boolean
+            aggregate_max_failures:
+                type: integer
+                minimum: 0
+required: ['base_url']
+"""
+
+# Built the first time a config file is validated.
+_config_validator = None
+# Compiled allowed_branch_pattern of the projects.
+_branch_patterns = {}
 
 OPTIONAL_STEPS = (Status.untested,)
 STATUS_ORDER = (
@@ -42,14 +313,49 @@ def format_summary(statement_type, summary):
     return u", ".join(parts)
 
 
+def _get_config_validator():
+    """
+    Returns the validator of testrail.yml files, the schema is only parsed and checked
+    the first time. jsonschema and yaml are imported here, they are not needed when
+    the config is already cached.
+    """
+    global _config_validator
+    if _config_validator is None:
+        import yaml
+        from jsonschema.validators import validator_for
+
+        schema = yaml.safe_load(CONFIG_SCHEMA)
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        _config_validator = validator_class(schema)
+
+    return _config_validator
+
+
+def _compile_branch_pattern(allowed_branch_pattern):
+    pattern = r"" + str(allowed_branch_pattern)
+    if pattern not in _branch_patterns:
+        _branch_patterns[pattern] = re.compile(pattern)
+
+    return _branch_patterns[pattern]
+
+
 class TestrailProject(object):
-    def __init__(self, id, name, suite_id, allowed_branch_pattern="*"):
+    def __init__(self, id, name, suite_id, allowed_branch_pattern="*", config_ids=None):
         self.id = id
         self.name = name
         self.suite_id = suite_id
         self.allowed_branch_pattern = allowed_branch_pattern
+        # Testrail configurations of the test run when it is part of a test plan.
+        self.config_ids = sorted(config_ids or [])
         self.test_run = None
+        # Cases of a test run created without include_all, None until they are known.
+        self.run_case_ids = None
+        # Latest status and time of the results of each case in the test run, for
+        # `delta_sync`. None until they are requested.
+        self.latest_results = None
         self.cases = {}
+        self.lock = threading.Lock()
 
     def get_test_run_name(self, branch_name):
         return self.name.format(
@@ -77,6 +383,15 @@ class TestrailReporter(Reporter):
         u"untested": STATUS_UNTESTED,
     }
 
+    # Testrail statuses from best to worst, to merge the results of a case
+    AGGREGATE_STATUSES = (
+        (STATUS_PASSED, u"passed"),
+        (STATUS_UNTESTED, u"untested"),
+        (STATUS_RETEST, u"retest"),
+        (STATUS_BLOCKED, u"blocked"),
+        (STATUS_FAILED, u"failed"),
+    )
+
     def __init__(self, branch_name):
         self.config = {}
         self.projects = []
@@ -93,16 +408,123 @@ class TestrailReporter(Reporter):
         }
         self.duration = 0.0
         self.failed_cases = []
+        self.unchanged_results = 0
+        self.fallback_results = 0
+        self.result_buffers = {}
+        self.result_aggregators = {}
+        self.case_cache = None
+        self.run_registry = None
+        self.result_spool = None
+        self.fallback_spool = None
+        self.coordinator = None
+        self.uploader = None
+        self.async_sender = None
+        self.batch_executor = None
+        # Batches being sent by the batch executor, and the last ones of each project.
+        self._batch_sends = []
+        self._project_batch_sends = {}
+        self.attachment_uploader = None
+        self.comment_policy = None
+        # Files attached to the scenarios not reported yet.
+        self.pending_attachments = {}
+        # Case ids tagged in the feature files read by prescan.
+        self.referenced_case_ids = None
+        self._routable_projects = None
+        self._case_routes = None
+        self._cases_looked_up = False
+        self._looked_up_case_ids = set()
+        # Guards the shared state when results are reported by background uploaders.
+        self._lock = threading.RLock()
+        # Guards the lazy creation of the API client, case cache and uploader.
+        self._setup_lock = threading.Lock()
+        # Only one thread at a time sets up a test plan.
+        self._plan_lock = threading.Lock()
+
+    def prescan(self, locations=None):
+        """
+        Reads the case ids tagged in the feature files at locations, `features` by
+        default. Call it from before_all so that, when at most `case_lookup.max_cases`
+        cases are tagged, only those cases are requested instead of the whole suites.
+        """
+        self.referenced_case_ids = scan_case_ids(
+            locations or DEFAULT_FEATURE_LOCATIONS, self.CASE_TAG_PREFIX
+        )
+        return self.referenced_case_ids
+
+    def attach(self, scenario, path):
+        """
+        Attaches the file at path to the results of the scenario, call it from
+        after_scenario. The file is uploaded once the results are sent.
+        """
+        with self._lock:
+            self.pending_attachments.setdefault(
+                self._get_scenario_key(scenario), []
+            ).append(path)
+
+    def _get_scenario_key(self, scenario):
+        return (scenario.filename, scenario.line)
+
+    def _pop_attachments(self, scenario):
+        with self._lock:
+            return self.pending_attachments.pop(self._get_scenario_key(scenario), [])
 
     def feature(self, feature):
         self.duration += feature.duration
+        feature_case_ids = self._parse_case_ids(feature.tags)
         for scenario in feature:
             if isinstance(scenario, ScenarioOutline):
-                self.process_scenario_outline(scenario)
+                self.process_scenario_outline(scenario, feature_case_ids)
             else:
-                self.process_scenario(scenario)
+                self.process_scenario(scenario, feature_case_ids)
 
     def end(self):
+        if self.uploader:
+            drain_timeout = self.config[u"async_upload"].get(
+                u"drain_timeout", DEFAULT_DRAIN_TIMEOUT
+            )
+            pending_results = self.uploader.drain(timeout=drain_timeout)
+            if pending_results:
+                print(
+                    u"\nTestrail upload timed out with {} scenarios not reported.".format(
+                        pending_results
+                    )
+                )
+            for error in self.uploader.errors:
+                print(u"\nTestrail upload error: {}".format(error))
+
+        self.flush_results()
+        if self.batch_executor:
+            self.batch_executor.shutdown(wait=True)
+        if self.async_sender:
+            # flush_results already waited drain_timeout for the batches.
+            pending_batches = self.async_sender.close(timeout=0)
+            if pending_batches:
+                print(
+                    u"\nTestrail upload timed out with {} result batches not sent.".format(
+                        pending_batches
+                    )
+                )
+            for error in self.async_sender.errors:
+                print(u"\nTestrail upload error: {}".format(error))
+
+        if self.attachment_uploader:
+            pending_attachments = self.attachment_uploader.close(
+                timeout=self.config.get(u"attachments", {}).get(
+                    u"drain_timeout", DEFAULT_DRAIN_TIMEOUT
+                )
+            )
+            if pending_attachments:
+                print(
+                    u"\nTestrail upload timed out with {} attachments not sent.".format(
+                        pending_attachments
+                    )
+                )
+            for error in self.attachment_uploader.errors:
+                print(u"\nTestrail attachment error: {}".format(error))
+
+        if self.result_spool:
+            self.result_spool.clear_if_acknowledged()
+
         if self.show_failed_cases and self.failed_cases:
             print(u"\nTestrail test results failed for test cases:\n")
             for case_id in self.failed_cases:
@@ -111,50 +533,97 @@ class TestrailReporter(Reporter):
 
         # -- SHOW SUMMARY COUNTS:
         print(format_summary(u"testrail test case", self.case_summary))
+        if self.config.get(u"delta_sync") is not None:
+            print(
+                u"Testrail delta sync: %d unchanged results not sent"
+                % self.unchanged_results
+            )
+        if self.testrail_client and self._uses_circuit_breaker():
+            self._print_circuit_breaker_summary(self.testrail_client.circuit_breaker)
+        if self.case_cache:
+            print(
+                u"Testrail case cache: %d hits, %d misses, %d cases refreshed in %0.3fs"
+                % (
+                    self.case_cache.hits,
+                    self.case_cache.misses,
+                    self.case_cache.refreshed_cases,
+                    self.case_cache.refresh_seconds,
+                )
+            )
+        if self.attachment_uploader:
+            print(
+                u"Testrail attachments: %d uploaded, %d bytes, %d skipped"
+                % (
+                    self.attachment_uploader.uploaded,
+                    self.attachment_uploader.uploaded_bytes,
+                    self.attachment_uploader.skipped,
+                )
+            )
+        if self.testrail_client:
+            self._print_api_summary(self.testrail_client)
         timings = (int(self.duration / 60.0), self.duration % 60)
         print(u"Took %dm%02.3fs\n" % timings)
 
+    def _print_circuit_breaker_summary(self, circuit_breaker):
+        print(
+            u"Testrail circuit breaker: %s, opened %d times, %d requests not sent"
+            % (
+                circuit_breaker.state,
+                circuit_breaker.opened,
+                circuit_breaker.rejected_requests,
+            )
+        )
+        if self.fallback_results:
+            print(
+                u"Testrail fallback: %d results written to %s"
+                % (self.fallback_results, self.fallback_spool.path)
+            )
+
+    def _print_api_summary(self, testrail_client):
+        parts = []
+        if testrail_client.retries or testrail_client.throttled_seconds:
+            parts.append(
+                u"%d retries, %0.3fs throttled"
+                % (testrail_client.retries, testrail_client.throttled_seconds)
+            )
+        if testrail_client.gzip_bytes_before:
+            parts.append(
+                u"gzip sent %d of %d bytes"
+                % (testrail_client.gzip_bytes_after, testrail_client.gzip_bytes_before)
+            )
+        if parts:
+            print(u"Testrail API: {}".format(u", ".join(parts)))
+        for line in testrail_client.metrics.format_summary():
+            print(u"Testrail API {}".format(line))
+
+        metrics_config = self.config.get(u"metrics")
+        if metrics_config and metrics_config.get(u"path"):
+            testrail_client.metrics.write(
+                metrics_config[u"path"],
+                metrics_format=metrics_config.get(u"format", u"json"),
+            )
+
     def _load_config(self):
         try:
             with open(u"testrail.yml", u"r") as stream:
-                try:
-                    self.config = yaml.safe_load(stream)
-                    self._validate_config(self.config)
-                    self._load_projects_from_config(self.config)
-                except yaml.YAMLError as exception:
-                    raise Exception(
-                        u"Error loading testrail.yml file: {}".format(exception)
-                    )
+                content = stream.read()
         except IOError:
             raise Exception(
                 u"Could not read `testrail.yml` file, check the file exists in root of your project."
             )
 
-    def _validate_config(self, config):
-        schema = """
-        type: object
-        properties:
-            base_url:
-                type: string
-            projects:
-                type: array
-                items:
-                    type: object
-                    properties:
-                        id:
-                            type: number
-                        name:
-                            type: string
-                        suite_id:
-                            type: number
-                        allowed_branch_pattern:
-                            type: string
-                    required: ['id', 'name', 'suite_id', 'allowed_branch_pattern']
-        required: ['base_url']
-        """
+        import yaml
 
         try:
-            validate(config, yaml.safe_load(schema))
+            self.config = yaml.safe_load(content)
+        except yaml.YAMLError as exception:
+            raise Exception(u"Error loading testrail.yml file: {}".format(exception))
+        self._validate_config(self.config)
+        self._load_projects_from_config(self.config)
+
+    def _validate_config(self, config):
+        try:
+            _get_config_validator().validate(config)
         except Exception as exception:
             try:
                 exception_message = exception.message
@@ -177,6 +646,7 @@ class TestrailReporter(Reporter):
                 name=project_config.get(u"name"),
                 suite_id=project_config.get(u"suite_id"),
                 allowed_branch_pattern=project_config.get(u"allowed_branch_pattern"),
+                config_ids=project_config.get(u"config_ids"),
             )
             self.projects.append(testrail_project)
 
@@ -185,62 +655,1091 @@ class TestrailReporter(Reporter):
         This method contains the logic to decide if the branch_name is allowed to have test run and
         test results added to it.
         """
-        allowed_branch_names = r"" + str(testrail_project.allowed_branch_pattern)
+        allowed_branch_names = _compile_branch_pattern(
+            testrail_project.allowed_branch_pattern
+        )
 
-        return bool(re.match(allowed_branch_names, branch_name))
+        return bool(allowed_branch_names.match(branch_name))
 
-    def setup_test_run(self, testrail_project):
+    def setup_test_run(
+        self, testrail_project, test_run_name=None, case_ids=(), test_plan_name=None
+    ):
         """
         Sets up the testrail run for testrail_project.
+        With `test_runs.include_all` disabled a new run only gets the case_ids.
         """
-        test_run_name = testrail_project.get_test_run_name(branch_name=self.branch_name)
-        testrail_project.test_run = (
-            self._get_testrail_client().get_test_run_by_project_and_name(
-                project_id=testrail_project.id, test_run_name=test_run_name
+        testrail_client = self._get_testrail_client()
+        if test_run_name is None:
+            test_run_name = testrail_project.get_test_run_name(
+                branch_name=self.branch_name
+            )
+        if self._uses_test_plan():
+            self._setup_test_plan(
+                testrail_project, test_run_name, case_ids, test_plan_name
             )
+            return
+
+        run_key = (
+            testrail_client.url,
+            testrail_project.id,
+            testrail_project.suite_id,
+            test_run_name,
+        )
+
+        coordinator = self._get_coordinator()
+        if coordinator:
+            # Only one worker at a time can look up or create the run, the others
+            # then find it in the run registry.
+            with coordinator.lock(u"run", run_key):
+                self._setup_test_run(testrail_project, test_run_name, run_key, case_ids)
+        else:
+            self._setup_test_run(testrail_project, test_run_name, run_key, case_ids)
+
+    def _setup_test_run(self, testrail_project, test_run_name, run_key, case_ids):
+        testrail_client = self._get_testrail_client()
+        run_registry = self._get_run_registry()
+        testrail_project.run_case_ids = None
+        testrail_project.latest_results = None
+
+        if run_registry:
+            testrail_project.test_run = self._get_registered_test_run(
+                run_registry.get(*run_key)
+            )
+            if testrail_project.test_run is not None:
+                return
+
+        testrail_project.test_run = testrail_client.get_test_run_by_project_and_name(
+            project_id=testrail_project.id, test_run_name=test_run_name
         )
 
         if testrail_project.test_run is None:
-            testrail_project.test_run = self._get_testrail_client().create_run(
+            # A new test run has no results to compare with.
+            testrail_project.latest_results = {}
+
+        if testrail_project.test_run is None and self._includes_all_cases():
+            testrail_project.test_run = testrail_client.create_run(
                 testrail_project.id, testrail_project.suite_id, test_run_name
             )
+        elif testrail_project.test_run is None:
+            testrail_project.run_case_ids = set(case_ids)
+            testrail_project.test_run = testrail_client.create_run(
+                testrail_project.id,
+                testrail_project.suite_id,
+                test_run_name,
+                case_ids=sorted(testrail_project.run_case_ids),
+            )
+
+        if run_registry:
+            run_registry.set(*run_key, run_id=testrail_project.test_run[u"id"])
+
+    def _uses_test_plan(self):
+        return self.config.get(u"test_plan") is not None
+
+    def _get_test_plan_name(self, testrail_project):
+        return self.config[u"test_plan"][u"name"].format(
+            project_id=testrail_project.id, branch=self.branch_name
+        )
+
+    def _setup_test_plan(
+        self, testrail_project, test_run_name, case_ids, test_plan_name=None
+    ):
+        """
+        Sets up the test runs of the routable projects of the same Testrail project
+        as the runs of one test plan, all created by a single add_plan request.
+        The runs missing from an existing plan are added with one add_plan_entry
+        request for each suite and test run name.
+
+        A given test_plan_name, like the one of a spooled result, only sets up the
+        run of testrail_project.
+        """
+        testrail_client = self._get_testrail_client()
+        plan_projects = []
+        if test_plan_name is None:
+            test_plan_name = self._get_test_plan_name(testrail_project)
+            plan_projects = self._get_routable_projects()
+        # Test plans are registered without suite, they can hold several.
+        plan_key = (testrail_client.url, testrail_project.id, None, test_plan_name)
+
+        with self._plan_lock:
+            # Set up with the test plan of another project.
+            if testrail_project.test_run is not None:
+                return
+
+            plan_runs = [(testrail_project, test_run_name)] + [
+                (project, project.get_test_run_name(branch_name=self.branch_name))
+                for project in plan_projects
+                if project.id == testrail_project.id
+                and project is not testrail_project
+                and project.test_run is None
+            ]
+            coordinator = self._get_coordinator()
+            if coordinator:
+                with coordinator.lock(u"plan", plan_key):
+                    self._set_up_test_plan(
+                        test_plan_name, plan_key, plan_runs, case_ids
+                    )
+            else:
+                self._set_up_test_plan(test_plan_name, plan_key, plan_runs, case_ids)
+
+    def _set_up_test_plan(self, test_plan_name, plan_key, plan_runs, case_ids):
+        """
+        Assigns its test plan run to each project of plan_runs, the first project
+        is the one reporting the case_ids.
+        """
+        testrail_client = self._get_testrail_client()
+        run_registry = self._get_run_registry()
+        project_id = plan_runs[0][0].id
+
+        test_plan = None
+        if run_registry:
+            test_plan = self._get_registered_test_plan(run_registry.get(*plan_key))
+        if test_plan is None:
+            test_plan = testrail_client.get_test_plan_by_project_and_name(
+                project_id, test_plan_name
+            )
+
+        if test_plan is None:
+            new_plan_runs = plan_runs
+            test_plan = testrail_client.create_plan(
+                project_id,
+                test_plan_name,
+                self._build_plan_entries(new_plan_runs, case_ids),
+            )
+        else:
+            existing_runs = self._index_plan_runs(test_plan)
+            new_plan_runs = [
+                (project, run_name)
+                for project, run_name in plan_runs
+                if self._get_plan_run_key(
+                    project.suite_id, run_name, project.config_ids
+                )
+                not in existing_runs
+            ]
+            entries = test_plan.setdefault(u"entries", [])
+            for entry in self._build_plan_entries(new_plan_runs, case_ids):
+                entries.append(testrail_client.add_plan_entry(test_plan[u"id"], entry))
+
+        if run_registry:
+            run_registry.set(*plan_key, run_id=test_plan[u"id"])
+
+        runs = self._index_plan_runs(test_plan)
+        new_projects = [project for project, _ in new_plan_runs]
+        for project, run_name in plan_runs:
+            project.test_run = runs[
+                self._get_plan_run_key(project.suite_id, run_name, project.config_ids)
+            ]
+            project.run_case_ids = None
+            project.latest_results = None
+            if project in new_projects:
+                # A new test run has no results to compare with.
+                project.latest_results = {}
+                if not self._includes_all_cases():
+                    project.run_case_ids = (
+                        set(case_ids) if project is plan_runs[0][0] else set()
+                    )
+
+    def _build_plan_entries(self, plan_runs, case_ids):
+        """
+        Returns the test plan entries of plan_runs, the projects with the same suite
+        and test run name are the configurations of one entry.
+        """
+        include_all = self._includes_all_cases()
+        entries = []
+        entries_by_key = {}
+        for project, run_name in plan_runs:
+            run = {u"include_all": include_all}
+            if not include_all:
+                run[u"case_ids"] = (
+                    sorted(case_ids) if project is plan_runs[0][0] else []
+                )
+
+            entry_key = (project.suite_id, run_name)
+            if entry_key not in entries_by_key:
+                entries_by_key[entry_key] = {
+                    u"suite_id": project.suite_id,
+                    u"name": run_name,
+                }
+                entries.append(entries_by_key[entry_key])
+            entry = entries_by_key[entry_key]
+
+            if not project.config_ids:
+                entry.update(run)
+                continue
+            run[u"config_ids"] = project.config_ids
+            entry[u"include_all"] = include_all
+            entry[u"config_ids"] = sorted(
+                set(entry.get(u"config_ids", [])).union(project.config_ids)
+            )
+            entry.setdefault(u"runs", []).append(run)
+
+        return entries
+
+    def _index_plan_runs(self, test_plan):
+        runs = {}
+        for entry in test_plan.get(u"entries") or []:
+            for run in entry.get(u"runs") or []:
+                run_key = self._get_plan_run_key(
+                    entry[u"suite_id"], entry[u"name"], run.get(u"config_ids")
+                )
+                runs[run_key] = run
+        return runs
+
+    def _get_plan_run_key(self, suite_id, run_name, config_ids):
+        return (suite_id, run_name, tuple(sorted(config_ids or [])))
+
+    def _get_registered_test_plan(self, plan_id):
+        """
+        Returns the registered test plan if it still exists and is not completed.
+        """
+        if plan_id is None:
+            return None
+
+        try:
+            test_plan = self._get_testrail_client().get_plan(plan_id)
+        except APIError:
+            return None
+
+        if test_plan.get(u"is_completed"):
+            return None
+        return test_plan
+
+    def _get_registered_test_run(self, run_id):
+        """
+        Returns the registered test run if it still exists and is not completed.
+        """
+        if run_id is None:
+            return None
+
+        try:
+            test_run = self._get_testrail_client().get_run(run_id)
+        except APIError:
+            return None
+
+        if test_run.get(u"is_completed"):
+            return None
+        return test_run
+
+    def _get_run_registry(self):
+        registry_config = self.config.get(u"run_registry")
+        coordinator = self._get_coordinator()
+        if registry_config is None and coordinator is None:
+            return None
+
+        with self._setup_lock:
+            if not self.run_registry:
+                if registry_config is not None:
+                    path = registry_config.get(u"path", DEFAULT_RUN_REGISTRY_PATH)
+                else:
+                    # Coordinated workers share the runs through their own registry.
+                    path = coordinator.run_registry_path
+                self.run_registry = RunRegistry(path=path)
+
+        return self.run_registry
+
+    def _get_coordinator(self):
+        coordination_config = self.config.get(u"coordination")
+        if coordination_config is None:
+            return None
+
+        with self._setup_lock:
+            if not self.coordinator:
+                self.coordinator = WorkerCoordinator(
+                    directory=coordination_config.get(
+                        u"directory", DEFAULT_COORDINATION_DIRECTORY
+                    ),
+                    case_index_ttl=coordination_config.get(
+                        u"case_index_ttl", DEFAULT_CASE_INDEX_TTL
+                    ),
+                )
+
+        return self.coordinator
+
+    def _get_result_spool(self):
+        spool_config = self.config.get(u"spool")
+        if spool_config is None:
+            return None
+
+        with self._setup_lock:
+            if not self.result_spool:
+                self.result_spool = ResultSpool(
+                    path=spool_config.get(u"path", DEFAULT_SPOOL_PATH)
+                )
+
+        return self.result_spool
+
+    def _get_fallback_spool(self):
+        with self._setup_lock:
+            if not self.fallback_spool:
+                self.fallback_spool = ResultSpool(
+                    path=self.config[u"circuit_breaker"].get(
+                        u"fallback_path", DEFAULT_FALLBACK_PATH
+                    )
+                )
+
+        return self.fallback_spool
+
+    def _get_case_cache(self):
+        cache_config = self.config.get(u"case_cache")
+        if cache_config is None:
+            return None
+
+        with self._setup_lock:
+            if not self.case_cache:
+                self.case_cache = CaseCache(
+                    directory=cache_config.get(u"directory", DEFAULT_CACHE_DIRECTORY),
+                    ttl=cache_config.get(u"ttl", DEFAULT_CACHE_TTL),
+                    max_size=cache_config.get(u"max_size", DEFAULT_CACHE_MAX_SIZE),
+                )
+
+        return self.case_cache
+
+    def _get_uploader(self):
+        upload_config = self.config.get(u"async_upload")
+        if upload_config is None:
+            return None
+
+        with self._setup_lock:
+            if not self.uploader:
+                self.uploader = BackgroundUploader(
+                    process=self._report_scenario_result,
+                    workers=upload_config.get(u"workers", DEFAULT_UPLOAD_WORKERS),
+                    queue_size=upload_config.get(
+                        u"queue_size", DEFAULT_UPLOAD_QUEUE_SIZE
+                    ),
+                )
+
+        return self.uploader
+
+    def _get_attachment_uploader(self):
+        attachments_config = self.config.get(u"attachments", {})
+        testrail_client = self._get_testrail_client()
+        with self._setup_lock:
+            if not self.attachment_uploader:
+                self.attachment_uploader = AttachmentUploader(
+                    testrail_client,
+                    workers=attachments_config.get(
+                        u"workers", DEFAULT_ATTACHMENT_WORKERS
+                    ),
+                    max_size=attachments_config.get(
+                        u"max_size", DEFAULT_ATTACHMENT_MAX_SIZE
+                    ),
+                    run_budget=attachments_config.get(u"run_budget"),
+                )
+
+        return self.attachment_uploader
+
+    def _get_async_sender(self):
+        async_config = self.config.get(u"async_api")
+        if async_config is None:
+            return None
+
+        testrail_client = self._get_testrail_client()
+        with self._setup_lock:
+            if not self.async_sender:
+                # Imported here, the coroutines need python 3.5 or newer.
+                from .async_api import (
+                    DEFAULT_CONCURRENCY,
+                    AsyncAPIClient,
+                    AsyncResultSender,
+                    EventLoopThread,
+                )
+
+                self.async_sender = AsyncResultSender(
+                    reporter=self,
+                    client=AsyncAPIClient(
+                        testrail_client,
+                        concurrency=async_config.get(
+                            u"concurrency", DEFAULT_CONCURRENCY
+                        ),
+                    ),
+                    loop_thread=EventLoopThread(),
+                )
+
+        return self.async_sender
+
+    def _get_async_drain_timeout(self):
+        return self.config[u"async_api"].get(u"drain_timeout", DEFAULT_DRAIN_TIMEOUT)
 
     def _load_test_cases_for_project(self, project):
-        cases = self._get_testrail_client().get_cases(project.id, project.suite_id)
-        project.cases = {str(case[u"id"]): case for case in cases}
+        coordinator = self._get_coordinator()
+        if not coordinator:
+            self._fetch_test_cases_for_project(project)
+            return
+
+        case_index_key = (self._get_testrail_client().url, project.id, project.suite_id)
+        # The first worker downloads the cases and shares their ids with the others.
+        with coordinator.lock(u"cases", case_index_key):
+            case_ids = coordinator.read_case_ids(case_index_key)
+            if case_ids is None:
+                self._fetch_test_cases_for_project(project)
+                coordinator.write_case_ids(case_index_key, project.cases)
+                return
+
+        if self._uses_compact_case_index():
+            project.cases = CaseIndex(case_ids)
+        else:
+            project.cases = {case_id: {u"id": int(case_id)} for case_id in case_ids}
+
+    def _uses_compact_case_index(self):
+        return self.config.get(u"compact_case_index", False)
+
+    def _looks_up_cases(self):
+        if self.referenced_case_ids is None:
+            return False
+        max_cases = self.config.get(u"case_lookup", {}).get(
+            u"max_cases", DEFAULT_LOOKUP_MAX_CASES
+        )
+        return len(self.referenced_case_ids) <= max_cases
+
+    def _look_up_cases(self, projects, case_ids):
+        """
+        Requests the case_ids one by one and adds them to the cases of the projects
+        with the same suite.
+        """
+        case_ids = sorted(set(case_ids) - self._looked_up_case_ids)
+        self._looked_up_case_ids.update(case_ids)
+        cases = self._get_testrail_client().iter_cases_by_id(
+            case_ids,
+            workers=self.config.get(u"case_lookup", {}).get(
+                u"workers", DEFAULT_LOOKUP_WORKERS
+            ),
+        )
+        for case in cases:
+            for project in projects:
+                if case.get(u"suite_id") == project.suite_id:
+                    project.cases[str(case[u"id"])] = case
+
+    def _load_available_test_cases_for_project(self, project):
+        try:
+            self._load_test_cases_for_project(project)
+        except APIError:
+            if not self._uses_circuit_breaker():
+                raise
+            project.cases = UnavailableCases()
+
+    def _look_up_available_cases(self, projects, case_ids):
+        projects = [
+            project
+            for project in projects
+            if not isinstance(project.cases, UnavailableCases)
+        ]
+        if not projects:
+            return
+
+        try:
+            self._look_up_cases(projects, case_ids)
+        except APIError:
+            if not self._uses_circuit_breaker():
+                raise
+            for project in projects:
+                project.cases = UnavailableCases()
+
+    def _fetch_test_cases_for_project(self, project):
+        compact_case_index = self._uses_compact_case_index()
+        case_cache = self._get_case_cache()
+        if case_cache:
+            cases = case_cache.get_cases(
+                self._get_testrail_client(), project.id, project.suite_id
+            )
+            project.cases = CaseIndex(cases) if compact_case_index else cases
+            return
+
+        cases = self._get_testrail_client().iter_cases(project.id, project.suite_id)
+        if compact_case_index:
+            # Only the ids are kept, each page of cases is released once read.
+            project.cases = CaseIndex(case[u"id"] for case in cases)
+        else:
+            project.cases = {str(case[u"id"]): case for case in cases}
 
     def _get_testrail_client(self):
-        if not self.testrail_client:
-            self.testrail_client = APIClient(base_url=self.config.get(u"base_url"))
+        with self._setup_lock:
+            if not self.testrail_client:
+                self.testrail_client = self._build_testrail_client()
 
         return self.testrail_client
 
+    def _build_testrail_client(self):
+        # Imported here, requests is only needed once there is something to report.
+        from .api import DEFAULT_POOL_SIZE, APIClient
+
+        api_config = self.config.get(u"api", {})
+        rate_limiter = None
+        if u"rate_limit" in api_config:
+            rate_limiter = RateLimiter(
+                rate=api_config[u"rate_limit"],
+                burst=api_config.get(u"rate_limit_burst", 1),
+            )
+        circuit_breaker = None
+        if self._uses_circuit_breaker():
+            circuit_breaker_config = self.config[u"circuit_breaker"]
+            circuit_breaker = CircuitBreaker(
+                failure_threshold=circuit_breaker_config.get(
+                    u"failure_threshold", DEFAULT_FAILURE_THRESHOLD
+                ),
+                cool_down=circuit_breaker_config.get(u"cool_down", DEFAULT_COOL_DOWN),
+            )
+
+        return APIClient(
+            base_url=self.config.get(u"base_url"),
+            page_workers=api_config.get(u"page_workers", 1),
+            retry_policy=RetryPolicy(
+                max_retries=api_config.get(u"max_retries", DEFAULT_MAX_RETRIES),
+                backoff_factor=api_config.get(
+                    u"backoff_factor", DEFAULT_BACKOFF_FACTOR
+                ),
+                max_backoff=api_config.get(u"max_backoff", DEFAULT_MAX_BACKOFF),
+            ),
+            rate_limiter=rate_limiter,
+            pool_size=api_config.get(u"pool_size", DEFAULT_POOL_SIZE),
+            keep_alive=api_config.get(u"keep_alive", True),
+            connect_timeout=api_config.get(u"connect_timeout"),
+            read_timeout=api_config.get(u"read_timeout"),
+            gzip_threshold=api_config.get(u"gzip_threshold"),
+            circuit_breaker=circuit_breaker,
+        )
+
+    def _uses_circuit_breaker(self):
+        return self.config.get(u"circuit_breaker") is not None
+
+    def _get_result_buffer(self, project):
+        if project not in self.result_buffers:
+            self.result_buffers[project] = self._build_result_buffer()
+
+        return self.result_buffers[project]
+
+    def _build_result_buffer(self):
+        results_config = self.config.get(u"results", {})
+        return ResultBuffer(
+            max_results=results_config.get(u"batch_size", DEFAULT_BATCH_SIZE),
+            max_bytes=results_config.get(u"batch_max_bytes", DEFAULT_BATCH_MAX_BYTES),
+        )
+
+    def _get_result_aggregator(self, project):
+        if project not in self.result_aggregators:
+            results_config = self.config.get(u"results", {})
+            self.result_aggregators[project] = ResultAggregator(
+                statuses=self.AGGREGATE_STATUSES,
+                max_failures=results_config.get(
+                    u"aggregate_max_failures", DEFAULT_AGGREGATE_MAX_FAILURES
+                ),
+            )
+
+        return self.result_aggregators[project]
+
     def _add_test_result(
-        self, project, case_id, status, comment=u"", elapsed_seconds=1
+        self, project, case_id, status, comment=u"", elapsed_seconds=1, attachments=()
     ):
-        if not project.test_run:
-            self.setup_test_run(project)
+        """
+        Queues the test result for the project, the test run is set up and the results
+        are sent in batches when the buffer is full or when the reporter ends.
+        With `results.aggregate` the results of each case are merged until flushed.
+        """
+        if self.config.get(u"results", {}).get(u"aggregate"):
+            with self._lock:
+                self._get_result_aggregator(project).add(
+                    case_id, status, comment, elapsed_seconds, attachments
+                )
+            return
+
+        self._queue_test_result(
+            project, case_id, status, comment, elapsed_seconds, attachments
+        )
+
+    def _queue_test_result(
+        self, project, case_id, status, comment, elapsed_seconds, attachments=()
+    ):
+        if self.config.get(u"delta_sync") is not None and self._is_unchanged_result(
+            project, int(case_id), status
+        ):
+            return
 
         elapsed_seconds_formatted = self._format_duration(elapsed_seconds)
+        result = {
+            u"case_id": int(case_id),
+            u"status_id": status,
+            u"comment": comment,
+            u"elapsed": elapsed_seconds_formatted,
+        }
+
+        result_spool = self._get_result_spool()
+        if result_spool:
+            result = self._spool_result(result_spool, project, result)
+        if attachments:
+            result[ATTACHMENTS_FIELD] = list(attachments)
+
+        with self._lock:
+            result_buffer = self._get_result_buffer(project)
+            result_buffer.add(result)
+            batches = list(result_buffer.drain()) if result_buffer.is_full() else []
+
+        if batches:
+            self._submit_batches(project, batches)
+
+    def _is_unchanged_result(self, project, case_id, status):
+        """
+        Returns True when the latest result of the case in the test run has the same
+        status and is at most `delta_sync.max_age` seconds old, the result is then not
+        sent. Otherwise the result is recorded as the latest one.
+        """
+        try:
+            latest_results = self._get_latest_results(project, case_id)
+        except APIError:
+            if not self._uses_circuit_breaker():
+                raise
+            # Without the latest results the result is sent, or written to the
+            # fallback file while Testrail is unavailable.
+            return False
+        max_age = self.config[u"delta_sync"].get(u"max_age")
+        now = time.time()
+
+        with self._lock:
+            latest_status, created_on = latest_results.get(case_id, (None, None))
+            if latest_status == status and (
+                max_age is None
+                or (created_on is not None and now - created_on <= max_age)
+            ):
+                self.unchanged_results += 1
+                return True
+
+            latest_results[case_id] = (status, now)
+            return False
+
+    def _get_latest_results(self, project, case_id):
+        if not project.test_run:
+            self._ensure_test_run(project, [case_id])
+
+        with project.lock:
+            if project.latest_results is None:
+                project.latest_results = self._fetch_latest_results(project)
+
+        return project.latest_results
+
+    def _fetch_latest_results(self, project):
+        """
+        Returns the status of each tested case in the test run from its tests. With a
+        `max_age` the time of the results created since then is requested too.
+        """
+        testrail_client = self._get_testrail_client()
+        test_run_id = project.test_run[u"id"]
+        latest_results = {}
+        test_case_ids = {}
+        for test in testrail_client.iter_tests(test_run_id):
+            if test.get(u"status_id") in (None, self.STATUS_UNTESTED):
+                continue
+            latest_results[test[u"case_id"]] = (test[u"status_id"], None)
+            test_case_ids[test[u"id"]] = test[u"case_id"]
+
+        max_age = self.config[u"delta_sync"].get(u"max_age")
+        if max_age is None:
+            return latest_results
 
-        return self._get_testrail_client().create_result(
-            project.test_run[u"id"],
-            case_id,
-            status=status,
-            comment=comment,
-            elapsed=elapsed_seconds_formatted,
+        results = testrail_client.iter_results_for_run(
+            test_run_id, created_after=time.time() - max_age
         )
+        for result in results:
+            case_id = test_case_ids.get(result[u"test_id"])
+            if case_id is None:
+                continue
+            status, created_on = latest_results[case_id]
+            if created_on is None or result[u"created_on"] > created_on:
+                latest_results[case_id] = (status, result[u"created_on"])
 
-    def _buid_comment_for_scenario(self, scenario):
-        comment = u"{}\n".format(scenario.name)
-        comment += u"\n".join(
-            [
-                u"->  {} {} [{}]".format(step.keyword, step.name, step.status)
-                for step in scenario.steps
-            ]
+        return latest_results
+
+    def _spool_result(self, result_spool, project, result):
+        """
+        Writes the result to the spool before it is sent and returns it with its key.
+        """
+        key = build_spool_key()
+        spool_key_line = SPOOL_KEY_TEMPLATE.format(key=key)
+        result = dict(result)
+        # The key must be kept whole for resume to find the result.
+        result[u"comment"] = (
+            self._get_comment_policy().truncate(
+                result[u"comment"] or u"", reserved_size=len(spool_key_line)
+            )
+            + spool_key_line
+        )
+        record = {
+            u"key": key,
+            u"project_id": project.id,
+            u"suite_id": project.suite_id,
+            u"test_run_name": project.get_test_run_name(branch_name=self.branch_name),
+            u"result": result,
+            u"created_on": int(time.time()),
+        }
+        if project.config_ids:
+            record[u"config_ids"] = project.config_ids
+        if self._uses_test_plan():
+            # resume reports to the plan of this execution, its branch can differ.
+            record[u"test_plan_name"] = self._get_test_plan_name(project)
+        result_spool.append(record)
+        result[SPOOL_KEY_FIELD] = key
+        return result
+
+    def resume(self):
+        """
+        Sends the results left in the spool by an interrupted execution, skipping the
+        ones Testrail already has so they are never sent twice.
+        """
+        result_spool = self._get_result_spool()
+        if not result_spool:
+            raise Exception(u"Your testrail.yml config file does not have a spool!")
+
+        records_by_run = {}
+        for record in result_spool.pending():
+            run_key = (
+                record[u"project_id"],
+                record[u"suite_id"],
+                tuple(record.get(u"config_ids", ())),
+                record[u"test_run_name"],
+                record.get(u"test_plan_name"),
+            )
+            records_by_run.setdefault(run_key, []).append(record)
+
+        for run_key, records in records_by_run.items():
+            project_id, suite_id, config_ids, test_run_name, test_plan_name = run_key
+            project = self._get_project(project_id, suite_id, list(config_ids))
+            if project is None:
+                continue
+            # Each test run name gets its own copy, the spool can hold several branches.
+            run_project = TestrailProject(
+                id=project.id,
+                name=project.name,
+                suite_id=project.suite_id,
+                allowed_branch_pattern=project.allowed_branch_pattern,
+                config_ids=project.config_ids,
+            )
+            self.setup_test_run(
+                run_project, test_run_name=test_run_name, test_plan_name=test_plan_name
+            )
+            self._resume_results(result_spool, run_project, records)
+
+        self.flush_results()
+
+    def _resume_results(self, result_spool, project, records):
+        created_after = None
+        # Records spooled by older versions have no time, all the results are read.
+        if all(u"created_on" in record for record in records):
+            created_after = (
+                min(record[u"created_on"] for record in records) - RESUME_CLOCK_MARGIN
+            )
+
+        sent_keys = set()
+        for result in self._get_testrail_client().iter_results_for_run(
+            project.test_run[u"id"], created_after=created_after
+        ):
+            sent_keys.update(find_spool_keys(result.get(u"comment")))
+
+        result_buffer = self._build_result_buffer()
+        for record in records:
+            if record[u"key"] in sent_keys:
+                result_spool.acknowledge([record[u"key"]])
+                continue
+            result = dict(record[u"result"])
+            result[SPOOL_KEY_FIELD] = record[u"key"]
+            result_buffer.add(result)
+
+        for results in result_buffer.drain():
+            self._send_results(project, results)
+
+    def _get_project(self, project_id, suite_id, config_ids=()):
+        for testrail_project in self.projects:
+            if testrail_project.id != project_id:
+                continue
+            if testrail_project.suite_id != suite_id:
+                continue
+            if testrail_project.config_ids == sorted(config_ids):
+                return testrail_project
+        return None
+
+    def flush_results(self):
+        """
+        Sends all the queued test results to Testrail, one project per worker.
+        """
+        if self.config.get(u"async_api") is not None:
+            # The projects are already sent concurrently by the event loop, the sender
+            # is only created once there are batches to send.
+            for project in self.projects:
+                self._flush_results_for_project(project)
+            if self.async_sender:
+                self.async_sender.wait(timeout=self._get_async_drain_timeout())
+            return
+
+        self._run_for_projects(self._flush_results_for_project, self.projects)
+        self._wait_for_batches()
+
+    def _run_for_projects(self, function, projects):
+        """
+        Calls function for each project using up to `project_workers` threads,
+        so working with several projects takes about as long as the slowest one.
+        """
+        workers = min(
+            self.config.get(u"project_workers", DEFAULT_PROJECT_WORKERS), len(projects)
+        )
+        if workers <= 1:
+            return [function(project) for project in projects]
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            return list(executor.map(function, projects))
+        finally:
+            executor.shutdown(wait=True)
+
+    def _ensure_test_run(self, project, case_ids=()):
+        with project.lock:
+            if not project.test_run:
+                self.setup_test_run(project, case_ids=case_ids)
+            if not self._includes_all_cases():
+                self._include_cases_in_test_run(project, case_ids)
+
+    def _includes_all_cases(self):
+        return self.config.get(u"test_runs", {}).get(u"include_all", True)
+
+    def _include_cases_in_test_run(self, project, case_ids):
+        """
+        Adds the case_ids missing from a test run created without include_all,
+        all of them with a single update_run request.
+        """
+        test_run = project.test_run
+        if test_run.get(u"include_all"):
+            return
+        if project.run_case_ids is not None and project.run_case_ids.issuperset(
+            case_ids
+        ):
+            return
+
+        coordinator = self._get_coordinator()
+        if coordinator:
+            # Other workers can add cases to the same run, update_run replaces the
+            # cases so they are read again under the lock.
+            with coordinator.lock(u"run_cases", test_run[u"id"]):
+                project.run_case_ids = None
+                self._update_test_run_cases(project, case_ids)
+        else:
+            self._update_test_run_cases(project, case_ids)
+
+    def _update_test_run_cases(self, project, case_ids):
+        testrail_client = self._get_testrail_client()
+        test_run_id = project.test_run[u"id"]
+        if project.run_case_ids is None:
+            project.run_case_ids = set(
+                test[u"case_id"] for test in testrail_client.iter_tests(test_run_id)
+            )
+
+        run_case_ids = project.run_case_ids.union(case_ids)
+        if run_case_ids != project.run_case_ids and project.test_run.get(u"plan_id"):
+            testrail_client.update_plan_run(project.test_run, sorted(run_case_ids))
+            project.test_run = dict(project.test_run, include_all=False)
+            project.run_case_ids = run_case_ids
+        elif run_case_ids != project.run_case_ids:
+            project.test_run = testrail_client.update_run(
+                test_run_id, sorted(run_case_ids)
+            )
+            project.run_case_ids = run_case_ids
+
+    def _flush_results_for_project(self, project):
+        with self._lock:
+            result_aggregator = self.result_aggregators.get(project)
+            aggregated_results = (
+                list(result_aggregator.drain()) if result_aggregator else []
+            )
+            aggregated_attachments = (
+                result_aggregator.drain_attachments() if result_aggregator else {}
+            )
+
+        comment_policy = self._get_comment_policy()
+        for case_id, status, comment_lines, elapsed_seconds in aggregated_results:
+            self._queue_test_result(
+                project,
+                case_id,
+                status,
+                comment_policy.join(comment_lines),
+                elapsed_seconds,
+                aggregated_attachments.get(case_id, ()),
+            )
+
+        with self._lock:
+            result_buffer = self.result_buffers.get(project)
+            batches = list(result_buffer.drain()) if result_buffer else []
+
+        if batches and not self._includes_all_cases():
+            # All the cases flushed are added to the test run at once.
+            try:
+                self._ensure_test_run(
+                    project,
+                    [result[u"case_id"] for results in batches for result in results],
+                )
+            except APIError:
+                if not self._uses_circuit_breaker():
+                    raise
+        if batches:
+            self._submit_batches(project, batches)
+
+    def _submit_batches(self, project, batches):
+        """
+        Sends the batches in the background, Behave goes on while they are sent.
+        The batches of each project are sent in the order they were submitted.
+        """
+        if self.config.get(u"async_api") is not None:
+            self._send_batches(project, batches)
+            return
+
+        batch_executor = self._get_batch_executor()
+        with self._lock:
+            batch_send = batch_executor.submit(
+                self._send_batches_after,
+                self._project_batch_sends.get(project),
+                project,
+                batches,
+            )
+            self._project_batch_sends[project] = batch_send
+            self._batch_sends.append(batch_send)
+
+    def _send_batches_after(self, previous_send, project, batches):
+        # The executor starts the sends in order, so the previous one already runs.
+        if previous_send is not None:
+            wait([previous_send])
+        self._send_batches(project, batches)
+
+    def _get_batch_executor(self):
+        with self._setup_lock:
+            if not self.batch_executor:
+                self.batch_executor = ThreadPoolExecutor(
+                    max_workers=self.config.get(
+                        u"project_workers", DEFAULT_PROJECT_WORKERS
+                    )
+                )
+
+        return self.batch_executor
+
+    def _wait_for_batches(self):
+        """
+        Waits for the batches submitted so far, raising the first error of their sends.
+        """
+        with self._lock:
+            batch_sends, self._batch_sends = self._batch_sends, []
+            self._project_batch_sends = {}
+
+        wait(batch_sends)
+        for batch_send in batch_sends:
+            batch_send.result()
+
+    def _send_batches(self, project, batches):
+        async_sender = self._get_async_sender()
+        if async_sender:
+            async_sender.submit(project, batches)
+            return
+
+        for results in batches:
+            self._send_results(project, results)
+
+    def _send_results(self, project, results):
+        payload, spool_keys = self._build_results_payload(results)
+        try:
+            self._ensure_test_run(project, [result[u"case_id"] for result in results])
+        except APIError as error:
+            if not self._uses_circuit_breaker():
+                raise
+            self._record_failed_results(project, results, spool_keys, error)
+            return
+
+        try:
+            sent_results = self._get_testrail_client().create_results(
+                project.test_run[u"id"], payload
+            )
+        except APIError as error:
+            # A rejected batch does not tell which case was wrong, so the results are
+            # sent one by one to keep the summary accurate for each case.
+            if len(results) > 1 and self._is_client_error(error):
+                for result in results:
+                    self._send_results(project, [result])
+                return
+            self._record_failed_results(project, results, spool_keys, error)
+        else:
+            self._record_sent_results(results, spool_keys)
+            self._upload_attachments(project, results, sent_results)
+
+    def _build_results_payload(self, results):
+        spool_keys = [result.get(SPOOL_KEY_FIELD) for result in results]
+        payload = results
+        if any(spool_keys) or any(ATTACHMENTS_FIELD in result for result in results):
+            payload = [self._without_internal_fields(result) for result in results]
+        return payload, spool_keys
+
+    def _record_failed_results(self, project, results, spool_keys, error):
+        with self._lock:
+            self.failed_cases.extend(str(result[u"case_id"]) for result in results)
+        # Results rejected by Testrail would be rejected again when resuming.
+        if self._is_client_error(error):
+            if self.result_spool:
+                self.result_spool.acknowledge(spool_keys)
+        elif self._uses_circuit_breaker():
+            self._fall_back_results(project, results)
+
+    def _fall_back_results(self, project, results):
+        """
+        Writes the results Testrail was not available for to the fallback file, they
+        can be sent later by `resume` with the file as spool. The results already
+        written to the spool are left there.
+        """
+        fallback_spool = self._get_fallback_spool()
+        for result in results:
+            if result.get(SPOOL_KEY_FIELD):
+                continue
+            self._spool_result(
+                fallback_spool, project, self._without_internal_fields(result)
+            )
+            with self._lock:
+                self.fallback_results += 1
+
+    def _record_sent_results(self, results, spool_keys):
+        with self._lock:
+            self.case_summary[Status.passed.name] += len(results)
+        if self.result_spool:
+            self.result_spool.acknowledge(spool_keys)
+
+    def _upload_attachments(self, project, results, sent_results):
+        """
+        Queues the attachments of the results for upload, Testrail answers with the
+        results created in the order they were sent.
+        """
+        if not any(ATTACHMENTS_FIELD in result for result in results):
+            return
+
+        attachment_uploader = self._get_attachment_uploader()
+        for result, sent_result in zip(results, sent_results):
+            for path in result.get(ATTACHMENTS_FIELD, ()):
+                attachment_uploader.upload(
+                    project.test_run[u"id"], sent_result[u"id"], path
+                )
+
+    def _without_internal_fields(self, result):
+        result = dict(result)
+        result.pop(SPOOL_KEY_FIELD, None)
+        result.pop(ATTACHMENTS_FIELD, None)
+        return result
+
+    def _is_client_error(self, error):
+        return (
+            error.status_code is not None
+            and 400 <= error.status_code < 500
+            and error.status_code != 429
         )
 
-        return comment
+    def _buid_comment_for_scenario(self, scenario):
+        return self._get_comment_policy().build(scenario)
+
+    def _get_comment_policy(self):
+        if not self.comment_policy:
+            comments_config = self.config.get(u"comments", {})
+            self.comment_policy = CommentPolicy(
+                verbosity=comments_config.get(u"verbosity", VERBOSITY_FULL),
+                max_steps=comments_config.get(u"max_steps"),
+                max_size=comments_config.get(u"max_size"),
+            )
+
+        return self.comment_policy
 
     def _format_duration(self, duration):
         """
@@ -252,50 +1751,181 @@ class TestrailReporter(Reporter):
 
         return u"{duration_seconds}s".format(duration_seconds=duration_seconds)
 
-    def process_scenario(self, scenario):
+    def _parse_case_ids(self, tags):
+        prefix_length = len(TestrailReporter.CASE_TAG_PREFIX)
+        return [
+            tag[prefix_length:]
+            for tag in tags
+            if tag.startswith(TestrailReporter.CASE_TAG_PREFIX)
+        ]
+
+    def _get_routable_projects(self):
         """
-        Reports the test results for the given scenario to the testrail run.
+        Returns the projects the current branch is allowed to report to,
+        the branch patterns are only matched the first time.
         """
-        for tag in scenario.tags + scenario.feature.tags:
-            if tag.startswith(TestrailReporter.CASE_TAG_PREFIX):
-                case_id = tag[len(TestrailReporter.CASE_TAG_PREFIX) :]
-                # loop through all projects to ensure if test exists on both projects it is pushed
-                for testrail_project in self.projects:
-                    # If the branch is not allowed to generate a test run for
-                    # the project we just skip to the next project.
-                    if not self._can_generate_test_run_for_branch(
-                        testrail_project, self.branch_name
-                    ):
-                        continue
-                    if not testrail_project.cases:
-                        self._load_test_cases_for_project(testrail_project)
-                    if case_id in testrail_project.cases:
-                        testrail_status = TestrailReporter.STATUS_MAPS[
-                            scenario.status.name
+        if self._routable_projects is None:
+            self._routable_projects = [
+                testrail_project
+                for testrail_project in self.projects
+                if self._can_generate_test_run_for_branch(
+                    testrail_project, self.branch_name
+                )
+            ]
+
+        return self._routable_projects
+
+    def _get_case_routes(self):
+        """
+        Returns the index of each case id to the routable projects containing it,
+        loading the cases of the projects the first time.
+        """
+        with self._lock:
+            if self._case_routes is None:
+                routable_projects = self._get_routable_projects()
+                self._cases_looked_up = self._looks_up_cases()
+                if self._cases_looked_up:
+                    self._look_up_available_cases(
+                        routable_projects, self.referenced_case_ids
+                    )
+                else:
+                    self._load_suites(
+                        [
+                            testrail_project
+                            for testrail_project in routable_projects
+                            if not testrail_project.cases
                         ]
+                    )
+                case_routes = {}
+                # The compact index routes the cases when they are first reported, and
+                # so do the projects whose cases are unavailable.
+                if not self._uses_compact_case_index() and not any(
+                    isinstance(testrail_project.cases, UnavailableCases)
+                    for testrail_project in routable_projects
+                ):
+                    for testrail_project in routable_projects:
+                        for case_id in testrail_project.cases:
+                            case_routes.setdefault(case_id, []).append(testrail_project)
+                self._case_routes = case_routes
+
+        return self._case_routes
+
+    def _load_suites(self, projects):
+        """
+        Loads the cases of each suite once, the configurations of a suite share them.
+        """
+        projects_by_suite = {}
+        for testrail_project in projects:
+            projects_by_suite.setdefault(
+                (testrail_project.id, testrail_project.suite_id), []
+            ).append(testrail_project)
+
+        self._run_for_projects(
+            self._load_available_test_cases_for_project,
+            [suite_projects[0] for suite_projects in projects_by_suite.values()],
+        )
+        for suite_projects in projects_by_suite.values():
+            for testrail_project in suite_projects[1:]:
+                testrail_project.cases = suite_projects[0].cases
+
+    def _route_case(self, case_id):
+        """
+        Returns the routable projects containing the case, they are kept for the next
+        results of the case.
+        """
+        with self._lock:
+            if case_id not in self._case_routes:
+                self._case_routes[case_id] = [
+                    testrail_project
+                    for testrail_project in self._get_routable_projects()
+                    if case_id in testrail_project.cases
+                ]
 
-                        # When adding a test result untested status is not allowed status
-                        # @see http://docs.gurock.com/testrail-api2/reference-results#add_result
-                        if testrail_status is self.STATUS_UNTESTED:
-                            self.case_summary[Status.skipped.name] += 1
-                            continue
-
-                        comment = self._buid_comment_for_scenario(scenario)
-                        is_added = self._add_test_result(
-                            project=testrail_project,
-                            case_id=case_id,
-                            status=testrail_status,
-                            comment=comment,
-                            elapsed_seconds=scenario.duration,
+        return self._case_routes[case_id]
+
+    def _route_unscanned_cases(self, case_ids):
+        """
+        Looks up the cases tagged in feature files prescan did not read.
+        """
+        with self._lock:
+            case_ids = [
+                case_id
+                for case_id in case_ids
+                if case_id not in self._looked_up_case_ids
+            ]
+            if not case_ids:
+                return
+
+            routable_projects = self._get_routable_projects()
+            self._look_up_available_cases(routable_projects, case_ids)
+            for testrail_project in routable_projects:
+                for case_id in case_ids:
+                    if case_id in testrail_project.cases:
+                        self._case_routes.setdefault(case_id, []).append(
+                            testrail_project
                         )
 
-                        if is_added:
-                            self.case_summary[Status.passed.name] += 1
-                        else:
-                            self.failed_cases.append(case_id)
-                    else:
-                        self.case_summary[Status.untested.name] += 1
+    def process_scenario(self, scenario, feature_case_ids=None):
+        """
+        Reports the test results for the given scenario to the testrail run.
+        With `async_upload` configured the scenario is queued for the uploader threads.
+        """
+        attachments = self._pop_attachments(scenario)
+        if feature_case_ids is None:
+            feature_case_ids = self._parse_case_ids(scenario.feature.tags)
+        case_ids = self._parse_case_ids(scenario.tags) + feature_case_ids
+        # If the branch is not allowed to generate a test run for
+        # any project there is nothing to report.
+        if not case_ids or not self._get_routable_projects():
+            return
+
+        uploader = self._get_uploader()
+        if uploader:
+            uploader.put(ScenarioResult.from_scenario(scenario, case_ids, attachments))
+        else:
+            self._report_scenario(scenario, case_ids, attachments)
+
+    def _report_scenario_result(self, scenario_result):
+        self._report_scenario(
+            scenario_result, scenario_result.case_ids, scenario_result.attachments
+        )
+
+    def _report_scenario(self, scenario, case_ids, attachments=()):
+        routable_projects = self._get_routable_projects()
+        case_routes = self._get_case_routes()
+        if self._cases_looked_up:
+            self._route_unscanned_cases(case_ids)
+        testrail_status = TestrailReporter.STATUS_MAPS[scenario.status.name]
+        comment = None
+
+        for case_id in case_ids:
+            # the case is pushed to all the projects containing it
+            testrail_projects = case_routes.get(case_id)
+            if testrail_projects is None:
+                testrail_projects = self._route_case(case_id)
+            missing_projects = len(routable_projects) - len(testrail_projects)
+            with self._lock:
+                self.case_summary[Status.untested.name] += missing_projects
+
+            for testrail_project in testrail_projects:
+                # When adding a test result untested status is not allowed status
+                # @see http://docs.gurock.com/testrail-api2/reference-results#add_result
+                if testrail_status is self.STATUS_UNTESTED:
+                    with self._lock:
+                        self.case_summary[Status.skipped.name] += 1
+                    continue
+
+                if comment is None:
+                    comment = self._buid_comment_for_scenario(scenario)
+                self._add_test_result(
+                    project=testrail_project,
+                    case_id=case_id,
+                    status=testrail_status,
+                    comment=comment,
+                    elapsed_seconds=scenario.duration,
+                    attachments=attachments,
+                )
 
-    def process_scenario_outline(self, scenario_outline):
+    def process_scenario_outline(self, scenario_outline, feature_case_ids=None):
         for scenario in scenario_outline.scenarios:
-            self.process_scenario(scenario)
+            self.process_scenario(scenario, feature_case_ids)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+# Testrail answers 429 when the request quota is exceeded and 5xx when it is overloaded.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# POST requests are not idempotent, they are only retried when Testrail did not process
+# them: over quota or unavailable.
+POST_RETRY_STATUS_CODES = (429, 503)
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOL_DOWN = 60.0
+CIRCUIT_CLOSED = u"closed"
+CIRCUIT_OPEN = u"open"
+CIRCUIT_HALF_OPEN = u"half-open"
+
+
+class RetryPolicy(object):
+    """
+    Decides how long to wait before retrying a failed request, using exponential backoff
+    with full jitter unless the server tells how long to wait with `Retry-After`.
+    No wait is longer than `max_backoff` seconds.
+    """
+
+    def __init__(
+        self,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_factor=DEFAULT_BACKOFF_FACTOR,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+    ):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def can_retry(self, attempt):
+        return attempt < self.max_retries
+
+    def get_delay(self, attempt, retry_after=None):
+        retry_after_seconds = self._parse_retry_after(retry_after)
+        if retry_after_seconds is not None:
+            return min(self.max_backoff, retry_after_seconds)
+
+        backoff = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, backoff)
+
+    def _parse_retry_after(self, retry_after):
+        """
+        Retry-After is either a number of seconds or an HTTP date.
+        """
+        if not retry_after:
+            return None
+
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+        retry_after_date = parsedate_tz(retry_after)
+        if retry_after_date is None:
+            return None
+        return max(0.0, mktime_tz(retry_after_date) - time.time())
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing `rate` requests per second on average with bursts of up to
+    `burst` requests. It is shared by all the threads sending requests with one client.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, waiting until it is available.
+        Returns the number of seconds waited.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            # The token is reserved before waiting so concurrent callers queue up behind it.
+            self.tokens -= 1
+            wait_seconds = max(0.0, -self.tokens / self.rate)
+
+        if wait_seconds:
+            time.sleep(wait_seconds)
+        return wait_seconds
+
+
+class CircuitBreaker(object):
+    """
+    Stops the requests after `failure_threshold` consecutive failures, so an
+    unavailable Testrail fails fast instead of every request waiting for its timeout.
+
+    Once `cool_down` seconds have passed one request is let through, the circuit
+    closes again when it succeeds and stays open for another cool down when it fails.
+    It is shared by all the threads sending requests with one client.
+    """
+
+    def __init__(
+        self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cool_down=DEFAULT_COOL_DOWN
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cool_down = cool_down
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected_requests = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+
+            now = time.time()
+            if now - self.opened_at >= self.cool_down:
+                # The cool down restarts so a trial request that never finished
+                # does not keep the circuit half open forever.
+                self.state = CIRCUIT_HALF_OPEN
+                self.opened_at = now
+                return True
+
+            self.rejected_requests += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = CIRCUIT_CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or (
+                self.state == CIRCUIT_CLOSED
+                and self.failures >= self.failure_threshold
+            ):
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.time()
+                self.opened += 1
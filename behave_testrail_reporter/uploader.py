@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+DEFAULT_UPLOAD_WORKERS = 1
+DEFAULT_UPLOAD_QUEUE_SIZE = 1000
+DEFAULT_DRAIN_TIMEOUT = 300
+
+_STOP = object()
+
+
+class BackgroundUploader(object):
+    """
+    Runs `process` for each queued record in worker threads, so reporting to Testrail
+    happens while Behave keeps executing the following features.
+    When the queue is full `put` blocks until a worker takes a record.
+    """
+
+    def __init__(
+        self,
+        process,
+        workers=DEFAULT_UPLOAD_WORKERS,
+        queue_size=DEFAULT_UPLOAD_QUEUE_SIZE,
+    ):
+        self.process = process
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.errors = []
+        self.threads = []
+        for index in range(max(1, workers)):
+            thread = threading.Thread(
+                target=self._work, name=u"testrail-uploader-{}".format(index)
+            )
+            # Daemon threads never keep Behave alive after a drain timeout.
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def _work(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self.process(record)
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                self.queue.task_done()
+
+    def drain(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        Waits up to timeout seconds for the workers to process all the queued records.
+        Returns the number of records that could not be processed in time.
+        """
+        deadline = time.time() + timeout
+        try:
+            for _ in self.threads:
+                self.queue.put(_STOP, timeout=max(0, deadline - time.time()))
+        except queue.Full:
+            pass
+
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+
+        with self.queue.mutex:
+            queued_stops = sum(1 for record in self.queue.queue if record is _STOP)
+            return self.queue.unfinished_tasks - queued_stops
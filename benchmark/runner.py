@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+from behave.model import Feature, Scenario, Step
+from behave.model_core import Status
+
+from behave_testrail_reporter import TestrailReporter
+
+from .stub_server import MAX_PAGE_SIZE, StubTestrailServer
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+SCENARIOS_PER_FEATURE = 10
+STEPS_PER_SCENARIO = 3
+# Modules the reporter must not import until they are needed.
+LAZY_MODULES = (u"jsonschema", u"requests", u"yaml")
+
+_IMPORT_TIME_CODE = u"""
+import json, sys, time
+started_at = time.time()
+import behave_testrail_reporter
+loaded_modules = [module for module in sys.argv[1:] if module in sys.modules]
+print(json.dumps([time.time() - started_at, loaded_modules]))
+"""
+
+
+def build_features(scenarios, scenarios_per_feature=SCENARIOS_PER_FEATURE):
+    """
+    Returns executed Behave features with `scenarios` scenarios in total, each one
+    tagged with its own case id starting at 1. One scenario in ten failed.
+    """
+    features = []
+    for first_case_id in range(1, scenarios + 1, scenarios_per_feature):
+        last_case_id = min(first_case_id + scenarios_per_feature, scenarios + 1)
+        feature_scenarios = []
+        for case_id in range(first_case_id, last_case_id):
+            steps = []
+            for index in range(STEPS_PER_SCENARIO):
+                step = Step(
+                    u"benchmark.feature", index, u"Given", u"given", u"step %d" % index
+                )
+                step.status = Status.passed
+                step.duration = 0.1
+                steps.append(step)
+            if case_id % 10 == 0:
+                steps[-1].status = Status.failed
+
+            feature_scenarios.append(
+                Scenario(
+                    u"benchmark.feature",
+                    case_id,
+                    u"Scenario",
+                    u"Scenario %d" % case_id,
+                    tags=[u"testrail-C{}".format(case_id)],
+                    steps=steps,
+                )
+            )
+
+        features.append(
+            Feature(
+                u"benchmark.feature",
+                1,
+                u"Feature",
+                u"Feature %d" % first_case_id,
+                scenarios=feature_scenarios,
+            )
+        )
+    return features
+
+
+def write_feature_file(path, features):
+    """
+    Writes the tags of the scenarios of features to path, for the reporter prescan.
+    """
+    with io.open(path, u"w", encoding=u"utf-8") as stream:
+        for feature in features:
+            stream.write(u"Feature: {}\n".format(feature.name))
+            for scenario in feature.scenarios:
+                stream.write(
+                    u"    {}\n".format(u" ".join(u"@" + tag for tag in scenario.tags))
+                )
+                stream.write(u"    Scenario: {}\n".format(scenario.name))
+
+
+def build_config(base_url, projects, settings=None, configurations=1):
+    """
+    With several configurations each project is reported once for each of them,
+    configuration ids start at 1.
+    """
+    projects_config = []
+    for project_id in range(1, projects + 1):
+        for config_id in range(1, configurations + 1):
+            project_config = {
+                u"id": project_id,
+                u"name": u"Benchmark {project_id} {branch}",
+                u"suite_id": project_id,
+                u"allowed_branch_pattern": u".*",
+            }
+            if configurations > 1:
+                project_config[u"name"] += u" %d" % config_id
+                project_config[u"config_ids"] = [config_id]
+            projects_config.append(project_config)
+
+    config = {u"base_url": base_url, u"projects": projects_config}
+    config.update(settings or {})
+    return config
+
+
+def run_benchmark(
+    scenarios,
+    projects,
+    latency=0.0,
+    page_size=MAX_PAGE_SIZE,
+    throttle_every=0,
+    settings=None,
+    measure_memory=True,
+    suite_size=None,
+    prescan=False,
+    runs=1,
+    outage=False,
+    configurations=1,
+):
+    """
+    Reports `scenarios` synthetic scenarios to `projects` projects of a stub Testrail
+    server and returns the wall time, the requests received by the server, the
+    results stored and the peak memory allocated by python.
+
+    The suites hold `suite_size` cases, by default as many as scenarios. With prescan
+    the reporter first reads the tags of the scenarios from a feature file. With
+    several runs the same scenarios are reported again, like a rerun pipeline. During
+    an outage the server answers every request with a 503. Each project is reported
+    under `configurations` configurations.
+    """
+    features = build_features(scenarios)
+    working_directory = os.getcwd()
+    directory = tempfile.mkdtemp()
+    stdout = sys.stdout
+    os.environ.setdefault(u"TESTRAIL_USER", u"benchmark@example.com")
+    os.environ.setdefault(u"TESTRAIL_KEY", u"benchmark")
+
+    with StubTestrailServer(
+        cases_per_project=suite_size or scenarios,
+        latency=latency,
+        page_size=page_size,
+        throttle_every=throttle_every,
+        unavailable=outage,
+    ) as server:
+        try:
+            os.chdir(directory)
+            with open(u"testrail.yml", u"w") as stream:
+                yaml.safe_dump(
+                    build_config(server.url, projects, settings, configurations),
+                    stream,
+                )
+            if prescan:
+                write_feature_file(u"benchmark.feature", features)
+
+            if measure_memory and tracemalloc:
+                tracemalloc.start()
+            # The summary printed by the reporter is not part of the results.
+            sys.stdout = io.StringIO()
+            started_at = time.time()
+
+            for _ in range(runs):
+                testrail_reporter = TestrailReporter(u"benchmark")
+                if prescan:
+                    testrail_reporter.prescan([u"benchmark.feature"])
+                for feature in features:
+                    testrail_reporter.feature(feature)
+                testrail_reporter.end()
+
+            wall_time = time.time() - started_at
+            peak_memory = None
+            if measure_memory and tracemalloc:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            sys.stdout = stdout
+            os.chdir(working_directory)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        u"scenarios": scenarios,
+        u"projects": projects,
+        u"wall_time": wall_time,
+        u"requests": dict(server.request_counts),
+        u"throttled_requests": server.throttled_requests,
+        u"results": server.count_results(),
+        u"peak_memory": peak_memory,
+    }
+
+
+def measure_import_time():
+    """
+    Imports the reporter in a new interpreter and returns the seconds it took and the
+    LAZY_MODULES it loaded.
+    """
+    output = subprocess.check_output(
+        [sys.executable, u"-c", _IMPORT_TIME_CODE] + list(LAZY_MODULES),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    import_time, loaded_modules = json.loads(output.decode(u"utf-8"))
+    return {u"import_time": import_time, u"lazy_modules_loaded": loaded_modules}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Measure the time taken to report to a local stub of Testrail."
+    )
+    parser.add_argument(u"--scenarios", type=int, default=1000)
+    parser.add_argument(u"--projects", type=int, default=3)
+    parser.add_argument(
+        u"--latency", type=float, default=0.0, help=u"Seconds added to each request."
+    )
+    parser.add_argument(u"--page-size", type=int, default=MAX_PAGE_SIZE)
+    parser.add_argument(
+        u"--suite-size",
+        type=int,
+        help=u"Cases in each suite, by default as many as scenarios.",
+    )
+    parser.add_argument(
+        u"--prescan",
+        action=u"store_true",
+        help=u"Read the tagged cases from a feature file before reporting.",
+    )
+    parser.add_argument(
+        u"--throttle-every",
+        type=int,
+        default=0,
+        help=u"Answer one request in every N with a 429.",
+    )
+    parser.add_argument(
+        u"--configurations",
+        type=int,
+        default=1,
+        help=u"Configurations each project is reported under.",
+    )
+    parser.add_argument(
+        u"--outage",
+        action=u"store_true",
+        help=u"Answer every request with a 503, like an unavailable Testrail.",
+    )
+    parser.add_argument(
+        u"--settings",
+        help=u"YAML file with testrail.yml settings to add, like async_upload.",
+    )
+    parser.add_argument(
+        u"--runs", type=int, default=1, help=u"Times the scenarios are reported."
+    )
+    parser.add_argument(u"--no-memory", action=u"store_true")
+    arguments = parser.parse_args(argv)
+
+    settings = None
+    if arguments.settings:
+        with open(arguments.settings, u"r") as stream:
+            settings = yaml.safe_load(stream)
+
+    results = run_benchmark(
+        scenarios=arguments.scenarios,
+        projects=arguments.projects,
+        latency=arguments.latency,
+        page_size=arguments.page_size,
+        throttle_every=arguments.throttle_every,
+        settings=settings,
+        measure_memory=not arguments.no_memory,
+        suite_size=arguments.suite_size,
+        prescan=arguments.prescan,
+        runs=arguments.runs,
+        outage=arguments.outage,
+        configurations=arguments.configurations,
+    )
+    results.update(measure_import_time())
+    print(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+import re
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+API_PREFIX = u"/api/v2/"
+MAX_PAGE_SIZE = 250
+_FILE_NAME_PATTERN = re.compile(b'filename="([^"]*)"')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubTestrailServer(object):
+    """
+    Local HTTP server answering the Testrail API v2 endpoints used by APIClient, with
+    every project holding the cases 1 to `cases_per_project` in its suite.
+
+    Each request waits `latency` seconds, pages hold at most `page_size` items and
+    every `throttle_every` requests one is answered with a 429. get_case answers every
+    case as part of the suite 1. While `unavailable` every request gets a 503.
+    """
+
+    def __init__(
+        self,
+        cases_per_project=100,
+        latency=0.0,
+        page_size=MAX_PAGE_SIZE,
+        throttle_every=0,
+        unavailable=False,
+    ):
+        self.cases_per_project = cases_per_project
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_every = throttle_every
+        self.unavailable = unavailable
+        self.request_counts = collections.Counter()
+        self.throttled_requests = 0
+        self.runs = {}
+        self.plans = {}
+        self.results = collections.defaultdict(list)
+        self.attachments = collections.defaultdict(list)
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return u"http://{}:{}/".format(host, port)
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keeps the connections open like Testrail does.
+            protocol_version = u"HTTP/1.1"
+            # Headers and body are written separately, Nagle would delay the body.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._handle(self, u"GET")
+
+            def do_POST(self):
+                server._handle(self, u"POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer((u"127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _parse_path(self, path):
+        """
+        Splits `/index.php?/api/v2/get_cases/1&suite_id=2` in the endpoint name, its
+        positional arguments and its query parameters.
+        """
+        uri = path.split(u"?", 1)[-1]
+        if not uri.startswith(API_PREFIX):
+            return None, [], {}
+
+        parts = uri[len(API_PREFIX) :].split(u"&")
+        endpoint_parts = parts[0].split(u"/")
+        parameters = dict(part.split(u"=", 1) for part in parts[1:] if u"=" in part)
+        return endpoint_parts[0], endpoint_parts[1:], parameters
+
+    def _read_body(self, handler):
+        body = handler.rfile.read(int(handler.headers.get(u"Content-Length") or 0))
+        if handler.headers.get(u"Content-Encoding") == u"gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if handler.headers.get(u"Content-Type", u"").startswith(u"multipart/"):
+            return body
+        return json.loads(body.decode(u"utf-8")) if body else {}
+
+    def _handle(self, handler, method):
+        endpoint, arguments, parameters = self._parse_path(handler.path)
+        data = self._read_body(handler) if method == u"POST" else None
+
+        with self._lock:
+            self._requests += 1
+            self.request_counts[endpoint] += 1
+            throttled = (
+                self.throttle_every and self._requests % self.throttle_every == 0
+            )
+            if throttled:
+                self.throttled_requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttled:
+            self._respond(handler, 429, {u"error": u"API rate limit exceeded"})
+            return
+        if self.unavailable:
+            self._respond(handler, 503, {u"error": u"Service unavailable"})
+            return
+
+        action = getattr(self, u"_{}".format(endpoint), None)
+        if action is None:
+            self._respond(handler, 404, {u"error": u"Unknown method"})
+            return
+
+        status, response = action(arguments, parameters, data)
+        self._respond(handler, status, response)
+
+    def _respond(self, handler, status, response):
+        body = json.dumps(response).encode(u"utf-8")
+        handler.send_response(status)
+        handler.send_header(u"Content-Type", u"application/json")
+        handler.send_header(u"Content-Length", str(len(body)))
+        if status == 429:
+            handler.send_header(u"Retry-After", u"0")
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _paginate(self, items, items_key, parameters):
+        limit = min(int(parameters.get(u"limit", MAX_PAGE_SIZE)), self.page_size)
+        offset = int(parameters.get(u"offset", 0))
+        page = items[offset : offset + limit]
+        next_page = None
+        if offset + limit < len(items):
+            next_page = u"/api/v2/next&limit={}&offset={}".format(limit, offset + limit)
+
+        return {
+            u"offset": offset,
+            u"limit": limit,
+            u"size": len(page),
+            u"_links": {u"next": next_page, u"prev": None},
+            items_key: page,
+        }
+
+    def _build_case(self, case_id):
+        # Holds the fields of a real case, so the memory used by the reporter is too.
+        return {
+            u"id": case_id,
+            u"title": u"Benchmark case %d" % case_id,
+            u"section_id": 1,
+            u"template_id": 1,
+            u"type_id": 1,
+            u"priority_id": 2,
+            u"refs": None,
+            u"created_by": 1,
+            u"created_on": 0,
+            u"updated_by": 1,
+            u"updated_on": 0,
+            u"custom_preconds": u"The user is logged in.",
+            u"custom_steps": u"Open the page.\nClick the button.",
+            u"custom_expected": u"The page is shown.",
+        }
+
+    def _get_cases(self, arguments, parameters, data):
+        case_ids = range(1, self.cases_per_project + 1)
+        if u"updated_after" in parameters:
+            case_ids = []
+        response = self._paginate(case_ids, u"cases", parameters)
+        response[u"cases"] = [
+            self._build_case(case_id) for case_id in response[u"cases"]
+        ]
+        return 200, response
+
+    def _get_case(self, arguments, parameters, data):
+        case_id = int(arguments[0])
+        if not 1 <= case_id <= self.cases_per_project:
+            return 400, {u"error": u"Field :case_id is not a valid test case."}
+        return 200, dict(self._build_case(case_id), suite_id=1)
+
+    def _get_runs(self, arguments, parameters, data):
+        project_id = int(arguments[0])
+        with self._lock:
+            # The runs of test plans are not listed.
+            runs = [
+                run
+                for run in self.runs.values()
+                if run[u"project_id"] == project_id
+                and not run[u"is_completed"]
+                and not run.get(u"plan_id")
+            ]
+        return 200, self._paginate(runs, u"runs", parameters)
+
+    def _get_run(self, arguments, parameters, data):
+        with self._lock:
+            run = self.runs.get(int(arguments[0]))
+        if run is None:
+            return 400, {u"error": u"Field :run_id is not a valid test run."}
+        return 200, run
+
+    def _add_run(self, arguments, parameters, data):
+        with self._lock:
+            run = {
+                u"id": len(self.runs) + 1,
+                u"project_id": int(arguments[0]),
+                u"suite_id": data.get(u"suite_id"),
+                u"name": data.get(u"name"),
+                u"include_all": data.get(u"include_all", True),
+                u"case_ids": data.get(u"case_ids", []),
+                u"is_completed": False,
+            }
+            self.runs[run[u"id"]] = run
+        return 200, run
+
+    def _get_plans(self, arguments, parameters, data):
+        project_id = int(arguments[0])
+        with self._lock:
+            plans = [
+                {u"id": plan[u"id"], u"name": plan[u"name"]}
+                for plan in self.plans.values()
+                if plan[u"project_id"] == project_id and not plan[u"is_completed"]
+            ]
+        return 200, self._paginate(plans, u"plans", parameters)
+
+    def _get_plan(self, arguments, parameters, data):
+        with self._lock:
+            plan = self.plans.get(int(arguments[0]))
+        if plan is None:
+            return 400, {u"error": u"Field :plan_id is not a valid test plan."}
+        return 200, plan
+
+    def _add_plan(self, arguments, parameters, data):
+        with self._lock:
+            plan = {
+                u"id": len(self.plans) + 1,
+                u"project_id": int(arguments[0]),
+                u"name": data.get(u"name"),
+                u"is_completed": False,
+                u"entries": [],
+            }
+            self.plans[plan[u"id"]] = plan
+            for entry in data.get(u"entries", []):
+                plan[u"entries"].append(self._build_plan_entry(plan, entry))
+        return 200, plan
+
+    def _add_plan_entry(self, arguments, parameters, data):
+        with self._lock:
+            plan = self.plans.get(int(arguments[0]))
+            if plan is None:
+                return 400, {u"error": u"Field :plan_id is not a valid test plan."}
+            entry = self._build_plan_entry(plan, data)
+            plan[u"entries"].append(entry)
+        return 200, entry
+
+    def _build_plan_entry(self, plan, entry_data):
+        entry = {
+            u"id": u"{}-{}".format(plan[u"id"], len(plan[u"entries"]) + 1),
+            u"suite_id": entry_data.get(u"suite_id"),
+            u"name": entry_data.get(u"name"),
+            u"runs": [],
+        }
+        # An entry without configurations holds a single run.
+        for run_data in entry_data.get(u"runs") or [entry_data]:
+            run = {
+                u"id": len(self.runs) + 1,
+                u"project_id": plan[u"project_id"],
+                u"plan_id": plan[u"id"],
+                u"entry_id": entry[u"id"],
+                u"suite_id": entry[u"suite_id"],
+                u"name": entry[u"name"],
+                u"config_ids": run_data.get(u"config_ids", []),
+                u"include_all": run_data.get(
+                    u"include_all", entry_data.get(u"include_all", True)
+                ),
+                u"case_ids": run_data.get(u"case_ids", []),
+                u"is_completed": False,
+            }
+            self.runs[run[u"id"]] = run
+            entry[u"runs"].append(run)
+        return entry
+
+    def _update_run_in_plan_entry(self, arguments, parameters, data):
+        return self._update_run(arguments, parameters, data)
+
+    def _update_plan_entry(self, arguments, parameters, data):
+        with self._lock:
+            runs = [
+                run
+                for run in self.runs.values()
+                if run.get(u"plan_id") == int(arguments[0])
+                and run[u"entry_id"] == arguments[1]
+            ]
+            for run in runs:
+                run.update(data)
+        if not runs:
+            return 400, {u"error": u"Field :entry_id is not a valid plan entry."}
+        return 200, {u"id": arguments[1], u"runs": runs}
+
+    def _update_run(self, arguments, parameters, data):
+        with self._lock:
+            run = self.runs.get(int(arguments[0]))
+            if run is None:
+                return 400, {u"error": u"Field :run_id is not a valid test run."}
+            run.update(data)
+        return 200, run
+
+    def _get_tests(self, arguments, parameters, data):
+        with self._lock:
+            run = self.runs.get(int(arguments[0]), {})
+            case_ids = run.get(u"case_ids", [])
+            if run.get(u"include_all", True):
+                case_ids = range(1, self.cases_per_project + 1)
+            statuses = {
+                result[u"case_id"]: result[u"status_id"]
+                for result in self.results[int(arguments[0])]
+            }
+            # The tests of a run get the id of their case.
+            tests = [
+                {
+                    u"id": case_id,
+                    u"case_id": case_id,
+                    u"status_id": statuses.get(case_id, 3),
+                }
+                for case_id in case_ids
+            ]
+        return 200, self._paginate(tests, u"tests", parameters)
+
+    def _get_missing_case_ids(self, run_id, case_ids):
+        run = self.runs.get(run_id, {})
+        if run.get(u"include_all", True):
+            return []
+        return sorted(set(case_ids) - set(run.get(u"case_ids", [])))
+
+    def _get_results_for_run(self, arguments, parameters, data):
+        with self._lock:
+            # Testrail returns the latest results first.
+            results = list(reversed(self.results[int(arguments[0])]))
+        if u"created_after" in parameters:
+            created_after = int(parameters[u"created_after"])
+            results = [
+                result for result in results if result[u"created_on"] > created_after
+            ]
+        return 200, self._paginate(results, u"results", parameters)
+
+    def _add_result_for_case(self, arguments, parameters, data):
+        result = dict(data, case_id=int(arguments[1]))
+        return self._add_results(int(arguments[0]), [result])
+
+    def _add_results_for_cases(self, arguments, parameters, data):
+        return self._add_results(int(arguments[0]), data[u"results"])
+
+    def _add_results(self, run_id, results):
+        with self._lock:
+            missing_case_ids = self._get_missing_case_ids(
+                run_id, [result[u"case_id"] for result in results]
+            )
+            if missing_case_ids:
+                return 400, {u"error": u"Cases {} not in run.".format(missing_case_ids)}
+            created_on = int(time.time())
+            first_id = sum(len(items) for items in self.results.values()) + 1
+            results = [
+                dict(
+                    result,
+                    id=first_id + index,
+                    test_id=result[u"case_id"],
+                    created_on=created_on,
+                )
+                for index, result in enumerate(results)
+            ]
+            self.results[run_id].extend(results)
+        return 200, results
+
+    def _add_attachment_to_result(self, arguments, parameters, data):
+        # The file is the only part, between its headers and the closing boundary.
+        content = data.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+        with self._lock:
+            attachments = self.attachments[int(arguments[0])]
+            attachments.append(
+                {
+                    u"name": _FILE_NAME_PATTERN.search(data).group(1).decode(u"utf-8"),
+                    u"size": len(content),
+                }
+            )
+            attachment_id = sum(len(items) for items in self.attachments.values())
+        return 200, {u"attachment_id": attachment_id}
+
+    def count_results(self):
+        with self._lock:
+            return sum(len(results) for results in self.results.values())
@@ -6,7 +6,13 @@ long_description = "Please see our GitHub README"
 if os.path.exists("README.md"):
     long_description = open("README.md").read()
 
-REQUIREMENTS = ["jsonschema", "behave", "pyyaml", "requests"]
+REQUIREMENTS = [
+    "jsonschema",
+    "behave",
+    "pyyaml",
+    "requests",
+    'futures; python_version < "3"',
+]
 TEST_REQUIREMENTS = ["coverage", "flake8", "mock", "twine", "codacy-coverage"]
 
 setup(
@@ -15,7 +21,7 @@ setup(
     author="Virtualstock",
     author_email="development.team@virtualstock.co.uk",
     url="https://github.com/virtualstock/behave-testrail-reporter/",
-    packages=find_packages(exclude=["temp*.py", "register.py", "test"]),
+    packages=find_packages(exclude=["temp*.py", "register.py", "test", "benchmark"]),
     include_package_data=True,
     license="MIT",
     description="Behave library to integrate with Testrail API",
@@ -23,6 +29,11 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     install_requires=REQUIREMENTS,
+    entry_points={
+        "console_scripts": [
+            "behave-testrail-resume=behave_testrail_reporter.spool:main",
+        ]
+    },
     classifiers=[
         "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3.4",
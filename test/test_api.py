@@ -1,27 +1,59 @@
 # -*- coding: utf-8 -*-
 
+import json
 import unittest
 import os
+import shutil
+import tempfile
+import zlib
+
 import mock
+import requests
+
+from behave_testrail_reporter.api import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    APIClient,
+    APIError,
+)
+from behave_testrail_reporter.attachments import MultipartFileBody
+from behave_testrail_reporter.errors import CircuitOpenError
+from behave_testrail_reporter.throttling import CircuitBreaker, RetryPolicy
 
-from behave_testrail_reporter.api import APIClient
+TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
 
 
 class APIClientTestCase(unittest.TestCase):
-    def build_mocked_requests_get_response(self, json_data, status_code):
+    def build_mocked_requests_get_response(self, json_data, status_code, headers=None):
         class MockResponse:
             def __init__(self, json_data, status_code):
                 self.json_data = json_data
                 self.status_code = status_code
+                self.headers = headers or {}
+                self.content = b""
 
             def json(self):
                 return self.json_data
 
             def raise_for_status(self):
-                """@todo Implement this when you need to test how bad responses are handled."""
+                if self.status_code >= 400:
+                    raise requests.HTTPError(u"{} Error".format(self.status_code))
 
         return MockResponse(json_data, status_code)
 
+    def test_timeouts_default_when_not_set(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            self.assertEqual(TIMEOUT, APIClient(u"https://x").timeout)
+            self.assertEqual(
+                (5, DEFAULT_READ_TIMEOUT),
+                APIClient(u"https://x", connect_timeout=5, read_timeout=None).timeout,
+            )
+
     def test_env_variables_not_present(self):
         with self.assertRaises(ValueError) as context:
             APIClient(base_url="index.php/")
@@ -305,3 +337,603 @@ class APIClientTestCase(unittest.TestCase):
 
         self.assertEqual(expected_number_of_test_runs, len(test_runs))
         self.assertEqual(expected_test_runs, test_runs)
+
+    def test_create_results(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        results = [
+            {u"case_id": 1104, u"status_id": 1, u"comment": u"", u"elapsed": u"1s"},
+            {u"case_id": 1105, u"status_id": 5, u"comment": u"", u"elapsed": u"2s"},
+        ]
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data=[{u"id": 1}, {u"id": 2}], status_code=200
+            )
+            api_client.create_results(run_id=333, results=results)
+
+        request_mock.assert_called_once_with(
+            u"https://www.testrail.test/index.php?/api/v2/add_results_for_cases/333",
+            json={u"results": results},
+            timeout=TIMEOUT,
+        )
+
+    def test_create_run_with_case_ids_and_update_run(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={u"id": 333}, status_code=200
+            )
+            api_client.create_run(111, 222, u"Run name", case_ids=[1104])
+            api_client.update_run(333, [1104, 1105])
+
+        self.assertEqual(
+            [
+                mock.call(
+                    u"https://www.testrail.test/index.php?/api/v2/add_run/111",
+                    json={
+                        u"suite_id": 222,
+                        u"name": u"Run name",
+                        u"include_all": False,
+                        u"case_ids": [1104],
+                    },
+                    timeout=TIMEOUT,
+                ),
+                mock.call(
+                    u"https://www.testrail.test/index.php?/api/v2/update_run/333",
+                    json={u"include_all": False, u"case_ids": [1104, 1105]},
+                    timeout=TIMEOUT,
+                ),
+            ],
+            request_mock.call_args_list,
+        )
+
+    def test_create_plan_and_update_plan_runs(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        entries = [{u"suite_id": 222, u"name": u"Run name", u"include_all": True}]
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={u"id": 444}, status_code=200
+            )
+            api_client.create_plan(111, u"Plan name", entries)
+            api_client.add_plan_entry(444, entries[0])
+            api_client.update_plan_run(
+                {u"id": 555, u"plan_id": 444, u"entry_id": u"e1", u"config_ids": [7]},
+                [1104],
+            )
+            api_client.update_plan_run(
+                {u"id": 556, u"plan_id": 444, u"entry_id": u"e2", u"config_ids": []},
+                [1105],
+            )
+
+        base_url = u"https://www.testrail.test/index.php?/api/v2/"
+        self.assertEqual(
+            [
+                mock.call(
+                    base_url + u"add_plan/111",
+                    json={u"name": u"Plan name", u"entries": entries},
+                    timeout=TIMEOUT,
+                ),
+                mock.call(
+                    base_url + u"add_plan_entry/444", json=entries[0], timeout=TIMEOUT
+                ),
+                mock.call(
+                    base_url + u"update_run_in_plan_entry/555",
+                    json={u"include_all": False, u"case_ids": [1104]},
+                    timeout=TIMEOUT,
+                ),
+                mock.call(
+                    base_url + u"update_plan_entry/444/e2",
+                    json={u"include_all": False, u"case_ids": [1105]},
+                    timeout=TIMEOUT,
+                ),
+            ],
+            request_mock.call_args_list,
+        )
+
+    def test_get_test_plan_by_project_and_name_gets_its_entries(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch.object(api_client, u"send_get") as send_get_mock:
+            send_get_mock.side_effect = [
+                {
+                    u"offset": 0,
+                    u"limit": 250,
+                    u"size": 2,
+                    u"_links": {u"next": None, u"prev": None},
+                    u"plans": [
+                        {u"id": 1, u"name": u"Other plan"},
+                        {u"id": 2, u"name": u"Plan name"},
+                    ],
+                },
+                {u"id": 2, u"name": u"Plan name", u"entries": []},
+            ]
+            test_plan = api_client.get_test_plan_by_project_and_name(
+                111, u"Plan name"
+            )
+
+        self.assertEqual({u"id": 2, u"name": u"Plan name", u"entries": []}, test_plan)
+        self.assertEqual(
+            [
+                mock.call(uri=u"get_plans/111&is_completed=0&limit=250&offset=0"),
+                mock.call(uri=u"get_plan/2"),
+            ],
+            send_get_mock.call_args_list,
+        )
+
+    def test_iter_cases_by_id_skips_unknown_cases(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        def get_case(url, timeout):
+            case_id = int(url.rsplit(u"/", 1)[1])
+            if case_id == 2:
+                return self.build_mocked_requests_get_response(
+                    json_data={u"error": u"Field :case_id is not a valid test case."},
+                    status_code=400,
+                )
+            return self.build_mocked_requests_get_response(
+                json_data={u"id": case_id, u"suite_id": 222}, status_code=200
+            )
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.side_effect = get_case
+            cases = list(api_client.iter_cases_by_id([1, 2, 3], workers=2))
+
+        self.assertEqual(
+            [{u"id": 1, u"suite_id": 222}, {u"id": 3, u"suite_id": 222}], cases
+        )
+        self.assertEqual(3, request_mock.call_count)
+        request_mock.assert_any_call(
+            u"https://www.testrail.test/index.php?/api/v2/get_case/1", timeout=TIMEOUT
+        )
+
+    def test_iter_results_for_run_created_after(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        fake_testrail_v2_results_response_json = {
+            "offset": 0,
+            "limit": 250,
+            "size": 1,
+            "_links": {"next": None, "prev": None},
+            "results": [{"id": 1, "test_id": 2, "created_on": 1600000100}],
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data=fake_testrail_v2_results_response_json, status_code=200
+            )
+            results = list(
+                api_client.iter_results_for_run(333, created_after=1600000000.5)
+            )
+
+        self.assertEqual(fake_testrail_v2_results_response_json["results"], results)
+        request_mock.assert_called_once_with(
+            u"https://www.testrail.test/index.php?/api/v2/"
+            u"get_results_for_run/333&limit=250&offset=0&created_after=1600000000",
+            timeout=TIMEOUT,
+        )
+
+    def test_add_attachment_to_result_streams_the_file(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, u"screenshot.png")
+        with open(path, u"wb") as stream:
+            stream.write(b"\x89PNG")
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test", gzip_threshold=0
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={u"attachment_id": 443}, status_code=200
+            )
+            response = api_client.add_attachment_to_result(333, path)
+
+        self.assertEqual({u"attachment_id": 443}, response)
+        url = request_mock.call_args[0][0]
+        body = request_mock.call_args[1][u"data"]
+        self.assertEqual(
+            u"https://www.testrail.test/index.php?/api/v2/add_attachment_to_result/333",
+            url,
+        )
+        self.assertIsInstance(body, MultipartFileBody)
+        self.assertEqual(path, body.path)
+        self.assertEqual(
+            {u"Content-Type": body.content_type}, request_mock.call_args[1][u"headers"]
+        )
+        self.assertEqual(0, api_client.gzip_bytes_before)
+
+    def test_iter_cases_requests_one_page_at_a_time(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        fake_testrail_v2_cases_response_json = {
+            "offset": 0,
+            "limit": 250,
+            "size": 250,
+            "_links": {
+                "next": "/api/v2/get_cases/111&suite_id=222&limit=250&offset=250",
+                "prev": None,
+            },
+            "cases": [{"id": case_id} for case_id in range(250)],
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data=fake_testrail_v2_cases_response_json, status_code=200
+            )
+            cases = api_client.iter_cases(project_id=111, suite_id=222)
+            first_case = next(cases)
+
+        self.assertEqual({"id": 0}, first_case)
+        request_mock.assert_called_once_with(
+            u"https://www.testrail.test/index.php?/api/v2/"
+            u"get_cases/111&suite_id=222&limit=250&offset=0",
+            timeout=TIMEOUT,
+        )
+
+    def test_iter_cases_with_concurrent_pages(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        total_cases = 11
+        page_size = 2
+
+        def fake_send_get(uri):
+            offset = int(uri.rsplit(u"offset=", 1)[1])
+            cases = [
+                {u"id": case_id}
+                for case_id in range(offset, min(offset + page_size, total_cases))
+            ]
+            has_next = offset + page_size < total_cases
+            return {
+                u"offset": offset,
+                u"limit": page_size,
+                u"size": len(cases),
+                u"_links": {u"next": u"next-page" if has_next else None},
+                u"cases": cases,
+            }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test", page_workers=3)
+
+        with mock.patch.object(
+            api_client, "send_get", side_effect=fake_send_get
+        ) as send_get_mock:
+            cases = api_client.get_cases(project_id=111, suite_id=222)
+
+        self.assertEqual([{u"id": case_id} for case_id in range(total_cases)], cases)
+        requested_offsets = sorted(
+            int(call[1][u"uri"].rsplit(u"offset=", 1)[1])
+            for call in send_get_mock.call_args_list
+        )
+        # The last window requests one page past the end of the suite at most.
+        self.assertEqual([0, 2, 4, 6, 8, 10, 12], requested_offsets)
+
+    @mock.patch("behave_testrail_reporter.api.time.sleep")
+    def test_send_get_retries_after_too_many_requests(self, sleep_mock):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        throttled_response = self.build_mocked_requests_get_response(
+            json_data={}, status_code=429, headers={u"Retry-After": u"7"}
+        )
+        ok_response = self.build_mocked_requests_get_response(
+            json_data={u"id": 1}, status_code=200
+        )
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.side_effect = [throttled_response, ok_response]
+            response = api_client.send_get(u"get_run/1")
+
+        self.assertEqual({u"id": 1}, response)
+        sleep_mock.assert_called_once_with(7.0)
+        self.assertEqual(1, api_client.retries)
+        self.assertEqual(7.0, api_client.throttled_seconds)
+        get_run_metrics = api_client.metrics.to_dict()[u"get_run"]
+        self.assertEqual(2, get_run_metrics[u"requests"])
+        self.assertEqual(1, get_run_metrics[u"retries"])
+        self.assertEqual(0, get_run_metrics[u"errors"])
+
+    @mock.patch("behave_testrail_reporter.api.time.sleep")
+    def test_send_post_gives_up_after_max_retries(self, sleep_mock):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test",
+                retry_policy=RetryPolicy(max_retries=2),
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.side_effect = requests.ConnectTimeout(u"Connection timed out")
+            with self.assertRaises(APIError):
+                api_client.send_post(u"add_run/1", data={})
+
+        self.assertEqual(3, request_mock.call_count)
+        self.assertEqual(2, api_client.retries)
+        self.assertEqual(1, api_client.metrics.to_dict()[u"add_run"][u"errors"])
+
+    @mock.patch("behave_testrail_reporter.api.time.sleep")
+    def test_open_circuit_breaker_fails_fast(self, sleep_mock):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test",
+                retry_policy=RetryPolicy(max_retries=5),
+                circuit_breaker=CircuitBreaker(failure_threshold=2, cool_down=60),
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.side_effect = requests.ConnectTimeout(u"Connect timed out")
+            with self.assertRaises(CircuitOpenError):
+                api_client.send_post(u"add_run/1", data={})
+            with self.assertRaises(CircuitOpenError):
+                api_client.send_post(u"add_run/1", data={})
+
+        # The retries stop as soon as the circuit opens.
+        self.assertEqual(2, request_mock.call_count)
+        self.assertEqual(1, sleep_mock.call_count)
+        self.assertEqual(1, api_client.circuit_breaker.rejected_requests)
+
+    def test_server_errors_open_the_circuit_breaker(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test",
+                retry_policy=RetryPolicy(max_retries=0),
+                circuit_breaker=CircuitBreaker(failure_threshold=2, cool_down=60),
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.side_effect = [
+                self.build_mocked_requests_get_response(json_data={}, status_code=503),
+                self.build_mocked_requests_get_response(json_data={}, status_code=400),
+                self.build_mocked_requests_get_response(json_data={}, status_code=503),
+            ]
+            for _ in range(3):
+                with self.assertRaises(APIError) as context:
+                    api_client.send_get(u"get_run/1")
+                self.assertNotIsInstance(context.exception, CircuitOpenError)
+
+        # A client error is an answer, it resets the consecutive failures.
+        self.assertEqual(0, api_client.circuit_breaker.opened)
+
+    @mock.patch("behave_testrail_reporter.api.time.sleep")
+    def test_send_post_is_not_retried_when_testrail_may_have_processed_it(
+        self, sleep_mock
+    ):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.side_effect = requests.ReadTimeout(u"Read timed out")
+            with self.assertRaises(APIError):
+                api_client.send_post(u"add_results_for_cases/1", data={})
+            self.assertEqual(1, request_mock.call_count)
+
+            request_mock.reset_mock()
+            request_mock.side_effect = [
+                self.build_mocked_requests_get_response(json_data={}, status_code=500)
+            ]
+            with self.assertRaises(APIError):
+                api_client.send_post(u"add_results_for_cases/1", data={})
+            self.assertEqual(1, request_mock.call_count)
+
+            request_mock.reset_mock()
+            request_mock.side_effect = [
+                self.build_mocked_requests_get_response(json_data={}, status_code=503),
+                self.build_mocked_requests_get_response(
+                    json_data={u"id": 1}, status_code=200
+                ),
+            ]
+            self.assertEqual(
+                {u"id": 1}, api_client.send_post(u"add_results_for_cases/1", data={})
+            )
+            self.assertEqual(2, request_mock.call_count)
+
+        self.assertEqual(1, api_client.retries)
+
+    def test_send_get_does_not_retry_client_errors(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={}, status_code=400
+            )
+            with self.assertRaises(APIError) as context:
+                api_client.send_get(u"get_run/1")
+
+        self.assertEqual(400, context.exception.status_code)
+        self.assertEqual(1, request_mock.call_count)
+
+    def test_send_post_compresses_big_bodies(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        data = {u"comment": u"->  given step_01 [passed]\n" * 100}
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test",
+                connect_timeout=3,
+                read_timeout=30,
+                gzip_threshold=1024,
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={}, status_code=200
+            )
+            api_client.send_post(u"add_result_for_case/1/2", data=data)
+
+        request_kwargs = request_mock.call_args[1]
+        self.assertEqual((3, 30), request_kwargs[u"timeout"])
+        self.assertEqual({u"Content-Encoding": u"gzip"}, request_kwargs[u"headers"])
+        body = zlib.decompress(request_kwargs[u"data"], 16 + zlib.MAX_WBITS)
+        self.assertEqual(data, json.loads(body.decode(u"utf-8")))
+        self.assertEqual(len(body), api_client.gzip_bytes_before)
+        self.assertEqual(len(request_kwargs[u"data"]), api_client.gzip_bytes_after)
+
+    def test_send_post_does_not_compress_small_bodies(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(
+                base_url="https://www.testrail.test", gzip_threshold=1024
+            )
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.post"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data={}, status_code=200
+            )
+            api_client.send_post(u"add_run/1", data={u"name": u"master"})
+
+        request_mock.assert_called_once_with(
+            u"https://www.testrail.test/index.php?/api/v2/add_run/1",
+            data=b'{"name": "master"}',
+            timeout=TIMEOUT,
+        )
+        self.assertEqual(0, api_client.gzip_bytes_before)
+
+    def test_get_test_run_by_project_and_name_stops_at_first_match(self):
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+        fake_testrail_v2_runs_response_json = {
+            "offset": 0,
+            "limit": 250,
+            "size": 2,
+            "_links": {
+                "next": "/api/v2/get_runs/111&is_completed=0&limit=250&offset=250",
+                "prev": None,
+            },
+            "runs": [
+                {"id": 1865, "name": "Test run develop"},
+                {"id": 1866, "name": "Test run master"},
+            ],
+        }
+
+        with mock.patch.dict(os.environ, test_environment):
+            api_client = APIClient(base_url="https://www.testrail.test")
+
+        with mock.patch(
+            "behave_testrail_reporter.api.requests.Session.get"
+        ) as request_mock:
+            request_mock.return_value = self.build_mocked_requests_get_response(
+                json_data=fake_testrail_v2_runs_response_json, status_code=200
+            )
+            test_run = api_client.get_test_run_by_project_and_name(
+                project_id=111, test_run_name=u"Test run master"
+            )
+
+        self.assertEqual(1866, test_run[u"id"])
+        self.assertEqual(1, request_mock.call_count)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from behave_testrail_reporter.api import APIClient
+
+if sys.version_info >= (3, 5):
+    from behave_testrail_reporter.async_api import (
+        AsyncAPIClient,
+        AsyncResultSender,
+        EventLoopThread,
+    )
+
+
+@unittest.skipIf(sys.version_info < (3, 5), u"asyncio coroutines need python 3.5")
+class AsyncAPIClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop_thread = EventLoopThread()
+        self.addCleanup(self.loop_thread.stop)
+
+    def test_operations_are_sent_by_the_wrapped_client(self):
+        client = Mock(APIClient)
+        client.get_cases.return_value = [{u"id": 1104}]
+        async_client = AsyncAPIClient(client)
+        self.addCleanup(async_client.close)
+
+        cases = self.loop_thread.run(async_client.get_cases(1, 2), timeout=5)
+
+        self.assertEqual([{u"id": 1104}], cases)
+        client.get_cases.assert_called_once_with(1, 2, updated_after=None)
+
+    def test_concurrent_requests_are_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def create_results(run_id, results):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        client = Mock(APIClient)
+        client.create_results.side_effect = create_results
+        async_client = AsyncAPIClient(client, concurrency=3)
+        self.addCleanup(async_client.close)
+
+        futures = [
+            self.loop_thread.submit(async_client.create_results(100, [{}]))
+            for _ in range(12)
+        ]
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertEqual(12, client.create_results.call_count)
+        self.assertEqual(3, max_running[0])
+
+@unittest.skipIf(sys.version_info < (3, 5), u"asyncio coroutines need python 3.5")
+class AsyncResultSenderTestCase(unittest.TestCase):
+    def test_batches_of_the_same_project_are_sent_concurrently(self):
+        both_sending = threading.Barrier(2, timeout=5)
+        reporter = Mock()
+        reporter._send_results.side_effect = lambda project, results: (
+            both_sending.wait()
+        )
+        sender = AsyncResultSender(
+            reporter=reporter,
+            client=AsyncAPIClient(Mock(APIClient), concurrency=2),
+            loop_thread=EventLoopThread(),
+        )
+
+        sender.submit(u"project", [[{u"case_id": 1104}], [{u"case_id": 1105}]])
+
+        self.assertEqual(0, sender.close(timeout=5))
+        self.assertEqual([], sender.errors)
+        self.assertEqual(2, reporter._send_results.call_count)
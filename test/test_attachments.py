@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+
+from behave_testrail_reporter.attachments import (
+    AttachmentUploader,
+    MultipartFileBody,
+)
+
+
+class AttachmentsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_file(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, u"wb") as stream:
+            stream.write(b"x" * size)
+        return path
+
+    def test_multipart_file_body_is_read_in_chunks(self):
+        path = self.write_file(u"test.txt", 10)
+        body = MultipartFileBody(path, chunk_size=4)
+        boundary = body.content_type.split(u"boundary=")[1].encode(u"utf-8")
+
+        chunks = list(body)
+
+        self.assertEqual([b"xxxx", b"xxxx", b"xx"], chunks[1:-1])
+        self.assertEqual(
+            b"--" + boundary + b"\r\n"
+            b'Content-Disposition: form-data; name="attachment"; filename="test.txt"\r\n'
+            b"Content-Type: text/plain\r\n\r\n"
+            b"xxxxxxxxxx"
+            b"\r\n--" + boundary + b"--\r\n",
+            b"".join(chunks),
+        )
+        self.assertEqual(len(b"".join(chunks)), len(body))
+        # A retried request reads the file again.
+        self.assertEqual(chunks, list(body))
+
+    def test_uploader_skips_files_over_the_limits(self):
+        client = Mock()
+        uploader = AttachmentUploader(client, workers=2, max_size=10, run_budget=12)
+        small_path = self.write_file(u"small.log", 5)
+        big_path = self.write_file(u"big.log", 11)
+
+        uploader.upload(100, 1, small_path)
+        uploader.upload(100, 2, big_path)
+        uploader.upload(100, 3, small_path)
+        uploader.upload(100, 4, small_path)
+        uploader.upload(200, 5, small_path)
+        uploader.upload(200, 6, os.path.join(self.directory, u"missing.log"))
+        pending_uploads = uploader.close(timeout=5)
+
+        self.assertEqual(0, pending_uploads)
+        self.assertEqual(
+            [1, 3, 5],
+            sorted(
+                call[0][0] for call in client.add_attachment_to_result.call_args_list
+            ),
+        )
+        self.assertEqual(3, uploader.uploaded)
+        self.assertEqual(15, uploader.uploaded_bytes)
+        self.assertEqual(2, uploader.skipped)
+        self.assertEqual(1, len(uploader.errors))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from behave_testrail_reporter.api import APIClient
+from behave_testrail_reporter.attachments import CHUNK_SIZE
+from benchmark.runner import measure_import_time, run_benchmark
+from benchmark.stub_server import StubTestrailServer
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_reports_requests_sent_to_the_stub_server(self):
+        results = run_benchmark(
+            scenarios=30, projects=2, page_size=10, measure_memory=False
+        )
+
+        self.assertEqual(60, results[u"results"])
+        self.assertEqual(
+            {
+                u"get_cases": 6,
+                u"get_runs": 2,
+                u"add_run": 2,
+                u"add_results_for_cases": 2,
+            },
+            results[u"requests"],
+        )
+
+    def test_throttled_requests_are_retried(self):
+        results = run_benchmark(
+            scenarios=30, projects=2, throttle_every=3, measure_memory=False
+        )
+
+        self.assertEqual(60, results[u"results"])
+        self.assertGreater(results[u"throttled_requests"], 0)
+
+    def test_import_does_not_load_lazy_modules(self):
+        results = measure_import_time()
+
+        self.assertEqual([], results[u"lazy_modules_loaded"])
+        self.assertGreater(results[u"import_time"], 0)
+
+    def test_test_runs_without_include_all(self):
+        results = run_benchmark(
+            scenarios=30,
+            projects=2,
+            settings={u"test_runs": {u"include_all": False}},
+            measure_memory=False,
+        )
+
+        self.assertEqual(60, results[u"results"])
+        self.assertNotIn(u"update_run", results[u"requests"])
+
+    def test_prescanned_cases_are_looked_up(self):
+        results = run_benchmark(
+            scenarios=30,
+            projects=1,
+            suite_size=40000,
+            prescan=True,
+            measure_memory=False,
+        )
+
+        self.assertEqual(30, results[u"results"])
+        self.assertEqual(30, results[u"requests"][u"get_case"])
+        self.assertNotIn(u"get_cases", results[u"requests"])
+
+    def test_delta_sync_skips_unchanged_results(self):
+        results = run_benchmark(
+            scenarios=30,
+            projects=2,
+            settings={u"delta_sync": {u"max_age": 3600}},
+            measure_memory=False,
+            runs=2,
+        )
+
+        self.assertEqual(60, results[u"results"])
+        self.assertEqual(2, results[u"requests"][u"add_results_for_cases"])
+        self.assertEqual(2, results[u"requests"][u"get_results_for_run"])
+
+    def test_attachments_are_streamed_to_the_stub_server(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, u"screenshot.png")
+        with open(path, u"wb") as stream:
+            stream.write(b"\x89PNG" * (CHUNK_SIZE // 2))
+        test_environment = {
+            u"TESTRAIL_USER": u"homer@springfield.test",
+            u"TESTRAIL_KEY": u"simpson123",
+        }
+
+        with StubTestrailServer() as server:
+            with mock.patch.dict(os.environ, test_environment):
+                api_client = APIClient(base_url=server.url)
+            api_client.add_attachment_to_result(1, path)
+
+        self.assertEqual(
+            [{u"name": u"screenshot.png", u"size": CHUNK_SIZE * 2}],
+            server.attachments[1],
+        )
+        self.assertGreater(
+            api_client.metrics.to_dict()[u"add_attachment_to_result"][u"bytes_sent"],
+            CHUNK_SIZE * 2,
+        )
+
+    def test_compact_case_index_uses_less_memory(self):
+        results = run_benchmark(scenarios=30, projects=1, suite_size=5000)
+        compact_results = run_benchmark(
+            scenarios=30,
+            projects=1,
+            suite_size=5000,
+            settings={u"compact_case_index": True},
+        )
+
+        self.assertEqual(30, compact_results[u"results"])
+        self.assertLess(compact_results[u"peak_memory"], results[u"peak_memory"] / 2)
+
+    def test_circuit_breaker_fails_fast_during_an_outage(self):
+        results = run_benchmark(
+            scenarios=30,
+            projects=2,
+            settings={
+                u"api": {u"max_retries": 0},
+                u"circuit_breaker": {u"failure_threshold": 2},
+            },
+            measure_memory=False,
+            outage=True,
+        )
+
+        self.assertEqual(0, results[u"results"])
+        # Only the requests failing before the circuit opens reach the server.
+        self.assertEqual(2, sum(results[u"requests"].values()))
+
+    def test_test_plan_sets_up_all_configurations_at_once(self):
+        results = run_benchmark(
+            scenarios=30, projects=2, configurations=4, measure_memory=False
+        )
+        plan_results = run_benchmark(
+            scenarios=30,
+            projects=2,
+            configurations=4,
+            settings={u"test_plan": {u"name": u"Benchmark {branch}"}},
+            measure_memory=False,
+        )
+
+        self.assertEqual(240, results[u"results"])
+        self.assertEqual(8, results[u"requests"][u"add_run"])
+        self.assertEqual(240, plan_results[u"results"])
+        self.assertEqual(
+            {
+                u"get_cases": 2,
+                u"get_plans": 2,
+                u"add_plan": 2,
+                u"add_results_for_cases": 8,
+            },
+            plan_results[u"requests"],
+        )
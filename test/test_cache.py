@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from functools import partial
+
+from mock import Mock, mock
+
+from behave_testrail_reporter.api import APIClient
+from behave_testrail_reporter.cache import CaseCache, RunRegistry
+
+
+class CaseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+        self.client = Mock(APIClient)
+        self.client.url = u"https://www.testrail.test/index.php?/api/v2/"
+
+    def test_miss_downloads_the_whole_suite(self):
+        self.client.iter_cases.return_value = iter(
+            [{u"id": 1, u"updated_on": 100}, {u"id": 2, u"updated_on": 200}]
+        )
+        case_cache = CaseCache(directory=self.directory)
+
+        cases = case_cache.get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.assert_called_once_with(1, 11)
+        self.assertEqual([u"1", u"2"], sorted(cases))
+        self.assertEqual(0, case_cache.hits)
+        self.assertEqual(1, case_cache.misses)
+        self.assertEqual(2, case_cache.refreshed_cases)
+
+    def test_hit_only_downloads_updated_cases(self):
+        self.client.iter_cases.return_value = iter(
+            [{u"id": 1, u"updated_on": 100}, {u"id": 2, u"updated_on": 200}]
+        )
+        CaseCache(directory=self.directory).get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.reset_mock()
+        self.client.iter_cases.return_value = iter(
+            [{u"id": 2, u"updated_on": 300, u"title": u"new"}, {u"id": 3}]
+        )
+        case_cache = CaseCache(directory=self.directory)
+        cases = case_cache.get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.assert_called_once_with(1, 11, updated_after=199)
+        self.assertEqual([u"1", u"2", u"3"], sorted(cases))
+        self.assertEqual({u"id": 2, u"updated_on": 300}, cases[u"2"])
+        self.assertEqual(1, case_cache.hits)
+        self.assertEqual(0, case_cache.misses)
+        self.assertEqual(2, case_cache.refreshed_cases)
+
+    def test_expired_suite_is_downloaded_again(self):
+        self.client.iter_cases.return_value = iter([{u"id": 1}])
+        CaseCache(directory=self.directory, ttl=60).get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.reset_mock()
+        self.client.iter_cases.return_value = iter([{u"id": 2}])
+        case_cache = CaseCache(directory=self.directory, ttl=60)
+        time_in_the_future = time.time() + 120
+        with mock.patch(
+            "behave_testrail_reporter.cache.time.time", return_value=time_in_the_future
+        ):
+            cases = case_cache.get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.assert_called_once_with(1, 11)
+        self.assertEqual([u"2"], sorted(cases))
+        self.assertEqual(1, case_cache.misses)
+
+    def test_least_recently_used_suites_are_evicted(self):
+        case_cache = CaseCache(directory=self.directory, max_size=200)
+        for suite_id in (11, 22, 33):
+            self.client.iter_cases.return_value = iter([{u"id": suite_id}])
+            case_cache.get_cases(self.client, 1, suite_id)
+            path = case_cache._get_path(self.client.url, 1, suite_id)
+            os.utime(path, (suite_id, suite_id))
+
+        remaining_suites = [
+            suite_id
+            for suite_id in (11, 22, 33)
+            if os.path.exists(case_cache._get_path(self.client.url, 1, suite_id))
+        ]
+        self.assertEqual([22, 33], remaining_suites)
+
+
+    def test_suite_bigger_than_max_size_is_kept(self):
+        self.client.iter_cases.return_value = iter(
+            [{u"id": case_id, u"title": u"Case"} for case_id in range(100)]
+        )
+        CaseCache(directory=self.directory, max_size=10).get_cases(self.client, 1, 11)
+
+        self.client.iter_cases.reset_mock()
+        self.client.iter_cases.return_value = iter([])
+        case_cache = CaseCache(directory=self.directory, max_size=10)
+        cases = case_cache.get_cases(self.client, 1, 11)
+
+        self.assertEqual(1, case_cache.hits)
+        self.assertEqual(100, len(cases))
+        self.assertEqual({u"id": 1, u"updated_on": None}, cases[u"1"])
+
+    def test_eviction_keeps_the_other_files_of_the_directory(self):
+        registry_path = os.path.join(self.directory, u"runs.json")
+        RunRegistry(path=registry_path).set(self.client.url, 1, 11, u"Run", 100)
+        case_cache = CaseCache(directory=self.directory, max_size=0)
+        for suite_id in (11, 22):
+            self.client.iter_cases.return_value = iter([{u"id": suite_id}])
+            case_cache.get_cases(self.client, 1, suite_id)
+
+        self.assertTrue(os.path.exists(registry_path))
+        self.assertFalse(os.path.exists(case_cache._get_path(self.client.url, 1, 11)))
+        self.assertTrue(os.path.exists(case_cache._get_path(self.client.url, 1, 22)))
+
+class RunRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+        self.path = os.path.join(self.directory, u"registry", u"runs.json")
+
+    def test_get_unknown_run(self):
+        run_registry = RunRegistry(path=self.path)
+
+        self.assertIsNone(run_registry.get(u"https://testrail", 1, 11, u"master"))
+
+    def test_set_is_shared_with_other_executions(self):
+        RunRegistry(path=self.path).set(u"https://testrail", 1, 11, u"master", 555)
+        RunRegistry(path=self.path).set(u"https://testrail", 1, 11, u"develop", 556)
+
+        run_registry = RunRegistry(path=self.path)
+        self.assertEqual(555, run_registry.get(u"https://testrail", 1, 11, u"master"))
+        self.assertEqual(556, run_registry.get(u"https://testrail", 1, 11, u"develop"))
+        self.assertIsNone(run_registry.get(u"https://testrail", 2, 11, u"master"))
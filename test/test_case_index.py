@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from behave_testrail_reporter.case_index import CaseIndex
+
+
+class CaseIndexTestCase(unittest.TestCase):
+    def test_membership(self):
+        case_index = CaseIndex([1105, u"1104", 3, 1104])
+
+        self.assertEqual(3, len(case_index))
+        self.assertIn(u"1104", case_index)
+        self.assertIn(1105, case_index)
+        self.assertIn(3, case_index)
+        self.assertNotIn(u"4", case_index)
+        self.assertNotIn(u"9999", case_index)
+        self.assertNotIn(u"1104abc", case_index)
+        self.assertNotIn(None, case_index)
+
+    def test_iterates_string_ids_in_order(self):
+        self.assertEqual([u"3", u"1104"], list(CaseIndex([1104, 3])))
+        self.assertFalse(CaseIndex())
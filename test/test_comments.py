@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from behave.model_core import Status
+
+from behave_testrail_reporter.comments import CommentPolicy
+from behave_testrail_reporter.results import ScenarioResult, StepResult
+
+
+class CommentPolicyTestCase(unittest.TestCase):
+    def build_scenario(self, step_statuses):
+        steps = [
+            StepResult(u"given", u"step_%02d" % index, status)
+            for index, status in enumerate(step_statuses, 1)
+        ]
+        status = Status.passed
+        if Status.failed in step_statuses:
+            status = Status.failed
+        return ScenarioResult(u"Dummy scenario", status, 1, steps, [u"1104"])
+
+    def test_full_lists_every_step(self):
+        scenario = self.build_scenario([Status.passed, Status.failed])
+
+        comment = CommentPolicy().build(scenario)
+
+        self.assertEqual(
+            u"Dummy scenario\n"
+            u"->  given step_01 [{}]\n"
+            u"->  given step_02 [{}]".format(Status.passed, Status.failed),
+            comment,
+        )
+
+    def test_failures_only_lists_steps_not_passed(self):
+        scenario = self.build_scenario([Status.passed, Status.failed, Status.skipped])
+        policy = CommentPolicy(verbosity=u"failures")
+
+        comment = policy.build(scenario)
+
+        self.assertEqual(
+            u"Dummy scenario\n"
+            u"->  given step_02 [{}]\n"
+            u"->  given step_03 [{}]".format(Status.failed, Status.skipped),
+            comment,
+        )
+        self.assertEqual(
+            u"Dummy scenario", policy.build(self.build_scenario([Status.passed] * 3))
+        )
+
+    def test_summary_counts_steps_by_status(self):
+        scenario = self.build_scenario([Status.passed, Status.passed, Status.failed])
+
+        comment = CommentPolicy(verbosity=u"summary").build(scenario)
+
+        self.assertEqual(u"Dummy scenario\n3 steps: 1 failed, 2 passed", comment)
+
+    def test_max_steps_truncates_the_step_list(self):
+        scenario = self.build_scenario([Status.passed] * 5)
+
+        comment = CommentPolicy(max_steps=2).build(scenario)
+
+        self.assertEqual(
+            u"Dummy scenario\n"
+            u"->  given step_01 [{status}]\n"
+            u"->  given step_02 [{status}]\n"
+            u"... 3 more steps".format(status=Status.passed),
+            comment,
+        )
+
+    def test_max_size_cuts_the_comment(self):
+        scenario = self.build_scenario([Status.passed] * 100)
+
+        comment = CommentPolicy(max_size=80).build(scenario)
+
+        self.assertEqual(80, len(comment))
+        self.assertTrue(comment.startswith(u"Dummy scenario\n->  given step_01"))
+        self.assertTrue(comment.endswith(u"\n[truncated]"))
+
+    def test_max_size_keeps_short_comments(self):
+        scenario = self.build_scenario([Status.passed])
+        policy = CommentPolicy(max_size=1000)
+
+        self.assertEqual(CommentPolicy().build(scenario), policy.build(scenario))
+
+    def test_truncate_keeps_room_for_the_reserved_size(self):
+        policy = CommentPolicy(max_size=100)
+
+        comment = policy.truncate(u"x" * 100, reserved_size=46)
+
+        self.assertEqual(54, len(comment))
+        self.assertTrue(comment.endswith(u"\n[truncated]"))
+        self.assertEqual(u"x" * 54, policy.truncate(u"x" * 54, reserved_size=46))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+
+from mock import mock
+
+from behave_testrail_reporter.coordination import (
+    FileLock,
+    WorkerCoordinator,
+    write_file_atomically,
+)
+
+
+class FileLockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+
+    def test_lock_is_exclusive(self):
+        path = os.path.join(self.directory, u"locks", u"run.lock")
+        events = []
+
+        def hold_lock():
+            with FileLock(path):
+                events.append(u"second acquired")
+
+        with FileLock(path):
+            thread = threading.Thread(target=hold_lock)
+            thread.start()
+            thread.join(0.2)
+            events.append(u"first released")
+        thread.join(5)
+
+        self.assertEqual([u"first released", u"second acquired"], events)
+
+
+class WriteFileAtomicallyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+
+    def test_file_is_replaced_without_temporary_files_left(self):
+        path = os.path.join(self.directory, u"runs.json")
+        write_file_atomically(path, u"{}")
+
+        write_file_atomically(path, u'{"run": 1}')
+
+        with open(path, u"r") as stream:
+            self.assertEqual(u'{"run": 1}', stream.read())
+        self.assertEqual([u"runs.json"], os.listdir(self.directory))
+
+
+class WorkerCoordinatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+
+    def test_case_ids_are_shared(self):
+        coordinator = WorkerCoordinator(directory=self.directory)
+        key = (u"https://testrail", 1, 11)
+        with coordinator.lock(u"cases", key):
+            self.assertIsNone(coordinator.read_case_ids(key))
+            coordinator.write_case_ids(key, {u"1104": {}, u"1105": {}})
+
+        other_coordinator = WorkerCoordinator(directory=self.directory)
+
+        self.assertEqual(
+            [u"1104", u"1105"], sorted(other_coordinator.read_case_ids(key))
+        )
+        self.assertIsNone(other_coordinator.read_case_ids((u"https://testrail", 2, 22)))
+
+    def test_expired_case_ids_are_ignored(self):
+        coordinator = WorkerCoordinator(directory=self.directory, case_index_ttl=60)
+        key = (u"https://testrail", 1, 11)
+        with coordinator.lock(u"cases", key):
+            coordinator.write_case_ids(key, [u"1104"])
+
+        path = coordinator._get_path(u"cases", key, u"json")
+        time_in_the_future = os.path.getmtime(path) + 120
+        with mock.patch(
+            "behave_testrail_reporter.coordination.time.time",
+            return_value=time_in_the_future,
+        ):
+            self.assertIsNone(coordinator.read_case_ids(key))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from behave_testrail_reporter.metrics import RequestMetrics, get_endpoint_name
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    def build_metrics(self):
+        metrics = RequestMetrics()
+        for duration in range(1, 21):
+            metrics.record_request(
+                u"get_cases/1&suite_id=2&limit=250&offset=0",
+                duration / 10.0,
+                bytes_received=100,
+            )
+        metrics.record_request(u"add_results_for_cases/7", 0.5, bytes_sent=2048)
+        metrics.record_retry(u"add_results_for_cases/7")
+        metrics.record_error(u"add_results_for_cases/7")
+        return metrics
+
+    def test_get_endpoint_name(self):
+        self.assertEqual(u"get_cases", get_endpoint_name(u"get_cases/1&suite_id=2"))
+        self.assertEqual(u"get_run", get_endpoint_name(u"get_run/10"))
+
+    def test_endpoint_latency_percentiles_are_estimated_from_buckets(self):
+        get_cases_metrics = self.build_metrics().to_dict()[u"get_cases"]
+
+        self.assertEqual(20, get_cases_metrics[u"requests"])
+        self.assertEqual(2000, get_cases_metrics[u"bytes_received"])
+        latencies = get_cases_metrics[u"latency_seconds"]
+        # The p50 is interpolated in the 0.5-1 bucket, the p95 capped by the max.
+        self.assertEqual(1.0, latencies[u"p50"])
+        self.assertEqual(2.0, latencies[u"p95"])
+        self.assertEqual(2.0, latencies[u"max"])
+        self.assertAlmostEqual(21.0, latencies[u"sum"])
+        self.assertEqual(
+            [0, 0, 0, 0, 1, 2, 5, 10, 20, 20, 20, 20, 20, 20],
+            get_cases_metrics[u"latency_buckets"],
+        )
+
+    def test_format_summary_sorts_endpoints_by_time_spent(self):
+        lines = self.build_metrics().format_summary()
+
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith(u"get_cases: 20 requests, p50 1.000s"))
+        self.assertEqual(
+            u"add_results_for_cases: 1 requests, p50 0.500s, p95 0.500s, "
+            u"max 0.500s, 2048 bytes sent, 0 bytes received, 1 retries, 1 errors",
+            lines[1],
+        )
+
+    def test_to_prometheus(self):
+        text = self.build_metrics().to_prometheus()
+
+        self.assertIn(u"# TYPE testrail_requests_total counter\n", text)
+        self.assertIn(u'testrail_requests_total{endpoint="get_cases"} 20\n', text)
+        self.assertIn(
+            u'testrail_request_retries_total{endpoint="add_results_for_cases"} 1\n',
+            text,
+        )
+        self.assertIn(u"# TYPE testrail_request_duration_seconds histogram\n", text)
+        self.assertIn(
+            u'testrail_request_duration_seconds_bucket{endpoint="get_cases",le="1"} 10\n',
+            text,
+        )
+        self.assertIn(
+            u'testrail_request_duration_seconds_bucket{endpoint="get_cases",le="+Inf"} 20\n',
+            text,
+        )
+        self.assertIn(
+            u'testrail_request_duration_seconds_count{endpoint="get_cases"} 20\n', text
+        )
+
+    def test_write_json(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, u"metrics", u"testrail.json")
+
+        self.build_metrics().write(path)
+
+        with open(path, u"r") as stream:
+            self.assertEqual(
+                1, json.load(stream)[u"add_results_for_cases"][u"errors"]
+            )
+        self.assertEqual([u"testrail.json"], os.listdir(os.path.dirname(path)))
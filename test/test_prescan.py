@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from behave_testrail_reporter.prescan import iter_feature_files, scan_case_ids
+
+
+class PrescanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, u"w", encoding=u"utf-8") as stream:
+            stream.write(content)
+        return path
+
+    def test_iter_feature_files(self):
+        login_path = self.write_file(u"login.feature", u"")
+        checkout_path = self.write_file(u"shop/checkout.feature", u"")
+        self.write_file(u"steps/steps.py", u"")
+
+        self.assertEqual(
+            [login_path, checkout_path], list(iter_feature_files([self.directory]))
+        )
+        self.assertEqual([login_path], list(iter_feature_files([login_path + u":12"])))
+
+    def test_scan_case_ids(self):
+        self.write_file(
+            u"login.feature",
+            u"@testrail-C1 @smoke\n"
+            u"Feature: Login\n"
+            u"    # @testrail-C2 is commented out\n"
+            u"    @testrail-C3\n"
+            u"    @testrail-C4 @slow\n"
+            u"    Scenario Outline: Users can login\n"
+            u"        Given the user is called @testrail-C5\n"
+            u"\n"
+            u"        @testrail-C6\n"
+            u"        Examples:\n"
+            u"            | name |\n"
+            u"            | bob  |\n",
+        )
+
+        self.assertEqual(
+            {u"1", u"3", u"4", u"6"}, scan_case_ids([self.directory], u"testrail-C")
+        )
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from behave_testrail_reporter.results import ResultAggregator, ResultBuffer
+
+
+class ResultBufferTestCase(unittest.TestCase):
+    def build_result(self, case_id, comment=u""):
+        return {
+            u"case_id": case_id,
+            u"status_id": 1,
+            u"comment": comment,
+            u"elapsed": u"1s",
+        }
+
+    def test_is_full_by_number_of_results(self):
+        result_buffer = ResultBuffer(max_results=2)
+        result_buffer.add(self.build_result(1))
+        self.assertFalse(result_buffer.is_full())
+
+        result_buffer.add(self.build_result(2))
+        self.assertTrue(result_buffer.is_full())
+
+    def test_is_full_by_payload_size(self):
+        result_buffer = ResultBuffer(max_results=100, max_bytes=100)
+        result_buffer.add(self.build_result(1, comment=u"x" * 100))
+
+        self.assertTrue(result_buffer.is_full())
+
+    def test_drain_splits_by_number_of_results(self):
+        result_buffer = ResultBuffer(max_results=2)
+        for case_id in range(5):
+            result_buffer.add(self.build_result(case_id))
+
+        chunks = list(result_buffer.drain())
+
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual(0, len(result_buffer))
+
+    def test_drain_splits_by_payload_size(self):
+        result_size = len(
+            u'{"case_id": 1, "status_id": 1, "comment": "", "elapsed": "1s"}'
+        )
+        result_buffer = ResultBuffer(max_results=100, max_bytes=result_size * 2)
+        for case_id in range(1, 6):
+            result_buffer.add(self.build_result(case_id))
+
+        chunks = list(result_buffer.drain())
+
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+
+    def test_drain_sends_oversized_result_alone(self):
+        result_buffer = ResultBuffer(max_results=100, max_bytes=10)
+        result_buffer.add(self.build_result(1, comment=u"x" * 100))
+        result_buffer.add(self.build_result(2, comment=u"x" * 100))
+
+        chunks = list(result_buffer.drain())
+
+        self.assertEqual([1, 1], [len(chunk) for chunk in chunks])
+
+
+class ResultAggregatorTestCase(unittest.TestCase):
+    STATUSES = ((1, u"passed"), (4, u"retest"), (5, u"failed"))
+
+    def test_single_result_is_kept(self):
+        result_aggregator = ResultAggregator(self.STATUSES)
+        result_aggregator.add(u"1104", 1, u"Ok", 3)
+
+        self.assertEqual([(u"1104", 1, [u"Ok"], 3)], list(result_aggregator.drain()))
+        self.assertEqual(0, len(result_aggregator))
+
+    def test_results_of_a_case_are_merged(self):
+        result_aggregator = ResultAggregator(self.STATUSES)
+        result_aggregator.add(u"1104", 1, u"Example 1", 2)
+        result_aggregator.add(u"1105", 1, u"Other case", 1)
+        result_aggregator.add(u"1104", 5, u"Example 2", 3)
+        result_aggregator.add(u"1104", 4, u"Example 3", 4)
+
+        merged_results = list(result_aggregator.drain())
+
+        self.assertEqual(
+            [
+                (
+                    u"1104",
+                    5,
+                    [
+                        u"3 results: 1 failed, 1 retest, 1 passed",
+                        u"",
+                        u"Example 2",
+                        u"",
+                        u"Example 3",
+                    ],
+                    9,
+                ),
+                (u"1105", 1, [u"Other case"], 1),
+            ],
+            merged_results,
+        )
+
+    def test_failed_comments_are_bounded(self):
+        result_aggregator = ResultAggregator(self.STATUSES, max_failures=1)
+        for example in range(3):
+            result_aggregator.add(u"1104", 5, u"Example {}".format(example), 1)
+
+        _, _, comment_lines, _ = next(result_aggregator.drain())
+
+        self.assertEqual(
+            [
+                u"3 results: 3 failed",
+                u"",
+                u"Example 0",
+                u"",
+                u"... 2 more failed results",
+            ],
+            comment_lines,
+        )
+
+    def test_attachments_are_kept_per_case(self):
+        result_aggregator = ResultAggregator(self.STATUSES)
+        result_aggregator.add(u"1104", 1, u"Example 1", 1)
+        result_aggregator.add(u"1104", 5, u"Example 2", 1, [u"example_2.png"])
+        result_aggregator.add(u"1105", 5, u"Other case", 1, [u"other.png"])
+        result_aggregator.add(u"1104", 5, u"Example 3", 1, [u"example_3.png"])
+        list(result_aggregator.drain())
+
+        self.assertEqual(
+            {
+                u"1104": [u"example_2.png", u"example_3.png"],
+                u"1105": [u"other.png"],
+            },
+            result_aggregator.drain_attachments(),
+        )
+        self.assertEqual({}, result_aggregator.drain_attachments())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+
+from behave_testrail_reporter.coordination import FileLock
+from behave_testrail_reporter.spool import ResultSpool, find_spool_keys
+
+
+class ResultSpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, self.directory, ignore_errors=True))
+        self.path = os.path.join(self.directory, u"spool", u"spool.jsonl")
+
+    def build_record(self, key):
+        return {
+            u"key": key,
+            u"project_id": 1,
+            u"suite_id": 11,
+            u"test_run_name": u"master",
+            u"result": {u"case_id": 1104, u"status_id": 1},
+        }
+
+    def test_pending_returns_records_not_acknowledged(self):
+        result_spool = ResultSpool(path=self.path)
+        for key in (u"a", u"b", u"c"):
+            result_spool.append(self.build_record(key))
+        result_spool.acknowledge([u"b"])
+
+        pending_keys = [record[u"key"] for record in result_spool.pending()]
+
+        self.assertEqual([u"a", u"c"], pending_keys)
+
+    def test_pending_ignores_incomplete_lines(self):
+        result_spool = ResultSpool(path=self.path)
+        result_spool.append(self.build_record(u"a"))
+        with open(self.path, u"a") as stream:
+            stream.write(u'{"key": "b", "project_')
+
+        pending_keys = [record[u"key"] for record in ResultSpool(self.path).pending()]
+
+        self.assertEqual([u"a"], pending_keys)
+
+    def test_records_appended_after_an_incomplete_line_are_pending(self):
+        result_spool = ResultSpool(path=self.path)
+        result_spool.append(self.build_record(u"a"))
+        with open(self.path, u"a") as stream:
+            stream.write(u'{"key": "b", "project_')
+
+        resumed_spool = ResultSpool(self.path)
+        resumed_spool.append(self.build_record(u"c"))
+        resumed_spool.acknowledge([u"a"])
+
+        pending_keys = [record[u"key"] for record in resumed_spool.pending()]
+
+        self.assertEqual([u"c"], pending_keys)
+
+    def test_clear_if_acknowledged(self):
+        result_spool = ResultSpool(path=self.path)
+        result_spool.append(self.build_record(u"a"))
+
+        self.assertFalse(result_spool.clear_if_acknowledged())
+        self.assertTrue(os.path.exists(self.path))
+
+        result_spool.acknowledge([u"a"])
+        self.assertTrue(result_spool.clear_if_acknowledged())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_clear_waits_for_the_records_of_other_processes(self):
+        result_spool = ResultSpool(path=self.path)
+        result_spool.append(self.build_record(u"a"))
+        result_spool.acknowledge([u"a"])
+        cleared = []
+
+        # Another process holds the spool lock while it appends a record.
+        with FileLock(self.path + u".lock"):
+            thread = threading.Thread(
+                target=lambda: cleared.append(result_spool.clear_if_acknowledged())
+            )
+            thread.start()
+            thread.join(0.2)
+            with open(self.path, u"a") as stream:
+                stream.write(json.dumps(self.build_record(u"b")) + u"\n")
+        thread.join(5)
+
+        self.assertEqual([False], cleared)
+        self.assertEqual([u"b"], [record[u"key"] for record in result_spool.pending()])
+
+    def test_find_spool_keys(self):
+        key = u"0123456789abcdef0123456789abcdef"
+        comment = u"Dummy scenario\n\nResult key: {}".format(key)
+
+        self.assertEqual([key], find_spool_keys(comment))
+        self.assertEqual([], find_spool_keys(None))
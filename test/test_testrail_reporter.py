@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import shutil
 import sys
+import tempfile
+import threading
 import yaml
 import os
 from functools import partial
@@ -9,7 +12,15 @@ from functools import partial
 from mock import Mock, mock
 from behave.model import Scenario, Feature, Status
 
-from behave_testrail_reporter.api import APIClient
+from behave_testrail_reporter.api import APIClient, APIError
+from behave_testrail_reporter.errors import CircuitOpenError
+from behave_testrail_reporter.metrics import RequestMetrics
+from behave_testrail_reporter.spool import (
+    RESUME_CLOCK_MARGIN,
+    ResultSpool,
+    find_spool_keys,
+)
+from behave_testrail_reporter.throttling import CircuitBreaker
 from behave_testrail_reporter import TestrailReporter, TestrailProject
 
 
@@ -133,6 +144,7 @@ class TestrailReporterTestCase(unittest.TestCase):
             status=1,
             comment=comment,
             elapsed_seconds=mock_scenario.duration,
+            attachments=[],
         )
 
     @mock.patch(
@@ -205,6 +217,911 @@ class TestrailReporterTestCase(unittest.TestCase):
             expected_status, TestrailReporter.STATUS_MAPS[Status.untested.name]
         )
 
+    def build_reporter_with_test_runs(self):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.testrail_client = Mock(APIClient)
+        testrail_reporter.testrail_client.retries = 0
+        testrail_reporter.testrail_client.throttled_seconds = 0.0
+        testrail_reporter.testrail_client.gzip_bytes_before = 0
+        testrail_reporter.testrail_client.metrics = RequestMetrics()
+        testrail_reporter.testrail_client.url = u"https://test.testrail.net/"
+        for project in testrail_reporter.projects:
+            project.test_run = {u"id": project.id * 100}
+        return testrail_reporter
+
+    def test_add_test_result_is_buffered_until_end(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        project = testrail_reporter.projects[0]
+
+        testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter._add_test_result(project, u"1105", status=5)
+        testrail_reporter.testrail_client.create_results.assert_not_called()
+
+        with mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        testrail_reporter.testrail_client.create_results.assert_called_once_with(
+            100,
+            [
+                {u"case_id": 1104, u"status_id": 1, u"comment": u"", u"elapsed": u"1s"},
+                {u"case_id": 1105, u"status_id": 5, u"comment": u"", u"elapsed": u"1s"},
+            ],
+        )
+        self.assertEqual(2, testrail_reporter.case_summary[Status.passed.name])
+
+    @mock.patch("behave_testrail_reporter.testrail_reporter.time.time")
+    def test_delta_sync_skips_unchanged_results(self, time_mock):
+        time_mock.return_value = 10000
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"delta_sync"] = {u"max_age": 3600}
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.iter_tests.return_value = iter(
+            [
+                {u"id": 1, u"case_id": 1104, u"status_id": 1},
+                {u"id": 2, u"case_id": 1105, u"status_id": 1},
+                {u"id": 3, u"case_id": 1106, u"status_id": 5},
+                {u"id": 4, u"case_id": 1107, u"status_id": 3},
+            ]
+        )
+        testrail_client.iter_results_for_run.return_value = iter(
+            [
+                {u"test_id": 1, u"created_on": 9000},
+                {u"test_id": 3, u"created_on": 8000},
+            ]
+        )
+        project = testrail_reporter.projects[0]
+
+        testrail_reporter._add_test_result(project, u"1104", status=1)
+        # Its latest result is older than max_age.
+        testrail_reporter._add_test_result(project, u"1105", status=1)
+        testrail_reporter._add_test_result(project, u"1106", status=1)
+        # The result sent before is now the latest one.
+        testrail_reporter._add_test_result(project, u"1106", status=5)
+        testrail_reporter._add_test_result(project, u"1107", status=1)
+        testrail_reporter.flush_results()
+
+        testrail_client.iter_tests.assert_called_once_with(100)
+        testrail_client.iter_results_for_run.assert_called_once_with(
+            100, created_after=6400
+        )
+        testrail_client.create_results.assert_called_once_with(
+            100,
+            [
+                {
+                    u"case_id": case_id,
+                    u"status_id": status,
+                    u"comment": u"",
+                    u"elapsed": u"1s",
+                }
+                for case_id, status in ((1105, 1), (1106, 1), (1106, 5), (1107, 1))
+            ],
+        )
+        self.assertEqual(1, testrail_reporter.unchanged_results)
+
+    def test_add_test_result_flushes_when_buffer_is_full(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"results"] = {u"batch_size": 2}
+        project = testrail_reporter.projects[0]
+
+        for case_id in (u"1", u"2", u"3"):
+            testrail_reporter._add_test_result(project, case_id, status=1)
+        testrail_reporter._wait_for_batches()
+
+        self.assertEqual(1, testrail_reporter.testrail_client.create_results.call_count)
+        self.assertEqual(1, len(testrail_reporter.result_buffers[project]))
+
+    @unittest.skipIf(sys.version_info < (3, 2), u"threading.Barrier needs python 3.2")
+    def test_full_buffers_of_projects_are_set_up_and_sent_concurrently(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"results"] = {u"batch_size": 1}
+        projects = testrail_reporter.projects
+        all_setting_up = threading.Barrier(len(projects), timeout=5)
+
+        def get_test_run(project_id, test_run_name):
+            # Fails unless all the projects set up their test run at the same time.
+            all_setting_up.wait()
+            return {u"id": project_id * 100}
+
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_test_run_by_project_and_name.side_effect = get_test_run
+        for project in projects:
+            project.test_run = None
+
+        for project in projects:
+            testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter._wait_for_batches()
+
+        self.assertEqual(
+            [100, 200],
+            sorted(
+                call[0][0] for call in testrail_client.create_results.call_args_list
+            ),
+        )
+
+    def test_rejected_batch_is_retried_per_case(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        project = testrail_reporter.projects[0]
+
+        def create_results(run_id, results):
+            if len(results) > 1 or results[0][u"case_id"] == 2:
+                raise APIError(u"Bad request", status_code=400)
+            return [{u"id": 1}]
+
+        testrail_reporter.testrail_client.create_results.side_effect = create_results
+        testrail_reporter._add_test_result(project, u"1", status=1)
+        testrail_reporter._add_test_result(project, u"2", status=1)
+        testrail_reporter.flush_results()
+
+        self.assertEqual(1, testrail_reporter.case_summary[Status.passed.name])
+        self.assertEqual([u"2"], testrail_reporter.failed_cases)
+
+    @mock.patch(
+        "behave_testrail_reporter.TestrailReporter._load_test_cases_for_project"
+    )
+    def test_process_scenario_with_async_upload(self, mock_load_test_cases):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"async_upload"] = {u"workers": 2}
+        testrail_reporter.projects[0].cases = {u"1104": {}}
+        testrail_reporter.projects[1].cases = {u"2204": {}}
+
+        step_01 = Mock(status=u"passed", keyword=u"given")
+        step_01.name = u"step_01"
+
+        mock_feature = Mock(Feature)
+        mock_feature.tags = [u"testrail-C2204"]
+
+        mock_scenario = Mock(Scenario)
+        mock_scenario.tags = [u"testrail-C1104", u"wip"]
+        mock_scenario.name = u"Dummy scenario"
+        mock_scenario.steps = [step_01]
+        mock_scenario.feature = mock_feature
+        mock_scenario.status = Status.passed
+        mock_scenario.duration = 3
+
+        testrail_reporter.process_scenario(mock_scenario)
+        with mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        self.assertEqual(2, testrail_reporter.case_summary[Status.passed.name])
+        self.assertEqual(2, testrail_reporter.case_summary[Status.untested.name])
+        testrail_reporter.testrail_client.create_results.assert_any_call(
+            100,
+            [
+                {
+                    u"case_id": 1104,
+                    u"status_id": 1,
+                    u"comment": u"Dummy scenario\n->  given step_01 [passed]",
+                    u"elapsed": u"3s",
+                }
+            ],
+        )
+
+    def test_attachments_are_uploaded_to_the_sent_results(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"async_upload"] = {u"workers": 2}
+        testrail_reporter.projects[0].cases = {u"1104": {}, u"1105": {}}
+        testrail_reporter.projects[1].cases = {u"2204": {}}
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.create_results.side_effect = lambda run_id, results: [
+            {u"id": 500 + result[u"case_id"]} for result in results
+        ]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, directory, ignore_errors=True))
+        path = os.path.join(directory, u"screenshot.png")
+        with open(path, u"wb") as stream:
+            stream.write(b"\x89PNG")
+        first_scenario = self.build_mock_scenario([u"testrail-C1104"])
+        second_scenario = self.build_mock_scenario([u"testrail-C1105"])
+
+        testrail_reporter.attach(second_scenario, path)
+        testrail_reporter.process_scenario(first_scenario)
+        testrail_reporter.process_scenario(second_scenario)
+        with mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        testrail_client.create_results.assert_called_once_with(
+            100,
+            [
+                {
+                    u"case_id": case_id,
+                    u"status_id": 1,
+                    u"comment": u"Dummy scenario\n->  given step_01 [passed]",
+                    u"elapsed": u"1s",
+                }
+                for case_id in (1104, 1105)
+            ],
+        )
+        testrail_client.add_attachment_to_result.assert_called_once_with(1605, path)
+        self.assertEqual(1, testrail_reporter.attachment_uploader.uploaded)
+        self.assertEqual({}, testrail_reporter.pending_attachments)
+
+    def build_mock_scenario(self, tags, feature_tags=(), status=Status.passed):
+        step_01 = Mock(status=u"passed", keyword=u"given")
+        step_01.name = u"step_01"
+
+        mock_feature = Mock(Feature)
+        mock_feature.tags = list(feature_tags)
+
+        mock_scenario = Mock(Scenario)
+        mock_scenario.tags = list(tags)
+        mock_scenario.name = u"Dummy scenario"
+        mock_scenario.steps = [step_01]
+        mock_scenario.feature = mock_feature
+        mock_scenario.status = status
+        mock_scenario.duration = 1
+        return mock_scenario
+
+    @mock.patch("behave_testrail_reporter.TestrailReporter._add_test_result")
+    @mock.patch(
+        "behave_testrail_reporter.TestrailReporter._can_generate_test_run_for_branch"
+    )
+    def test_process_scenario_routes_cases_to_projects(
+        self, can_generate_mock, add_test_result_mock
+    ):
+        can_generate_mock.return_value = True
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.projects[0].cases = {u"1104": {}, u"1105": {}}
+        testrail_reporter.projects[1].cases = {u"1105": {}}
+
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104", u"testrail-C1105"])
+        )
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C9999"])
+        )
+
+        routed_cases = [
+            (call[1][u"project"].id, call[1][u"case_id"])
+            for call in add_test_result_mock.call_args_list
+        ]
+        self.assertEqual([(1, u"1104"), (1, u"1105"), (2, u"1105")], routed_cases)
+        self.assertEqual(3, testrail_reporter.case_summary[Status.untested.name])
+        # Branch patterns are matched once per project, not once per tag.
+        self.assertEqual(2, can_generate_mock.call_count)
+
+    def test_flush_results_sets_up_projects_concurrently(self):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.testrail_client = Mock(APIClient)
+        both_projects_started = threading.Event()
+        started_projects = []
+        waited_for_other_project = []
+
+        def setup_test_run(project, case_ids=()):
+            started_projects.append(project.id)
+            if len(started_projects) == 2:
+                both_projects_started.set()
+            waited_for_other_project.append(both_projects_started.wait(5))
+            project.test_run = {u"id": project.id * 100}
+
+        for project in testrail_reporter.projects:
+            testrail_reporter._add_test_result(project, u"1104", status=1)
+
+        with mock.patch.object(
+            testrail_reporter, "setup_test_run", side_effect=setup_test_run
+        ):
+            testrail_reporter.flush_results()
+
+        self.assertEqual([True, True], waited_for_other_project)
+        create_results_calls = testrail_reporter.testrail_client.create_results
+        self.assertEqual(
+            [100, 200],
+            sorted(call[0][0] for call in create_results_calls.call_args_list),
+        )
+
+    @mock.patch("behave_testrail_reporter.TestrailReporter._add_test_result")
+    def test_compact_case_index_keeps_only_case_ids(self, add_test_result_mock):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.config[u"compact_case_index"] = True
+        testrail_reporter.testrail_client = Mock(APIClient)
+        testrail_reporter.testrail_client.iter_cases.side_effect = (
+            lambda project_id, suite_id: iter(
+                [{u"id": 1104, u"title": u"Login"}, {u"id": project_id * 1000}]
+            )
+        )
+
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104", u"testrail-C2000"])
+        )
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104"])
+        )
+
+        self.assertEqual([u"1000", u"1104"], list(testrail_reporter.projects[0].cases))
+        self.assertEqual([u"1104", u"2000"], sorted(testrail_reporter._case_routes))
+        routed_cases = [
+            (call[1][u"project"].id, call[1][u"case_id"])
+            for call in add_test_result_mock.call_args_list
+        ]
+        self.assertEqual(
+            [(1, u"1104"), (2, u"1104"), (2, u"2000"), (1, u"1104"), (2, u"1104")],
+            routed_cases,
+        )
+        self.assertEqual(1, testrail_reporter.case_summary[Status.untested.name])
+
+    def build_reporter_with_run_registry(self, registered_run_id):
+        registry_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, registry_directory, ignore_errors=True))
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.config[u"run_registry"] = {
+            u"path": os.path.join(registry_directory, u"runs.json")
+        }
+        testrail_reporter.testrail_client = Mock(APIClient)
+        testrail_reporter.testrail_client.url = u"https://test.testrail.net/"
+        if registered_run_id:
+            testrail_reporter._get_run_registry().set(
+                u"https://test.testrail.net/",
+                1,
+                11,
+                u"Testrail project name",
+                registered_run_id,
+            )
+        return testrail_reporter
+
+    def test_setup_test_run_uses_registered_run(self):
+        testrail_reporter = self.build_reporter_with_run_registry(555)
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_run.return_value = {u"id": 555, u"is_completed": False}
+
+        testrail_reporter.setup_test_run(testrail_reporter.projects[0])
+
+        self.assertEqual(555, testrail_reporter.projects[0].test_run[u"id"])
+        testrail_client.get_run.assert_called_once_with(555)
+        testrail_client.get_test_run_by_project_and_name.assert_not_called()
+
+    def test_setup_test_run_replaces_completed_registered_run(self):
+        testrail_reporter = self.build_reporter_with_run_registry(555)
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_run.return_value = {u"id": 555, u"is_completed": True}
+        testrail_client.get_test_run_by_project_and_name.return_value = None
+        testrail_client.create_run.return_value = {u"id": 556}
+
+        testrail_reporter.setup_test_run(testrail_reporter.projects[0])
+
+        self.assertEqual(556, testrail_reporter.projects[0].test_run[u"id"])
+        testrail_client.create_run.assert_called_once_with(
+            1, 11, u"Testrail project name"
+        )
+        self.assertEqual(
+            556,
+            testrail_reporter._get_run_registry().get(
+                u"https://test.testrail.net/", 1, 11, u"Testrail project name"
+            ),
+        )
+
+    def build_reporter_with_test_plan(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"test_plan"] = {u"name": u"Plan {branch}"}
+        testrail_reporter.projects = [
+            TestrailProject(1, u"Run {branch}", 11, u".*", config_ids=[7]),
+            TestrailProject(1, u"Run {branch}", 11, u".*", config_ids=[8]),
+            TestrailProject(2, u"Run {branch}", 22, u".*"),
+        ]
+        testrail_reporter.testrail_client.get_test_plan_by_project_and_name.return_value = (
+            None
+        )
+
+        def build_plan_entry(entry):
+            runs = entry.get(u"runs") or [dict(entry, config_ids=[])]
+            return dict(
+                entry,
+                runs=[
+                    {
+                        u"id": entry[u"suite_id"] * 10 + sum(run[u"config_ids"]),
+                        u"plan_id": 1000,
+                        u"include_all": True,
+                        u"config_ids": run[u"config_ids"],
+                    }
+                    for run in runs
+                ],
+            )
+
+        testrail_reporter.testrail_client.create_plan.side_effect = (
+            lambda project_id, name, entries: {
+                u"id": 1000,
+                u"entries": [build_plan_entry(entry) for entry in entries],
+            }
+        )
+        testrail_reporter.testrail_client.add_plan_entry.side_effect = (
+            lambda plan_id, entry: build_plan_entry(entry)
+        )
+        return testrail_reporter
+
+    def test_test_plan_creates_the_runs_of_all_configurations_at_once(self):
+        testrail_reporter = self.build_reporter_with_test_plan()
+        testrail_client = testrail_reporter.testrail_client
+
+        for project in testrail_reporter.projects:
+            testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter.flush_results()
+
+        self.assertEqual(
+            [
+                mock.call(
+                    1,
+                    u"Plan master",
+                    [
+                        {
+                            u"suite_id": 11,
+                            u"name": u"Run master",
+                            u"include_all": True,
+                            u"config_ids": [7, 8],
+                            u"runs": [
+                                {u"include_all": True, u"config_ids": [7]},
+                                {u"include_all": True, u"config_ids": [8]},
+                            ],
+                        }
+                    ],
+                ),
+                mock.call(
+                    2,
+                    u"Plan master",
+                    [{u"suite_id": 22, u"name": u"Run master", u"include_all": True}],
+                ),
+            ],
+            sorted(
+                testrail_client.create_plan.call_args_list,
+                key=lambda call: call[0][0],
+            ),
+        )
+        self.assertEqual(
+            [117, 118, 220],
+            sorted(
+                call[0][0] for call in testrail_client.create_results.call_args_list
+            ),
+        )
+        testrail_client.get_test_run_by_project_and_name.assert_not_called()
+        testrail_client.create_run.assert_not_called()
+
+    def test_existing_test_plan_gets_the_missing_runs(self):
+        testrail_reporter = self.build_reporter_with_test_plan()
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_test_plan_by_project_and_name.side_effect = (
+            lambda project_id, name: {
+                u"id": 1000,
+                u"entries": [
+                    {
+                        u"suite_id": 11,
+                        u"name": u"Run master",
+                        u"runs": [{u"id": 117, u"config_ids": [7]}],
+                    }
+                ],
+            }
+            if project_id == 1
+            else None
+        )
+
+        for project in testrail_reporter.projects[:2]:
+            testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter.flush_results()
+
+        testrail_client.create_plan.assert_not_called()
+        testrail_client.add_plan_entry.assert_called_once_with(
+            1000,
+            {
+                u"suite_id": 11,
+                u"name": u"Run master",
+                u"include_all": True,
+                u"config_ids": [8],
+                u"runs": [{u"include_all": True, u"config_ids": [8]}],
+            },
+        )
+        self.assertEqual(
+            [117, 118],
+            sorted(
+                call[0][0] for call in testrail_client.create_results.call_args_list
+            ),
+        )
+
+    def build_reporter_with_spool(self):
+        spool_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, spool_directory, ignore_errors=True))
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"spool"] = {
+            u"path": os.path.join(spool_directory, u"spool.jsonl")
+        }
+        return testrail_reporter
+
+    def test_spooled_results_are_acknowledged_when_sent(self):
+        testrail_reporter = self.build_reporter_with_spool()
+        project = testrail_reporter.projects[0]
+
+        testrail_reporter._add_test_result(project, u"1104", status=1, comment=u"Ok")
+        result_spool = testrail_reporter.result_spool
+        self.assertEqual(1, len(result_spool.pending()))
+
+        testrail_reporter.flush_results()
+
+        create_results = testrail_reporter.testrail_client.create_results
+        sent_result = create_results.call_args[0][1][0]
+        self.assertNotIn(u"_spool_key", sent_result)
+        self.assertTrue(sent_result[u"comment"].startswith(u"Ok\n\nResult key: "))
+        self.assertEqual([], result_spool.pending())
+
+    def test_spooled_comments_fit_in_max_size_with_their_key(self):
+        testrail_reporter = self.build_reporter_with_spool()
+        testrail_reporter.config[u"comments"] = {u"max_size": 100}
+        project = testrail_reporter.projects[0]
+
+        testrail_reporter._add_test_result(project, u"1104", status=1, comment=u"x" * 90)
+        testrail_reporter.flush_results()
+
+        create_results = testrail_reporter.testrail_client.create_results
+        sent_comment = create_results.call_args[0][1][0][u"comment"]
+        self.assertEqual(100, len(sent_comment))
+        self.assertTrue(sent_comment.startswith(u"x" * 42 + u"\n[truncated]"))
+        self.assertEqual(1, len(find_spool_keys(sent_comment)))
+
+    def test_resume_skips_results_already_in_testrail(self):
+        testrail_reporter = self.build_reporter_with_spool()
+        testrail_client = testrail_reporter.testrail_client
+        project = testrail_reporter.projects[0]
+        testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter._add_test_result(project, u"1105", status=5)
+        pending_records = testrail_reporter.result_spool.pending()
+
+        resumed_reporter = self.build_reporter_with_spool()
+        resumed_reporter.config[u"spool"] = testrail_reporter.config[u"spool"]
+        resumed_client = resumed_reporter.testrail_client
+        resumed_client.get_test_run_by_project_and_name.return_value = {u"id": 100}
+        resumed_client.iter_results_for_run.return_value = iter(
+            [{u"comment": pending_records[0][u"result"][u"comment"]}]
+        )
+        resumed_reporter.resume()
+
+        resumed_client.get_test_run_by_project_and_name.assert_called_once_with(
+            project_id=1, test_run_name=u"Testrail project name"
+        )
+        resumed_client.iter_results_for_run.assert_called_once_with(
+            100,
+            created_after=min(record[u"created_on"] for record in pending_records)
+            - RESUME_CLOCK_MARGIN,
+        )
+        resumed_client.create_results.assert_called_once_with(
+            100, [pending_records[1][u"result"]]
+        )
+        self.assertEqual([], resumed_reporter.result_spool.pending())
+        testrail_client.create_results.assert_not_called()
+
+    def test_resume_reports_to_the_test_plan_of_the_spooled_results(self):
+        spool_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, spool_directory, ignore_errors=True))
+        spool_config = {u"path": os.path.join(spool_directory, u"spool.jsonl")}
+        testrail_reporter = self.build_reporter_with_test_plan()
+        testrail_reporter.config[u"spool"] = spool_config
+        testrail_reporter._add_test_result(
+            testrail_reporter.projects[2], u"1104", status=1
+        )
+
+        resumed_reporter = self.build_reporter_with_test_plan()
+        resumed_reporter.config[u"spool"] = spool_config
+        resumed_reporter.branch_name = u""
+        resumed_client = resumed_reporter.testrail_client
+        resumed_client.iter_results_for_run.return_value = iter([])
+        resumed_reporter.resume()
+
+        resumed_client.get_test_plan_by_project_and_name.assert_called_once_with(
+            2, u"Plan master"
+        )
+        resumed_client.create_plan.assert_called_once_with(
+            2,
+            u"Plan master",
+            [{u"suite_id": 22, u"name": u"Run master", u"include_all": True}],
+        )
+        self.assertEqual(220, resumed_client.create_results.call_args[0][0])
+        self.assertEqual([], resumed_reporter.result_spool.pending())
+
+    def test_results_fall_back_to_a_file_while_testrail_is_unavailable(self):
+        fallback_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, fallback_directory, ignore_errors=True))
+        fallback_path = os.path.join(fallback_directory, u"fallback.jsonl")
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"circuit_breaker"] = {u"fallback_path": fallback_path}
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.circuit_breaker = CircuitBreaker(failure_threshold=1)
+        testrail_client.iter_cases.side_effect = CircuitOpenError(u"Circuit open")
+        testrail_client.get_test_run_by_project_and_name.side_effect = CircuitOpenError(
+            u"Circuit open"
+        )
+        for project in testrail_reporter.projects:
+            project.test_run = None
+
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104"])
+        )
+        with mock.patch("sys.stdout") as stdout_mock:
+            testrail_reporter.end()
+
+        testrail_client.create_results.assert_not_called()
+        fallback_records = ResultSpool(fallback_path).pending()
+        self.assertEqual(
+            [(1, 11, 1104), (2, 22, 1104)],
+            sorted(
+                (
+                    record[u"project_id"],
+                    record[u"suite_id"],
+                    record[u"result"][u"case_id"],
+                )
+                for record in fallback_records
+            ),
+        )
+        printed = u"".join(call[0][0] for call in stdout_mock.write.call_args_list)
+        self.assertIn(
+            u"Testrail circuit breaker: closed, opened 0 times, 0 requests not sent",
+            printed,
+        )
+        self.assertIn(
+            u"Testrail fallback: 2 results written to {}".format(fallback_path), printed
+        )
+
+    def test_malformed_case_tags_are_ignored_while_testrail_is_unavailable(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"circuit_breaker"] = {}
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.circuit_breaker = CircuitBreaker(failure_threshold=1)
+        testrail_client.iter_cases.side_effect = CircuitOpenError(u"Circuit open")
+
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1x", u"testrail-C1104"])
+        )
+        with mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        self.assertEqual(
+            [[1104], [1104]],
+            [
+                [result[u"case_id"] for result in call[0][1]]
+                for call in testrail_client.create_results.call_args_list
+            ],
+        )
+
+    def test_coordinated_workers_share_test_run_and_cases(self):
+        coordination_directory = tempfile.mkdtemp()
+        self.addCleanup(
+            partial(shutil.rmtree, coordination_directory, ignore_errors=True)
+        )
+        workers = []
+        for _ in range(2):
+            testrail_reporter = TestrailReporter(u"master")
+            testrail_reporter.config[u"coordination"] = {
+                u"directory": coordination_directory
+            }
+            testrail_client = Mock(APIClient)
+            testrail_client.url = u"https://test.testrail.net/"
+            testrail_client.iter_cases.return_value = iter([{u"id": 1104}])
+            testrail_client.get_test_run_by_project_and_name.return_value = None
+            testrail_client.create_run.return_value = {u"id": 555}
+            testrail_client.get_run.return_value = {u"id": 555, u"is_completed": False}
+            testrail_reporter.testrail_client = testrail_client
+            workers.append(testrail_reporter)
+
+        for testrail_reporter in workers:
+            project = testrail_reporter.projects[0]
+            testrail_reporter._load_test_cases_for_project(project)
+            testrail_reporter.setup_test_run(project)
+            self.assertEqual([u"1104"], list(project.cases))
+            self.assertEqual(555, project.test_run[u"id"])
+
+        first_client, second_client = [worker.testrail_client for worker in workers]
+        first_client.iter_cases.assert_called_once_with(1, 11)
+        first_client.create_run.assert_called_once_with(
+            1, 11, u"Testrail project name"
+        )
+        second_client.iter_cases.assert_not_called()
+        second_client.get_test_run_by_project_and_name.assert_not_called()
+        second_client.create_run.assert_not_called()
+
+    @unittest.skipIf(sys.version_info < (3, 5), u"asyncio coroutines need python 3.5")
+    def test_async_api_sends_batches_from_the_event_loop(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"async_api"] = {u"concurrency": 4}
+        testrail_reporter.config[u"results"] = {u"batch_size": 1}
+        sender_threads = set()
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.create_results.side_effect = lambda run_id, results: (
+            sender_threads.add(threading.current_thread())
+        )
+
+        for project in testrail_reporter.projects:
+            testrail_reporter._add_test_result(project, u"1104", status=1)
+        with mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        self.assertEqual(
+            len(testrail_reporter.projects), testrail_client.create_results.call_count
+        )
+        self.assertEqual(
+            len(testrail_reporter.projects),
+            testrail_reporter.case_summary[Status.passed.name],
+        )
+        self.assertNotIn(threading.current_thread(), sender_threads)
+
+    def test_async_api_without_results_does_not_build_a_client(self):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.config[u"async_api"] = {u"concurrency": 4}
+
+        with mock.patch.object(
+            testrail_reporter, u"_build_testrail_client"
+        ) as build_client_mock, mock.patch("sys.stdout"):
+            testrail_reporter.end()
+
+        build_client_mock.assert_not_called()
+        self.assertIsNone(testrail_reporter.async_sender)
+
+    def test_end_writes_api_metrics(self):
+        metrics_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, metrics_directory, ignore_errors=True))
+        metrics_path = os.path.join(metrics_directory, u"testrail.prom")
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"metrics"] = {
+            u"path": metrics_path,
+            u"format": u"prometheus",
+        }
+        testrail_reporter.testrail_client.metrics.record_request(
+            u"add_results_for_cases/100", 0.25
+        )
+
+        with mock.patch("sys.stdout") as stdout_mock:
+            testrail_reporter.end()
+
+        printed = u"".join(call[0][0] for call in stdout_mock.write.call_args_list)
+        self.assertIn(u"Testrail API add_results_for_cases: 1 requests", printed)
+        with open(metrics_path, u"r") as stream:
+            self.assertIn(
+                u'testrail_requests_total{endpoint="add_results_for_cases"} 1',
+                stream.read(),
+            )
+
+    def test_build_comment_with_comment_settings(self):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.config[u"comments"] = {u"verbosity": u"summary"}
+        mock_scenario = self.build_mock_scenario([u"testrail-C1104"])
+
+        comment = testrail_reporter._buid_comment_for_scenario(mock_scenario)
+
+        self.assertEqual(u"Dummy scenario\n1 steps: 1 passed", comment)
+
+    def test_aggregated_results_are_sent_once_per_case(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"results"] = {u"aggregate": True}
+        project = testrail_reporter.projects[0]
+
+        testrail_reporter._add_test_result(project, u"1104", 1, u"Row 1", 2)
+        testrail_reporter._add_test_result(project, u"1104", 5, u"Row 2", 3)
+        testrail_reporter._add_test_result(project, u"1105", 1, u"Ok", 1)
+        testrail_reporter.flush_results()
+
+        testrail_reporter.testrail_client.create_results.assert_called_once_with(
+            100,
+            [
+                {
+                    u"case_id": 1104,
+                    u"status_id": 5,
+                    u"comment": u"2 results: 1 failed, 1 passed\n\nRow 2",
+                    u"elapsed": u"5s",
+                },
+                {u"case_id": 1105, u"status_id": 1, u"comment": u"Ok", u"elapsed": u"1s"},
+            ],
+        )
+
+    def build_reporter_with_tagged_runs(self):
+        testrail_reporter = self.build_reporter_with_test_runs()
+        testrail_reporter.config[u"test_runs"] = {u"include_all": False}
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_test_run_by_project_and_name.return_value = None
+        testrail_client.create_run.return_value = {u"id": 100, u"include_all": False}
+        testrail_client.update_run.return_value = {u"id": 100, u"include_all": False}
+        project = testrail_reporter.projects[0]
+        project.test_run = None
+        return testrail_reporter, project
+
+    def test_test_runs_without_include_all_only_get_reported_cases(self):
+        testrail_reporter, project = self.build_reporter_with_tagged_runs()
+        testrail_client = testrail_reporter.testrail_client
+
+        testrail_reporter._add_test_result(project, u"1105", status=1)
+        testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter.flush_results()
+        testrail_reporter._add_test_result(project, u"1104", status=5)
+        testrail_reporter._add_test_result(project, u"1106", status=1)
+        testrail_reporter._add_test_result(project, u"1107", status=1)
+        testrail_reporter.flush_results()
+
+        testrail_client.create_run.assert_called_once_with(
+            1, 11, u"Testrail project name", case_ids=[1104, 1105]
+        )
+        testrail_client.update_run.assert_called_once_with(
+            100, [1104, 1105, 1106, 1107]
+        )
+        testrail_client.iter_tests.assert_not_called()
+        self.assertEqual(2, testrail_client.create_results.call_count)
+
+    def test_existing_test_run_without_include_all_gets_missing_cases(self):
+        testrail_reporter, project = self.build_reporter_with_tagged_runs()
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.get_test_run_by_project_and_name.return_value = {
+            u"id": 100,
+            u"include_all": False,
+        }
+        testrail_client.iter_tests.return_value = iter([{u"case_id": 1104}])
+
+        testrail_reporter._add_test_result(project, u"1104", status=1)
+        testrail_reporter._add_test_result(project, u"1105", status=1)
+        testrail_reporter.flush_results()
+
+        testrail_client.create_run.assert_not_called()
+        testrail_client.iter_tests.assert_called_once_with(100)
+        testrail_client.update_run.assert_called_once_with(100, [1104, 1105])
+
+    @mock.patch("behave_testrail_reporter.TestrailReporter._add_test_result")
+    def test_prescanned_cases_are_looked_up_instead_of_the_suites(
+        self, add_test_result_mock
+    ):
+        features_directory = tempfile.mkdtemp()
+        self.addCleanup(partial(shutil.rmtree, features_directory, ignore_errors=True))
+        with open(os.path.join(features_directory, u"login.feature"), u"w") as stream:
+            stream.write(
+                u"Feature: Login\n\n"
+                u"    @testrail-C1104 @smoke\n"
+                u"    Scenario: Admin can login\n"
+                u"        Given I am logged out\n"
+            )
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.testrail_client = Mock(APIClient)
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.iter_cases_by_id.side_effect = lambda case_ids, workers: iter(
+            {u"id": int(case_id), u"suite_id": 11 if case_id == u"1104" else 22}
+            for case_id in case_ids
+        )
+
+        self.assertEqual({u"1104"}, testrail_reporter.prescan([features_directory]))
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104"])
+        )
+        # Tagged in a feature file prescan did not read.
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1105"])
+        )
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1105"])
+        )
+
+        testrail_client.iter_cases.assert_not_called()
+        self.assertEqual(
+            [
+                mock.call([u"1104"], workers=10),
+                mock.call([u"1105"], workers=10),
+            ],
+            testrail_client.iter_cases_by_id.call_args_list,
+        )
+        routed_cases = [
+            (call[1][u"project"].id, call[1][u"case_id"])
+            for call in add_test_result_mock.call_args_list
+        ]
+        self.assertEqual([(1, u"1104"), (2, u"1105"), (2, u"1105")], routed_cases)
+
+    @mock.patch("behave_testrail_reporter.TestrailReporter._add_test_result")
+    def test_prescan_with_many_cases_loads_the_suites(self, add_test_result_mock):
+        testrail_reporter = TestrailReporter(u"master")
+        testrail_reporter.config[u"case_lookup"] = {u"max_cases": 1}
+        testrail_reporter.testrail_client = Mock(APIClient)
+        testrail_client = testrail_reporter.testrail_client
+        testrail_client.iter_cases.side_effect = lambda project_id, suite_id: iter(
+            [{u"id": 1104}]
+        )
+
+        with mock.patch(
+            "behave_testrail_reporter.testrail_reporter.scan_case_ids",
+            return_value={u"1104", u"1105"},
+        ):
+            testrail_reporter.prescan()
+        testrail_reporter.process_scenario(
+            self.build_mock_scenario([u"testrail-C1104"])
+        )
+
+        testrail_client.iter_cases_by_id.assert_not_called()
+        self.assertEqual(2, testrail_client.iter_cases.call_count)
+        self.assertEqual(2, add_test_result_mock.call_count)
+
 
 class TestrailReporterTestLoadConfig(unittest.TestCase):
     def test_config_file_is_not_present(self):
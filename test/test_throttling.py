@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from email.utils import formatdate
+
+from mock import mock
+
+from behave_testrail_reporter.throttling import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    RateLimiter,
+    RetryPolicy,
+)
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_can_retry(self):
+        retry_policy = RetryPolicy(max_retries=2)
+
+        self.assertTrue(retry_policy.can_retry(1))
+        self.assertFalse(retry_policy.can_retry(2))
+
+    def test_delay_is_exponential_with_jitter(self):
+        retry_policy = RetryPolicy(backoff_factor=1, max_backoff=5)
+
+        for attempt, max_delay in ((0, 1), (1, 2), (2, 4), (3, 5), (10, 5)):
+            delay = retry_policy.get_delay(attempt)
+            self.assertTrue(0 <= delay <= max_delay)
+
+    def test_delay_uses_retry_after_seconds(self):
+        retry_policy = RetryPolicy()
+
+        self.assertEqual(30.0, retry_policy.get_delay(0, retry_after=u"30"))
+
+    def test_delay_from_retry_after_is_capped(self):
+        retry_policy = RetryPolicy(max_backoff=60)
+
+        self.assertEqual(60, retry_policy.get_delay(0, retry_after=u"86400"))
+
+    def test_delay_uses_retry_after_date(self):
+        retry_policy = RetryPolicy()
+
+        with mock.patch(
+            "behave_testrail_reporter.throttling.time.time", return_value=1000000000
+        ):
+            retry_after = formatdate(1000000000 + 20, usegmt=True)
+            delay = retry_policy.get_delay(0, retry_after=retry_after)
+
+        self.assertEqual(20.0, delay)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    @mock.patch("behave_testrail_reporter.throttling.time.sleep")
+    @mock.patch("behave_testrail_reporter.throttling.time.time")
+    def test_acquire_waits_when_bucket_is_empty(self, time_mock, sleep_mock):
+        time_mock.return_value = 100.0
+        rate_limiter = RateLimiter(rate=2, burst=2)
+
+        waits = [rate_limiter.acquire() for _ in range(4)]
+
+        self.assertEqual([0.0, 0.0, 0.5, 1.0], waits)
+        self.assertEqual(2, sleep_mock.call_count)
+
+    @mock.patch("behave_testrail_reporter.throttling.time.sleep")
+    @mock.patch("behave_testrail_reporter.throttling.time.time")
+    def test_bucket_refills_over_time(self, time_mock, sleep_mock):
+        time_mock.return_value = 100.0
+        rate_limiter = RateLimiter(rate=1, burst=1)
+        rate_limiter.acquire()
+
+        time_mock.return_value = 101.0
+        self.assertEqual(0.0, rate_limiter.acquire())
+        sleep_mock.assert_not_called()
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    @mock.patch("behave_testrail_reporter.throttling.time.time")
+    def test_opens_after_consecutive_failures(self, time_mock):
+        time_mock.return_value = 100.0
+        circuit_breaker = CircuitBreaker(failure_threshold=2, cool_down=30)
+
+        circuit_breaker.record_failure()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        self.assertEqual(CIRCUIT_CLOSED, circuit_breaker.state)
+        self.assertTrue(circuit_breaker.allow_request())
+
+        circuit_breaker.record_failure()
+        self.assertEqual(CIRCUIT_OPEN, circuit_breaker.state)
+        self.assertFalse(circuit_breaker.allow_request())
+        self.assertEqual(1, circuit_breaker.opened)
+        self.assertEqual(1, circuit_breaker.rejected_requests)
+
+    @mock.patch("behave_testrail_reporter.throttling.time.time")
+    def test_lets_one_request_through_after_cool_down(self, time_mock):
+        time_mock.return_value = 100.0
+        circuit_breaker = CircuitBreaker(failure_threshold=1, cool_down=30)
+        circuit_breaker.record_failure()
+
+        time_mock.return_value = 130.0
+        self.assertTrue(circuit_breaker.allow_request())
+        self.assertEqual(CIRCUIT_HALF_OPEN, circuit_breaker.state)
+        self.assertFalse(circuit_breaker.allow_request())
+
+        circuit_breaker.record_success()
+        self.assertEqual(CIRCUIT_CLOSED, circuit_breaker.state)
+        self.assertTrue(circuit_breaker.allow_request())
+
+    @mock.patch("behave_testrail_reporter.throttling.time.time")
+    def test_failed_trial_request_opens_again(self, time_mock):
+        time_mock.return_value = 100.0
+        circuit_breaker = CircuitBreaker(failure_threshold=3, cool_down=30)
+        for _ in range(3):
+            circuit_breaker.record_failure()
+
+        time_mock.return_value = 130.0
+        circuit_breaker.allow_request()
+        circuit_breaker.record_failure()
+
+        self.assertEqual(CIRCUIT_OPEN, circuit_breaker.state)
+        self.assertEqual(2, circuit_breaker.opened)
+        time_mock.return_value = 159.0
+        self.assertFalse(circuit_breaker.allow_request())
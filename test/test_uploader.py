@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from behave_testrail_reporter.uploader import BackgroundUploader
+
+
+class BackgroundUploaderTestCase(unittest.TestCase):
+    def test_drain_waits_for_all_records(self):
+        processed_records = []
+        uploader = BackgroundUploader(processed_records.append, workers=2)
+
+        for record in range(50):
+            uploader.put(record)
+        pending_records = uploader.drain(timeout=5)
+
+        self.assertEqual(0, pending_records)
+        self.assertEqual(list(range(50)), sorted(processed_records))
+
+    def test_errors_do_not_stop_the_workers(self):
+        processed_records = []
+
+        def process(record):
+            if record == 1:
+                raise ValueError(u"Broken record")
+            processed_records.append(record)
+
+        uploader = BackgroundUploader(process)
+        for record in range(3):
+            uploader.put(record)
+        uploader.drain(timeout=5)
+
+        self.assertEqual([0, 2], processed_records)
+        self.assertEqual(1, len(uploader.errors))
+
+    def test_drain_timeout_returns_pending_records(self):
+        release = threading.Event()
+        uploader = BackgroundUploader(lambda record: release.wait(), queue_size=10)
+
+        for record in range(3):
+            uploader.put(record)
+        pending_records = uploader.drain(timeout=0.1)
+        release.set()
+
+        self.assertEqual(3, pending_records)